@@ -0,0 +1,148 @@
+"""Spending analytics over a user's payment history (NumPy).
+
+SpendingHistory turns a user's payment and bill rows into column arrays once
+(the only per-row Python work); spending_summary() then computes everything
+from the columns with vectorized operations: per-category totals (bincount
+over category codes), a monthly series (bincount over month offsets), the
+on-time ratio (payment day vs bill due date) and the credit-earning rate.
+db.py caches the columns per user, so a repeated summary costs a few
+milliseconds even for 100k payments. The result is a compact, JSON-ready
+summary (API aliases) for dashboards and the frontend analyze step, instead
+of raw rows.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+UNKNOWN_CATEGORY = "unknown"
+
+
+def _days(values: Sequence[Optional[str]]) -> np.ndarray:
+    """datetime64[D] column from ISO dates/timestamps (NaT where missing)."""
+    return np.array([(v or "")[:10] for v in values], dtype="datetime64[D]")
+
+
+def _numbers(values: Sequence[Any], dtype: Any) -> np.ndarray:
+    return np.nan_to_num(np.array(values, dtype=np.float64)).astype(dtype)
+
+
+def _ratio(part: float, whole: float) -> Optional[float]:
+    return round(float(part) / float(whole), 4) if whole else None
+
+
+def _credit_rate(credits: float, paid: float) -> Optional[float]:
+    """Credits earned per 100 paid."""
+    return round(float(credits) * 100.0 / float(paid), 4) if paid else None
+
+
+class SpendingHistory:
+    """Column arrays of one user's payments (joined to their bills) and bills."""
+
+    __slots__ = ("categories", "pay_category", "pay_amount", "pay_credit", "pay_day", "pay_month",
+                 "pay_judged", "pay_on_time", "bill_amount", "bill_due", "bill_paid")
+
+    def __init__(self, payments: List[Dict[str, Any]], bills: List[Dict[str, Any]]):
+        """payments: bill_id, amount_paid, credit_awarded, payment_time/created_at;
+        bills: id, amount, due_date, status, category."""
+        # Category codes; the last code is for payments whose bill is gone
+        self.categories, codes = np.unique(
+            np.array([(b.get("category") or "rent").lower() for b in bills] + [UNKNOWN_CATEGORY]),
+            return_inverse=True,
+        )
+        self.bill_amount = _numbers([b.get("amount") for b in bills], np.float64)
+        self.bill_due = _days([b.get("due_date") for b in bills])
+        self.bill_paid = np.array([(b.get("status") or "").lower() == "paid" for b in bills], dtype=bool)
+
+        bill_index = {b["id"]: i for i, b in enumerate(bills)}
+        # Index len(bills) is a sentinel "no bill" row
+        bill_of = np.array([bill_index.get(p.get("bill_id"), len(bills)) for p in payments], dtype=np.int64)
+        due_with_sentinel = np.append(self.bill_due, np.datetime64("NaT"))
+        self.pay_category = codes[bill_of]
+        self.pay_amount = _numbers([p.get("amount_paid") for p in payments], np.float64)
+        self.pay_credit = _numbers([p.get("credit_awarded") for p in payments], np.int64)
+        self.pay_day = _days([p.get("payment_time") or p.get("created_at") for p in payments])
+        # Months since 1970-01; NaT days map to int64 min, outside any range
+        self.pay_month = self.pay_day.astype("datetime64[M]").astype(np.int64)
+        # Payments whose bill has a due date, and which of them were on time
+        pay_due = due_with_sentinel[bill_of]
+        self.pay_judged = ~np.isnat(pay_due) & ~np.isnat(self.pay_day)
+        self.pay_on_time = self.pay_judged & (self.pay_day <= pay_due)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in self.__slots__)
+
+
+def spending_summary(user_id: str, history: SpendingHistory, months: int = 12,
+                     today: Optional[date] = None) -> Dict[str, Any]:
+    """Totals, per-category split, last `months` months and payment punctuality."""
+    h = history
+    today = today or datetime.utcnow().date()
+    months = max(1, months)
+    n = len(h.pay_amount)
+    total_paid = float(h.pay_amount.sum())
+    total_credit = int(h.pay_credit.sum())
+
+    # ---------- Per category ----------
+    k = len(h.categories)
+    cat_count = np.bincount(h.pay_category, minlength=k)
+    cat_total = np.bincount(h.pay_category, weights=h.pay_amount, minlength=k)
+    cat_credit = np.bincount(h.pay_category, weights=h.pay_credit, minlength=k)
+    by_category = [
+        {
+            "Category": str(h.categories[i]),
+            "Payments": int(cat_count[i]),
+            "TotalPaid": round(float(cat_total[i]), 2),
+            "Share": _ratio(cat_total[i], total_paid),
+            "AveragePayment": round(float(cat_total[i] / cat_count[i]), 2),
+            "Credits": int(cat_credit[i]),
+            "CreditRate": _credit_rate(cat_credit[i], cat_total[i]),
+        }
+        for i in np.argsort(-cat_total, kind="stable") if cat_count[i]
+    ]
+
+    # ---------- Monthly series (last `months` months up to today) ----------
+    last_month = np.datetime64(today, "M").astype(np.int64)
+    first_month = last_month - months + 1
+    in_range = (h.pay_month >= first_month) & (h.pay_month <= last_month)
+    offset = h.pay_month[in_range] - first_month
+    month_count = np.bincount(offset, minlength=months)
+    month_total = np.bincount(offset, weights=h.pay_amount[in_range], minlength=months)
+    month_credit = np.bincount(offset, weights=h.pay_credit[in_range], minlength=months)
+    labels = np.arange(first_month, last_month + 1).astype("datetime64[M]").astype(str)
+    monthly = [
+        {"Month": str(labels[i]), "Payments": int(month_count[i]),
+         "TotalPaid": round(float(month_total[i]), 2), "Credits": int(month_credit[i])}
+        for i in range(months)
+    ]
+    # Least-squares slope of the monthly totals: change in spend per month
+    trend = float(np.polyfit(np.arange(months), month_total, 1)[0]) if months > 1 else 0.0
+
+    # ---------- On-time payments and outstanding bills ----------
+    on_time = int(h.pay_on_time.sum())
+    judged = int(h.pay_judged.sum())
+    unpaid = ~h.bill_paid
+    overdue = unpaid & ~np.isnat(h.bill_due) & (h.bill_due < np.datetime64(today, "D"))
+
+    return {
+        "UserID": user_id,
+        "GeneratedAt": datetime.utcnow().isoformat(),
+        "Payments": n,
+        "TotalPaid": round(total_paid, 2),
+        "AveragePayment": round(total_paid / n, 2) if n else 0.0,
+        "TotalCredits": total_credit,
+        "CreditRate": _credit_rate(total_credit, total_paid),
+        "OnTimePayments": on_time,
+        "LatePayments": judged - on_time,
+        "OnTimeRatio": _ratio(on_time, judged),
+        "UnpaidBills": int(unpaid.sum()),
+        "UnpaidAmount": round(float(h.bill_amount[unpaid].sum()), 2),
+        "OverdueBills": int(overdue.sum()),
+        "OverdueAmount": round(float(h.bill_amount[overdue].sum()), 2),
+        "Categories": by_category,
+        "Monthly": monthly,
+        "MonthlyTrend": round(trend, 2),
+    }
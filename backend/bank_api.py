@@ -1,19 +1,32 @@
 """Bank Card API Router for FastAPI.
 
 Provides endpoints for bank card validation and payment processing.
+
+Each endpoint fetches the card row once and carries it through validation,
+balance check and debit. The number of storage calls a request made is
+returned in the X-Storage-Calls response header (see middleware.py).
+Storage calls go through bank_db_async so the handlers never block the
+event loop. Card rows come from the bank_db card cache, so validating a hot
+card makes no storage call; the debit itself always goes to the database.
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException
 from pydantic import BaseModel
-from typing import Optional
-from bank_db import (
+from typing import Any, Optional
+from bank_db_async import (
     get_bank_card_by_number,
     deduct_balance,
-    get_balance,
     list_bank_cards
 )
+from idempotency import IDEMPOTENCY_HEADER, idempotent
+from locks import AsyncLockManager, LockTimeout
+from pagination import LimitParam, page_response, parse_fields
 
 router = APIRouter(prefix="/api/bank", tags=["Bank"])
 
+# Payments on one card run one at a time (validation through debit), so a
+# burst on one card sees consistent balances; different cards never wait.
+card_locks = AsyncLockManager("bank_card")
+
 
 class CardValidationRequest(BaseModel):
     account_number: str  # 16-digit card number
@@ -46,15 +59,15 @@ class PaymentResponse(BaseModel):
     transaction_id: Optional[str] = None
 
 
-def _validate_card_details(account_number: str, card_holder_name: str, 
-                          cvv: str, expiry_date: str):
+async def _validate_card_details(account_number: str, card_holder_name: str,
+                                 cvv: str, expiry_date: str):
     """
     Internal function to validate card details for online shopping.
     Uses card number (account_number), holder name, CVV, and expiry date.
     Returns (card, error_message) tuple.
     """
     # Get card by card number (using account_number as the 16-digit card number)
-    card = get_bank_card_by_number(account_number)
+    card = await get_bank_card_by_number(account_number)
     
     if not card:
         return None, "Invalid card number."
@@ -91,7 +104,7 @@ async def validate_card(request: CardValidationRequest):
     Returns card details if valid.
     """
     try:
-        card, error = _validate_card_details(
+        card, error = await _validate_card_details(
             request.account_number,
             request.card_holder_name,
             request.cvv,
@@ -122,16 +135,39 @@ async def validate_card(request: CardValidationRequest):
 
 
 @router.post("/process-payment", response_model=PaymentResponse)
-async def process_payment(request: PaymentRequest):
+async def process_payment(request: PaymentRequest,
+                          idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER)):
     """
     Process a payment using bank card details for online shopping.
     This mimics UK online shopping payment processing.
     
     Validates all card information, checks balance, and deducts the amount.
+    Retries that send the same Idempotency-Key get the first successful
+    response back instead of being charged again; a declined attempt can be
+    retried with the same key.
     """
+    return await idempotent(idempotency_key, "bank.process-payment", request,
+                            lambda: _process_payment(request),
+                            should_store=_payment_succeeded)
+
+
+def _payment_succeeded(body: Any) -> bool:
+    """Declined payments (HTTP 200, success=False) are not kept for replay."""
+    return bool(isinstance(body, dict) and body.get("success"))
+
+
+async def _process_payment(request: PaymentRequest) -> PaymentResponse:
+    try:
+        async with card_locks.hold(request.account_number):
+            return await _charge_card(request)
+    except LockTimeout as e:
+        raise HTTPException(status_code=503, detail=f"Card is busy, try again: {e}")
+
+
+async def _charge_card(request: PaymentRequest) -> PaymentResponse:
     try:
         # Validate all card details
-        card, error = _validate_card_details(
+        card, error = await _validate_card_details(
             request.account_number,
             request.card_holder_name,
             request.cvv,
@@ -146,16 +182,20 @@ async def process_payment(request: PaymentRequest):
         
         # Check balance
         current_balance = float(card.get("balance", 0))
-        
+        if current_balance < request.amount:
+            # The cached row may predate a top-up made by another worker
+            card = await get_bank_card_by_number(card["card_number"], fresh=True) or card
+            current_balance = float(card.get("balance", 0))
+
         if current_balance < request.amount:
             return PaymentResponse(
                 success=False,
                 message=f"Insufficient balance. Available: £{current_balance:.2f}, Required: £{request.amount:.2f}"
             )
         
-        # Process payment (deduct balance)
+        # Process payment: one conditional debit, no re-fetch of the validated card
         card_number = card.get("card_number")
-        updated_card = deduct_balance(card_number, request.amount)
+        updated_card = await deduct_balance(card_number, request.amount)
         new_balance = float(updated_card.get("balance", 0))
         
         return PaymentResponse(
@@ -180,14 +220,15 @@ async def check_balance(card_number: str):
     Check the balance of a bank card.
     """
     try:
-        balance = get_balance(card_number)
-        card = get_bank_card_by_number(card_number)
-        
+        card = await get_bank_card_by_number(card_number)
+        if not card:
+            raise ValueError(f"Card {card_number} not found")
+
         return {
             "card_number": card_number,
-            "balance": balance,
-            "card_holder_name": card.get("card_holder_name") if card else None,
-            "bank_name": card.get("bank_name") if card else None,
+            "balance": float(card.get("balance", 0)),
+            "card_holder_name": card.get("card_holder_name"),
+            "bank_name": card.get("bank_name"),
         }
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -195,13 +236,22 @@ async def check_balance(card_number: str):
         raise HTTPException(status_code=500, detail=f"Error checking balance: {str(e)}")
 
 
+CARD_LIST_FIELDS = ["id", "card_number_masked", "card_holder_name", "bank_name", "balance", "status"]
+# Storage columns needed to build the masked card list
+CARD_LIST_COLUMNS = "id, card_number, card_holder_name, bank_name, balance, status"
+
+
 @router.get("/cards")
-async def get_all_cards():
+async def get_all_cards(limit: Optional[int] = LimitParam, after: Optional[str] = None,
+                        fields: Optional[str] = None):
     """
     Get all bank cards (for testing/admin purposes).
+
+    Paged by card id: pass the X-Next-Cursor header value as `after`.
     """
+    selected = parse_fields(fields, CARD_LIST_FIELDS)
     try:
-        cards = list_bank_cards()
+        cards = await list_bank_cards(limit=limit, after=after, columns=CARD_LIST_COLUMNS)
         # Mask card numbers for security
         masked_cards = []
         for card in cards:
@@ -213,6 +263,6 @@ async def get_all_cards():
                 "balance": float(card.get("balance", 0)),
                 "status": card.get("status")
             })
-        return masked_cards
+        return page_response(masked_cards, "id", limit, selected)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching cards: {str(e)}")
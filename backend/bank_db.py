@@ -1,17 +1,31 @@
 """UK Bank Card Database System.
 
 Simple banking system to store UK payment card information.
-Uses a separate Supabase instance for bank data.
+Uses a separate Supabase instance for bank data, or an embedded SQLite
+database when BANK_STORAGE_BACKEND=sqlite (see storage.py).
 """
 from __future__ import annotations
 
 import os
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, List, Optional
 
 from dotenv import load_dotenv
 from pathlib import Path
-from supabase import create_client, Client
+from postgrest.types import CountMethod, ReturnMethod
+from supabase import Client
+
+from cache import VersionedCache
+from metrics import register_cache
+from storage import (
+    BACKEND_SUPABASE,
+    BANK_STORAGE_BACKEND,
+    BANK_SQLITE_PATH,
+    StorageOp,
+    create_async_storage_client,
+    create_storage_client,
+    run_sync,
+)
 
 # Load environment variables
 HERE = Path(__file__).resolve().parent
@@ -35,17 +49,69 @@ def get_bank_client() -> Client:
     """Get or create Supabase client for bank database."""
     global _bank_client
     if _bank_client is None:
-        if _MISSING_ENV:
+        if BANK_STORAGE_BACKEND == BACKEND_SUPABASE and _MISSING_ENV:
             raise RuntimeError(
                 "Missing Bank Supabase configuration: set BANK_SUPABASE_URL and BANK_SUPABASE_KEY in .env"
             )
-        _bank_client = create_client(BANK_SUPABASE_URL, BANK_SUPABASE_KEY)
+        _bank_client = create_storage_client(
+            BANK_STORAGE_BACKEND,
+            url=BANK_SUPABASE_URL,
+            key=BANK_SUPABASE_KEY,
+            sqlite_path=BANK_SQLITE_PATH,
+        )
     return _bank_client
 
 
+_async_bank_client: Optional[Any] = None
+
+async def get_async_bank_client() -> Any:
+    """Shared async client for the bank database (used by bank_db_async.py)."""
+    global _async_bank_client
+    if _async_bank_client is None:
+        if BANK_STORAGE_BACKEND == BACKEND_SUPABASE and _MISSING_ENV:
+            raise RuntimeError(
+                "Missing Bank Supabase configuration: set BANK_SUPABASE_URL and BANK_SUPABASE_KEY in .env"
+            )
+        client = await create_async_storage_client(
+            BANK_STORAGE_BACKEND,
+            url=BANK_SUPABASE_URL,
+            key=BANK_SUPABASE_KEY,
+            sqlite_path=BANK_SQLITE_PATH,
+        )
+        if _async_bank_client is None:
+            _async_bank_client = client
+    return _async_bank_client
+
+
 # Table name
 T_BANK_CARDS = "bank_cards"
 
+# Card rows by card number (bounded LRU). Every balance change writes the
+# returned row through, and rows carry a version (migration 011) so an older
+# copy never replaces a newer one: a worker never serves a balance older than
+# its own last write. Rows other workers update are dropped by
+# revalidate_card_cache (every BANK_CARD_CACHE_REVALIDATE_SECONDS, main.py)
+# and in any case expire after BANK_CARD_CACHE_TTL seconds.
+_card_cache = register_cache(VersionedCache(
+    maxsize=int(os.getenv("BANK_CARD_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("BANK_CARD_CACHE_TTL", "60")),
+    name="bank_cards",
+))
+BANK_CARD_CACHE_REVALIDATE_SECONDS = float(os.getenv("BANK_CARD_CACHE_REVALIDATE_SECONDS", "1"))
+
+# Card numbers per version query when revalidating
+_REVALIDATE_CHUNK = 500
+
+
+def _cache_card(card: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if card and card.get("card_number"):
+        _card_cache.put(card["card_number"], card)
+    return card
+
+
+def card_cache_stats() -> Dict[str, Any]:
+    return _card_cache.stats()
+
 
 def create_bank_card(
     card_number: str,
@@ -70,7 +136,22 @@ def create_bank_card(
     Returns:
         Created bank card record
     """
-    sb = get_bank_client()
+    return run_sync(create_bank_card_op(
+        get_bank_client(), card_number, card_holder_name, sort_code, account_number,
+        balance=balance, bank_name=bank_name, card_type=card_type,
+    ))
+
+
+def create_bank_card_op(
+    sb: Client,
+    card_number: str,
+    card_holder_name: str,
+    sort_code: str,
+    account_number: str,
+    balance: float = 1000.00,
+    bank_name: str = "UK Bank",
+    card_type: str = "Debit"
+) -> StorageOp[Dict[str, Any]]:
     now = datetime.utcnow().isoformat()
     
     payload = {
@@ -87,96 +168,230 @@ def create_bank_card(
         "updated_at": now,
     }
     
-    res = sb.table(T_BANK_CARDS).insert(payload).execute()
+    res = yield sb.table(T_BANK_CARDS).insert(payload)
     return res.data[0] if res.data else {}
 
 
+# Rows per multi-row INSERT when seeding cards
+BANK_SEED_BATCH = int(os.getenv("BANK_SEED_BATCH", "1000"))
+
+
+def create_bank_cards(cards: Iterable[Dict[str, Any]], batch_size: Optional[int] = None) -> int:
+    """Bulk-insert cards, BANK_SEED_BATCH rows per statement.
+
+    Each card has the create_bank_card fields. The iterable is consumed one
+    batch at a time, so generated card streams stay flat in memory. Cards whose
+    number already exists are skipped. Returns the number of rows sent.
+    """
+    return run_sync(create_bank_cards_op(get_bank_client(), cards, batch_size=batch_size))
+
+
+def create_bank_cards_op(sb: Client, cards: Iterable[Dict[str, Any]],
+                         batch_size: Optional[int] = None) -> StorageOp[int]:
+    batch_size = batch_size or BANK_SEED_BATCH
+    now = datetime.utcnow().isoformat()
+    sent = 0
+    batch: List[Dict[str, Any]] = []
+    for card in cards:
+        batch.append({
+            "card_number": card["card_number"],
+            "card_holder_name": card["card_holder_name"],
+            "sort_code": card["sort_code"],
+            "account_number": card["account_number"],
+            "balance": float(card.get("balance", 1000.00)),
+            "currency": "GBP",
+            "bank_name": card.get("bank_name", "UK Bank"),
+            "card_type": card.get("card_type", "Debit"),
+            "status": "active",
+            "created_at": now,
+            "updated_at": now,
+        })
+        if len(batch) >= batch_size:
+            yield sb.table(T_BANK_CARDS).upsert(
+                batch, on_conflict="card_number", ignore_duplicates=True, returning=ReturnMethod.minimal,
+            )
+            sent += len(batch)
+            batch = []
+    if batch:
+        yield sb.table(T_BANK_CARDS).upsert(
+            batch, on_conflict="card_number", ignore_duplicates=True, returning=ReturnMethod.minimal,
+        )
+        sent += len(batch)
+    return sent
+
+
+def get_card_stats() -> Dict[str, Any]:
+    """Card count and total balance from one aggregate query (bank_card_stats)."""
+    return run_sync(get_card_stats_op(get_bank_client()))
+
+
+def get_card_stats_op(sb: Client) -> StorageOp[Dict[str, Any]]:
+    res = yield sb.rpc("bank_card_stats", {})
+    row = res.data[0] if isinstance(res.data, list) and res.data else (res.data or {})
+    return {
+        "card_count": int(row.get("card_count") or 0),
+        "total_balance": float(row.get("total_balance") or 0),
+    }
+
+
 def get_bank_card(card_id: str) -> Optional[Dict[str, Any]]:
     """Get a bank card by ID."""
-    sb = get_bank_client()
-    res = sb.table(T_BANK_CARDS).select("*").eq("id", card_id).execute()
-    return res.data[0] if res.data else None
+    return run_sync(get_bank_card_op(get_bank_client(), card_id))
 
 
-def get_bank_card_by_number(card_number: str) -> Optional[Dict[str, Any]]:
-    """Get a bank card by card number."""
-    sb = get_bank_client()
-    res = sb.table(T_BANK_CARDS).select("*").eq("card_number", card_number).execute()
+def get_bank_card_op(sb: Client, card_id: str) -> StorageOp[Optional[Dict[str, Any]]]:
+    res = yield sb.table(T_BANK_CARDS).select("*").eq("id", card_id)
     return res.data[0] if res.data else None
 
 
-def list_bank_cards() -> List[Dict[str, Any]]:
-    """List all bank cards."""
-    sb = get_bank_client()
-    res = sb.table(T_BANK_CARDS).select("*").order("created_at").execute()
+def get_bank_card_by_number(card_number: str, fresh: bool = False) -> Optional[Dict[str, Any]]:
+    """Get a bank card by card number.
+
+    Served from the card cache when possible; `fresh` reads the database (and
+    refreshes the cache).
+    """
+    return run_sync(get_bank_card_by_number_op(get_bank_client(), card_number, fresh=fresh))
+
+
+def get_bank_card_by_number_op(sb: Client, card_number: str,
+                               fresh: bool = False) -> StorageOp[Optional[Dict[str, Any]]]:
+    if not fresh:
+        cached = _card_cache.get(card_number)
+        if cached is not None:
+            return dict(cached)
+    res = yield sb.table(T_BANK_CARDS).select("*").eq("card_number", card_number)
+    card = res.data[0] if res.data else None
+    if card is None:
+        _card_cache.invalidate(card_number)
+    return dict(_cache_card(card)) if card else None
+
+
+def list_bank_cards(limit: Optional[int] = None, after: Optional[str] = None,
+                    columns: str = "*") -> List[Dict[str, Any]]:
+    """List bank cards.
+
+    Ordered by id; `after` is a keyset cursor (last id seen) and `limit` bounds
+    the page. `columns` projects the selected fields.
+    """
+    return run_sync(list_bank_cards_op(get_bank_client(), limit=limit, after=after, columns=columns))
+
+
+def list_bank_cards_op(sb: Client, limit: Optional[int] = None, after: Optional[str] = None,
+                       columns: str = "*") -> StorageOp[List[Dict[str, Any]]]:
+    q = sb.table(T_BANK_CARDS).select(columns)
+    if after is not None:
+        q = q.gt("id", after)
+    q = q.order("id")
+    if limit is not None:
+        q = q.limit(limit)
+    res = yield q
     return res.data or []
 
 
 def update_balance(card_number: str, new_balance: float) -> Dict[str, Any]:
     """Update the balance of a bank card."""
-    sb = get_bank_client()
-    now = datetime.utcnow().isoformat()
-    
-    res = sb.table(T_BANK_CARDS).update({
-        "balance": float(new_balance),
-        "updated_at": now,
-    }).eq("card_number", card_number).execute()
-    
-    return res.data[0] if res.data else {}
+    return run_sync(update_balance_op(get_bank_client(), card_number, new_balance))
+
+
+def update_balance_op(sb: Client, card_number: str, new_balance: float) -> StorageOp[Dict[str, Any]]:
+    # set_card_balance bumps the row version (migration 011)
+    res = yield sb.rpc("set_card_balance", {"p_card_number": card_number, "p_balance": float(new_balance)})
+    if not res.data:
+        _card_cache.invalidate(card_number)
+        return {}
+    return dict(_cache_card(res.data[0]))
 
 
 def deduct_balance(card_number: str, amount: float) -> Dict[str, Any]:
     """Deduct an amount from a bank card balance.
-    
+
+    Runs as one conditional update (debit_card: balance = balance - amount
+    WHERE balance >= amount), so concurrent debits on the same card can never
+    overdraw it or overwrite each other, and a successful debit is one round trip.
+
     Args:
         card_number: Card number to deduct from
         amount: Amount to deduct
-    
+
     Returns:
         Updated bank card record
-    
+
     Raises:
-        ValueError: If insufficient balance
+        ValueError: If the card does not exist or has insufficient balance
     """
-    card = get_bank_card_by_number(card_number)
+    return run_sync(deduct_balance_op(get_bank_client(), card_number, amount))
+
+
+def deduct_balance_op(sb: Client, card_number: str, amount: float) -> StorageOp[Dict[str, Any]]:
+    res = yield sb.rpc("debit_card", {"p_card_number": card_number, "p_amount": float(amount)})
+    if res.data:
+        return dict(_cache_card(res.data[0]))
+
+    # No row updated: look the card up only to explain why
+    card = yield from get_bank_card_by_number_op(sb, card_number, fresh=True)
     if not card:
         raise ValueError(f"Card {card_number} not found")
-    
     current_balance = float(card.get("balance", 0))
-    if current_balance < amount:
-        raise ValueError(
-            f"Insufficient balance. Current: £{current_balance:.2f}, Required: £{amount:.2f}"
-        )
-    
-    new_balance = current_balance - amount
-    return update_balance(card_number, new_balance)
+    raise ValueError(
+        f"Insufficient balance. Current: £{current_balance:.2f}, Required: £{amount:.2f}"
+    )
 
 
 def add_balance(card_number: str, amount: float) -> Dict[str, Any]:
-    """Add an amount to a bank card balance."""
-    card = get_bank_card_by_number(card_number)
-    if not card:
+    """Add an amount to a bank card balance (single atomic increment)."""
+    return run_sync(add_balance_op(get_bank_client(), card_number, amount))
+
+
+def add_balance_op(sb: Client, card_number: str, amount: float) -> StorageOp[Dict[str, Any]]:
+    res = yield sb.rpc("credit_card", {"p_card_number": card_number, "p_amount": float(amount)})
+    if not res.data:
+        _card_cache.invalidate(card_number)
         raise ValueError(f"Card {card_number} not found")
-    
-    current_balance = float(card.get("balance", 0))
-    new_balance = current_balance + amount
-    return update_balance(card_number, new_balance)
+    return dict(_cache_card(res.data[0]))
 
 
 def get_balance(card_number: str) -> float:
     """Get the current balance of a bank card."""
-    card = get_bank_card_by_number(card_number)
+    return run_sync(get_balance_op(get_bank_client(), card_number))
+
+
+def get_balance_op(sb: Client, card_number: str) -> StorageOp[float]:
+    card = yield from get_bank_card_by_number_op(sb, card_number)
     if not card:
         raise ValueError(f"Card {card_number} not found")
     return float(card.get("balance", 0))
 
 
+def revalidate_card_cache() -> int:
+    """Drop cached cards another worker has updated or deleted; returns how many."""
+    return run_sync(revalidate_card_cache_op(get_bank_client()))
+
+
+def revalidate_card_cache_op(sb: Client) -> StorageOp[int]:
+    numbers = _card_cache.keys()
+    dropped = 0
+    for i in range(0, len(numbers), _REVALIDATE_CHUNK):
+        chunk = numbers[i:i + _REVALIDATE_CHUNK]
+        res = yield sb.table(T_BANK_CARDS).select("card_number, version").in_("card_number", chunk)
+        versions = {r["card_number"]: int(r.get("version") or 0) for r in (res.data or [])}
+        for number in chunk:
+            dropped += _card_cache.drop_older(number, versions.get(number))
+    return dropped
+
+
 def delete_all_cards() -> Dict[str, Any]:
     """Delete all bank cards (for testing/reset purposes)."""
-    sb = get_bank_client()
+    return run_sync(delete_all_cards_op(get_bank_client()))
+
+
+def delete_all_cards_op(sb: Client) -> StorageOp[Dict[str, Any]]:
     try:
         # Delete all records
-        res = sb.table(T_BANK_CARDS).delete().neq("id", "00000000-0000-0000-0000-000000000000").execute()
-        return {"status": "ok", "deleted": len(res.data) if res.data else 0}
+        # Count server-side instead of returning every deleted row
+        res = yield sb.table(T_BANK_CARDS).delete(
+            count=CountMethod.exact, returning=ReturnMethod.minimal,
+        ).neq("id", "00000000-0000-0000-0000-000000000000")
+        _card_cache.clear()
+        return {"status": "ok", "deleted": res.count or 0}
     except Exception as e:
         return {"status": "error", "message": str(e)}
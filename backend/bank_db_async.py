@@ -0,0 +1,67 @@
+"""Async variants of the bank_db.py operations (used by bank_api.py).
+
+Each function runs the shared bank_db.<name>_op generator on the async bank
+client, so the async bank endpoints no longer block the event loop.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional
+
+import bank_db
+from storage import run_async
+
+
+async def create_bank_card(
+    card_number: str,
+    card_holder_name: str,
+    sort_code: str,
+    account_number: str,
+    balance: float = 1000.00,
+    bank_name: str = "UK Bank",
+    card_type: str = "Debit"
+) -> Dict[str, Any]:
+    return await run_async(bank_db.create_bank_card_op(
+        await bank_db.get_async_bank_client(), card_number, card_holder_name, sort_code,
+        account_number, balance=balance, bank_name=bank_name, card_type=card_type,
+    ))
+
+
+async def get_bank_card(card_id: str) -> Optional[Dict[str, Any]]:
+    return await run_async(bank_db.get_bank_card_op(await bank_db.get_async_bank_client(), card_id))
+
+
+async def get_bank_card_by_number(card_number: str, fresh: bool = False) -> Optional[Dict[str, Any]]:
+    return await run_async(bank_db.get_bank_card_by_number_op(
+        await bank_db.get_async_bank_client(), card_number, fresh=fresh,
+    ))
+
+
+async def list_bank_cards(limit: Optional[int] = None, after: Optional[str] = None,
+                          columns: str = "*") -> List[Dict[str, Any]]:
+    return await run_async(bank_db.list_bank_cards_op(
+        await bank_db.get_async_bank_client(), limit=limit, after=after, columns=columns,
+    ))
+
+
+async def update_balance(card_number: str, new_balance: float) -> Dict[str, Any]:
+    return await run_async(bank_db.update_balance_op(await bank_db.get_async_bank_client(), card_number, new_balance))
+
+
+async def deduct_balance(card_number: str, amount: float) -> Dict[str, Any]:
+    return await run_async(bank_db.deduct_balance_op(await bank_db.get_async_bank_client(), card_number, amount))
+
+
+async def add_balance(card_number: str, amount: float) -> Dict[str, Any]:
+    return await run_async(bank_db.add_balance_op(await bank_db.get_async_bank_client(), card_number, amount))
+
+
+async def get_balance(card_number: str) -> float:
+    return await run_async(bank_db.get_balance_op(await bank_db.get_async_bank_client(), card_number))
+
+
+async def delete_all_cards() -> Dict[str, Any]:
+    return await run_async(bank_db.delete_all_cards_op(await bank_db.get_async_bank_client()))
+
+
+async def revalidate_card_cache() -> int:
+    return await run_async(bank_db.revalidate_card_cache_op(await bank_db.get_async_bank_client()))
@@ -0,0 +1,333 @@
+"""HTTP load test and latency benchmark for the FastAPI app.
+
+Boots main.app in-process against a throwaway SQLite database (see
+storage.py), seeds users, credits, a reward and bank cards, then drives a
+mixed workload through the real HTTP stack (httpx ASGI transport):
+
+- checkout:    POST /api/bank/process-payment
+- billpay:     POST /api/reward/bills, then POST /api/reward/payments
+- redeem:      POST /api/reward/redemptions
+- leaderboard: GET  /api/reward/leaderboard
+- flashsale:   POST /api/reward/redemptions of one item with --flash-stock
+               units; every user races for it. Once it sells out the
+               remaining attempts answer 409. After the run the sale is
+               audited: units sold + units left must equal the starting stock.
+
+Per route it reports throughput and p50/p95/p99 latency, optionally saves the
+results as a JSON baseline, and compares against a previous baseline (exit
+status 1 when a route's p95 regressed by more than --max-regression).
+
+    python benchmark.py --requests 5000 --concurrency 32 --out baseline.json
+    python benchmark.py --requests 5000 --concurrency 32 --baseline baseline.json
+    python benchmark.py --mix flashsale=1 --flash-stock 2000 --concurrency 64
+
+Client and app share one event loop, so latencies include client overhead;
+compare runs made on the same machine with the same settings.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+WORKLOADS = ("checkout", "billpay", "redeem", "leaderboard", "flashsale")
+DEFAULT_MIX = "checkout=4,billpay=3,redeem=2,leaderboard=5"
+
+CARD_BALANCE = 1_000_000_000.0
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    weights: Dict[str, int] = {}
+    for part in mix.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in WORKLOADS:
+            raise SystemExit(f"Unknown workload {name!r}; expected one of {', '.join(WORKLOADS)}")
+        weights[name] = int(weight or 1)
+    if not any(weights.values()):
+        raise SystemExit("--mix needs at least one workload with a positive weight")
+    return weights
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(samples: List[Tuple[float, int]], wall_seconds: float) -> Dict[str, Any]:
+    latencies = sorted(ms for ms, _ in samples)
+    errors = sum(1 for _, status in samples if status >= 400)
+    return {
+        "count": len(samples),
+        "errors": errors,
+        "throughput_rps": round(len(samples) / wall_seconds, 1) if wall_seconds else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(latencies[-1], 3) if latencies else 0.0,
+    }
+
+
+# ---------- Fixture data ----------
+
+class Fixtures:
+    def __init__(self) -> None:
+        self.user_ids: List[str] = []
+        self.reward_id: str = ""
+        self.flash_reward_id: str = ""
+        self.cards: List[Dict[str, Any]] = []
+
+
+def seed(users: int, cards: int, seed_value: int, flash_stock: int = 0) -> Fixtures:
+    """Users with plenty of credits, cheap rewards and funded bank cards."""
+    import bank_db
+    import db
+    from init_bank_cards import generate_uk_cards
+
+    fx = Fixtures()
+    for i in range(users):
+        user_id = str(uuid.uuid4())
+        db.init_user(user_id, f"bench{i}@example.com", f"Bench User {i}")
+        bill = db.create_bill(user_id, "Seed credits", 1_000_000.0, date.today(), "rent")
+        db.create_payment(bill["BillID"], 1_000_000.0, "card")
+        fx.user_ids.append(user_id)
+    fx.reward_id = db.create_reward("Benchmark voucher", 1, "1-credit reward")["RewardID"]
+    fx.flash_reward_id = db.create_reward("Flash sale gift card", 1, "limited stock",
+                                          stock=flash_stock)["RewardID"]
+
+    generated = list(generate_uk_cards(cards, seed=seed_value))
+    bank_db.create_bank_cards({**c, "balance": CARD_BALANCE} for c in generated)
+    fx.cards = generated
+    return fx
+
+
+# ---------- Workloads ----------
+
+Sample = Tuple[str, float, int]  # (route, latency ms, status)
+
+
+async def _timed(client: Any, method: str, url: str, route: str, **kwargs: Any) -> Tuple[Sample, Any]:
+    start = time.perf_counter()
+    response = await client.request(method, url, **kwargs)
+    return (route, (time.perf_counter() - start) * 1000.0, response.status_code), response
+
+
+async def run_workload(name: str, client: Any, fx: Fixtures, rng: random.Random) -> List[Sample]:
+    if name == "checkout":
+        card = rng.choice(fx.cards)
+        sample, _ = await _timed(client, "POST", "/api/bank/process-payment", "POST /api/bank/process-payment", json={
+            "account_number": card["card_number"],
+            "card_holder_name": card["card_holder_name"],
+            "cvv": card["card_number"][-3:],
+            "expiry_date": "12/28",
+            "amount": round(rng.uniform(1, 200), 2),
+        })
+        return [sample]
+    if name == "billpay":
+        user_id = rng.choice(fx.user_ids)
+        amount = round(rng.uniform(10, 2000), 2)
+        created, response = await _timed(client, "POST", "/api/reward/bills", "POST /api/reward/bills", json={
+            "UserID": user_id,
+            "Title": "Benchmark bill",
+            "Amount": amount,
+            "DueDate": date.today().isoformat(),
+            "Category": rng.choice(["rent", "utility", "subscription"]),
+        })
+        if created[2] >= 400:
+            return [created]
+        paid, _ = await _timed(client, "POST", "/api/reward/payments", "POST /api/reward/payments", json={
+            "BillID": response.json()["BillID"],
+            "AmountPaid": amount,
+            "PaymentMethod": "card",
+        })
+        return [created, paid]
+    if name == "redeem":
+        sample, _ = await _timed(client, "POST", "/api/reward/redemptions", "POST /api/reward/redemptions", json={
+            "UserID": rng.choice(fx.user_ids),
+            "RewardID": fx.reward_id,
+        })
+        return [sample]
+    if name == "flashsale":
+        sample, _ = await _timed(client, "POST", "/api/reward/redemptions", "POST /api/reward/redemptions (flash)",
+                                 json={"UserID": rng.choice(fx.user_ids), "RewardID": fx.flash_reward_id})
+        return [sample]
+    sample, _ = await _timed(client, "GET", "/api/reward/leaderboard", "GET /api/reward/leaderboard",
+                             params={"limit": 10})
+    return [sample]
+
+
+async def drive(app: Any, fx: Fixtures, mix: Dict[str, int], total: int, concurrency: int,
+                warmup: int, seed_value: int) -> Tuple[List[Sample], float]:
+    import httpx
+
+    names = [n for n in mix if mix[n] > 0]
+    weights = [mix[n] for n in names]
+    rng = random.Random(seed_value)
+    plan = rng.choices(names, weights=weights, k=warmup + total)
+    samples: List[Sample] = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60.0) as client:
+        for name in plan[:warmup]:
+            await run_workload(name, client, fx, rng)
+
+        queue = iter(plan[warmup:])
+
+        async def worker(worker_id: int) -> None:
+            worker_rng = random.Random(seed_value * 1000 + worker_id)
+            for name in queue:
+                samples.extend(await run_workload(name, client, fx, worker_rng))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        wall = time.perf_counter() - start
+    return samples, wall
+
+
+def build_report(samples: List[Sample], wall: float, config: Dict[str, Any]) -> Dict[str, Any]:
+    by_route: Dict[str, List[Tuple[float, int]]] = {}
+    for route, ms, status in samples:
+        by_route.setdefault(route, []).append((ms, status))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(),
+            "git_commit": commit,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "wall_seconds": round(wall, 3),
+            **config,
+        },
+        "routes": {route: summarize(values, wall) for route, values in sorted(by_route.items())},
+        "total": summarize([(ms, status) for _, ms, status in samples], wall),
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"{'route':36} {'count':>7} {'err':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    print("-" * 86)
+    rows = list(report["routes"].items()) + [("TOTAL", report["total"])]
+    for route, s in rows:
+        print(f"{route:36} {s['count']:>7} {s['errors']:>5} {s['throughput_rps']:>8.1f} "
+              f"{s['p50_ms']:>8.2f} {s['p95_ms']:>8.2f} {s['p99_ms']:>8.2f}")
+    print("(latencies in ms)")
+    sale = report.get("flash_sale")
+    if sale:
+        verdict = "ok" if sale["consistent"] else "OVERSOLD / LOST STOCK"
+        print(f"\nflash sale: {sale['sold']} sold + {sale['left']} left of {sale['stock']} units ({verdict})")
+
+
+def audit_flash_sale(fx: Fixtures, stock: int) -> Dict[str, Any]:
+    """Units sold and left of the flash sale item (after returning reserved tokens)."""
+    import db
+
+    db.release_stock_tokens()
+    sb = db.get_client()
+    item_id = int(fx.flash_reward_id)
+    left = sb.table("credit_shop").select("stock").eq("shop_item_id", item_id).execute().data[0]["stock"]
+    sold = len(sb.table("redemptions").select("id").eq("description", f"shop_item:{item_id}").execute().data)
+    return {"stock": stock, "sold": sold, "left": int(left), "consistent": sold + int(left) == stock and left >= 0}
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> bool:
+    """Print p95 changes against a baseline; True when no route regressed."""
+    ok = True
+    print(f"\n{'route':36} {'base p95':>9} {'p95':>9} {'change':>8}")
+    print("-" * 66)
+    for route, s in report["routes"].items():
+        base = baseline.get("routes", {}).get(route)
+        if not base or not base.get("p95_ms"):
+            print(f"{route:36} {'-':>9} {s['p95_ms']:>9.2f} {'new':>8}")
+            continue
+        change = s["p95_ms"] / base["p95_ms"] - 1.0
+        flag = ""
+        if change > max_regression:
+            ok = False
+            flag = "  REGRESSION"
+        print(f"{route:36} {base['p95_ms']:>9.2f} {s['p95_ms']:>9.2f} {change:>+8.1%}{flag}")
+    return ok
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load-test the API in-process against SQLite")
+    parser.add_argument("--requests", type=int, default=2000, help="workload operations to run")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--warmup", type=int, default=50, help="unrecorded operations first")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"workload weights (default {DEFAULT_MIX})")
+    parser.add_argument("--users", type=int, default=50, help="seeded reward users")
+    parser.add_argument("--cards", type=int, default=1000, help="seeded bank cards")
+    parser.add_argument("--flash-stock", type=int, default=1000, help="units of the flash sale item")
+    parser.add_argument("--seed", type=int, default=0, help="RNG seed for data and workload order")
+    parser.add_argument("--sqlite-path", help="database file (default: a new temp file)")
+    parser.add_argument("--out", help="write the JSON report here")
+    parser.add_argument("--baseline", help="compare against this JSON report")
+    parser.add_argument("--max-regression", type=float, default=0.20,
+                        help="allowed p95 increase per route vs baseline (default 0.20)")
+    args = parser.parse_args(argv)
+    mix = parse_mix(args.mix)
+
+    # Storage is chosen at import time, so configure it before importing the app
+    path = args.sqlite_path or os.path.join(tempfile.mkdtemp(prefix="guhack-bench-"), "bench.db")
+    os.environ["STORAGE_BACKEND"] = "sqlite"
+    os.environ["BANK_STORAGE_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = path
+    os.environ["BANK_SQLITE_PATH"] = path
+
+    from main import app
+
+    print(f"🌱 Seeding {args.users} users and {args.cards} cards into {path} ...")
+    fx = seed(args.users, args.cards, args.seed, args.flash_stock)
+    print(f"🚀 Running {args.requests} operations at concurrency {args.concurrency} ({args.mix})")
+    samples, wall = asyncio.run(drive(app, fx, mix, args.requests, args.concurrency,
+                                      args.warmup, args.seed))
+    report = build_report(samples, wall, {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "warmup": args.warmup,
+        "mix": mix,
+        "users": args.users,
+        "cards": args.cards,
+        "seed": args.seed,
+        "flash_stock": args.flash_stock,
+        "storage": "sqlite",
+    })
+    if mix.get("flashsale"):
+        report["flash_sale"] = audit_flash_sale(fx, args.flash_stock)
+    print_report(report)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Saved report to {args.out}")
+    if report.get("flash_sale") and not report["flash_sale"]["consistent"]:
+        return 1
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.max_regression):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""Small in-process caches used in front of the storage layer."""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire after `ttl` seconds.
+
+    Thread-safe; keeps hit/miss counters for diagnostics and metrics.
+    A ttl of 0 disables caching (every get is a miss, set is a no-op).
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, name: str = "cache"):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else None,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+            }
+
+
+class VersionedCache(TTLCache):
+    """TTLCache of rows that carry a monotonically increasing `version` column.
+
+    put() never replaces a cached row with an older version, so a read that
+    raced a write cannot put the pre-write row back over the written one.
+    drop_older() is the cross-worker check: given versions read from the
+    database, it drops entries another process has since updated.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, name: str = "cache",
+                 version_field: str = "version"):
+        super().__init__(maxsize=maxsize, ttl=ttl, name=name)
+        self.version_field = version_field
+        self.stale_drops = 0
+
+    def _version(self, row: Any) -> int:
+        return int((row or {}).get(self.version_field) or 0)
+
+    def put(self, key: Hashable, row: Dict[str, Any]) -> None:
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self._version(entry[1]) > self._version(row):
+                return
+            self._data[key] = (time.monotonic() + self.ttl, row)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def keys(self) -> List[Hashable]:
+        with self._lock:
+            return list(self._data)
+
+    def drop_older(self, key: Hashable, version: Optional[int]) -> bool:
+        """Drop the entry if it is older than `version` (None: the row is gone)."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False
+            if version is not None and self._version(entry[1]) >= version:
+                return False
+            del self._data[key]
+            self.stale_drops += 1
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        out = super().stats()
+        out["stale_drops"] = self.stale_drops
+        return out
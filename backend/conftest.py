@@ -0,0 +1,55 @@
+"""pytest setup: run the backend against a throwaway SQLite database.
+
+The storage backend is chosen when storage.py is imported, so the
+environment is set here, before any test module imports db/bank_db/main.
+"""
+import os
+import tempfile
+
+import pytest
+
+_TMP = tempfile.mkdtemp(prefix="guhack-test-")
+os.environ["STORAGE_BACKEND"] = "sqlite"
+os.environ["BANK_STORAGE_BACKEND"] = "sqlite"
+os.environ["SQLITE_PATH"] = os.path.join(_TMP, "test.db")
+os.environ["BANK_SQLITE_PATH"] = os.path.join(_TMP, "test.db")
+os.environ["CREDIT_LOG_SPOOL_DIR"] = os.path.join(_TMP, "spool")
+
+
+@pytest.fixture(scope="session")
+def client():
+    """TestClient for the whole app, with its startup/shutdown tasks running."""
+    from fastapi.testclient import TestClient
+
+    from main import app
+
+    with TestClient(app) as c:
+        yield c
+
+
+@pytest.fixture
+def new_bill():
+    """Factory: a fresh user with one unpaid rent bill of `amount`."""
+    import uuid
+    from datetime import date, timedelta
+
+    import db
+
+    def make(amount: float = 1000.0, name: str = "payer") -> dict:
+        user = db.create_user(name, f"{uuid.uuid4().hex}@example.com")
+        return db.create_bill(user["UserID"], "Rent", amount, date.today() + timedelta(days=7), "rent")
+
+    return make
+
+
+@pytest.fixture
+def funded_user(new_bill):
+    """Factory: a fresh user who has paid one bill of `amount` (5% back in credits)."""
+    import db
+
+    def make(amount: float = 1000.0, name: str = "payer") -> dict:
+        bill = new_bill(amount, name)
+        db.create_payment(bill["BillID"], amount, "card")
+        return db.get_user(bill["UserID"])
+
+    return make
@@ -5,16 +5,42 @@ We try multiple .env locations to be robust regardless of working directory:
 - backend/.env (next to this file)
 - repo root .env (parent of backend)
 Provides typed helpers that map DB rows <-> API shapes expected by reward.py.
+
+The storage backend is configurable (STORAGE_BACKEND=supabase|sqlite, see
+storage.py); with "sqlite" no Supabase credentials are needed.
 """
 from __future__ import annotations
 
 import os
-from datetime import datetime, date
-from typing import Any, Dict, List, Optional
+from datetime import datetime, date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
 
 from dotenv import load_dotenv
 from pathlib import Path
-from supabase import create_client, Client
+from supabase import Client
+
+import atexit
+
+from postgrest.types import ReturnMethod
+
+from cache import TTLCache
+from leaderboard import LeaderboardEngine
+from metrics import register_cache, register_queue
+from storage import (
+    BACKEND_SUPABASE,
+    BlockingCall,
+    STORAGE_BACKEND,
+    SQLITE_PATH,
+    StorageOp,
+    create_async_storage_client,
+    create_storage_client,
+    run_sync,
+)
+from locks import LockManager
+from analytics import SpendingHistory, spending_summary
+from reservations import StockTokens
+from reward_rules import RateTable, RewardRules
+from writebehind import WriteBehindQueue
 
 # Load env once from multiple likely locations
 HERE = Path(__file__).resolve().parent
@@ -47,16 +73,36 @@ _client: Optional[Client] = None
 def get_client() -> Client:
     global _client
     if _client is None:
-        if _MISSING_ENV:
+        if STORAGE_BACKEND == BACKEND_SUPABASE and _MISSING_ENV:
             raise RuntimeError(
                 "Missing Supabase configuration: set SUPABASE_URL and SUPABASE_KEY in environment or .env"
             )
-        _client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        _client = create_storage_client(
+            STORAGE_BACKEND, url=SUPABASE_URL, key=SUPABASE_KEY, sqlite_path=SQLITE_PATH
+        )
     return _client
 
+_async_client: Optional[Any] = None
+
+async def get_async_client() -> Any:
+    """Shared async client (supabase AsyncClient) used by db_async.py."""
+    global _async_client
+    if _async_client is None:
+        if STORAGE_BACKEND == BACKEND_SUPABASE and _MISSING_ENV:
+            raise RuntimeError(
+                "Missing Supabase configuration: set SUPABASE_URL and SUPABASE_KEY in environment or .env"
+            )
+        client = await create_async_storage_client(
+            STORAGE_BACKEND, url=SUPABASE_URL, key=SUPABASE_KEY, sqlite_path=SQLITE_PATH
+        )
+        if _async_client is None:
+            _async_client = client
+    return _async_client
+
 def get_env_status() -> Dict[str, Any]:
     """Diagnostics for environment configuration."""
     return {
+        "storage_backend": STORAGE_BACKEND,
         "SUPABASE_URL_present": bool(SUPABASE_URL),
         "SUPABASE_KEY_present": bool(SUPABASE_KEY),
         "loaded_root_env": (ROOT / ".env").exists(),
@@ -72,21 +118,136 @@ T_CREDIT_SHOP = "credit_shop"# shop items (shop_item_id int, item_name, credit_c
 T_REDEMPTION = "redemptions"# redemptions (id uuid, reward_id references rewards)
 T_LEADERBOARD = "leaderboard"# leaderboard (user_id integer, total_credit_earned)
 T_CREDITS = "rewards"       # ACTUAL TABLE NAME: "rewards" stores user credits (id uuid, user_id uuid, total_credits numeric)
+T_CREDIT_LEDGER = "credit_ledger"       # append-only credit changes (entry_id, user_id uuid, delta)
+T_CREDIT_SNAPSHOTS = "credit_snapshots" # per-user balance as of last_entry_id
+T_SPENDING_ROLLUPS = "spending_rollups" # per-user monthly spend by category (user_id uuid, month date)
+
+# Credit balances are snapshot + ledger tail (migrations/008_credit_ledger.sql).
+# A balance read that sees CREDIT_SNAPSHOT_EVERY or more tail entries folds
+# them into the user's snapshot; entries younger than CREDIT_SNAPSHOT_LAG
+# seconds are left in the tail because concurrent appends may still commit
+# with lower ids.
+CREDIT_SNAPSHOT_EVERY = int(os.getenv("CREDIT_SNAPSHOT_EVERY", "50"))
+CREDIT_SNAPSHOT_LAG = float(os.getenv("CREDIT_SNAPSHOT_LAG", "60"))
+
+# Credits per payment (rates, caps, promotions): see reward_rules.py. The rules
+# file is re-read within REWARD_RULES_RELOAD_SECONDS of being changed.
+reward_rules = RewardRules(
+    os.getenv("REWARD_RULES_PATH", str(HERE / "reward_rules.json")),
+    reload_seconds=float(os.getenv("REWARD_RULES_RELOAD_SECONDS", "5")),
+)
+
+# Reward catalog (credit_shop) cache: the catalog only changes via create_reward
+# or a status/stock change, so reads are served in-process for CATALOG_CACHE_TTL
+# seconds. Writers call invalidate_catalog_cache().
+_catalog_cache = register_cache(TTLCache(
+    maxsize=int(os.getenv("CATALOG_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("CATALOG_CACHE_TTL", "60")),
+    name="credit_shop",
+))
+
+
+def invalidate_catalog_cache(shop_item_id: Optional[Any] = None) -> None:
+    """Drop cached catalog entries (one item plus every list, or everything)."""
+    if shop_item_id is None:
+        _catalog_cache.clear()
+        return
+    _catalog_cache.invalidate(("item", str(shop_item_id)))
+    for active in (None, True, False):
+        _catalog_cache.invalidate(("list", active))
+
+
+def catalog_cache_stats() -> Dict[str, Any]:
+    return _catalog_cache.stats()
+
+# Leaderboard served from memory; updated on every credit award/redemption and
+# rebuilt from the leaderboard table on cold start and every
+# LEADERBOARD_REFRESH_SECONDS (so updates made by other workers show up).
+_leaderboard = LeaderboardEngine(refresh_seconds=float(os.getenv("LEADERBOARD_REFRESH_SECONDS", "300")))
+
+# credit_log rows that are not part of a server-side transaction (redemptions)
+# are written behind the request: spooled to CREDIT_LOG_SPOOL_DIR and inserted
+# in batches of CREDIT_LOG_FLUSH_ROWS at least every CREDIT_LOG_FLUSH_SECONDS
+# (see writebehind.py). Drained on shutdown by main.py and at exit.
+def _insert_credit_logs(rows: List[Dict[str, Any]]) -> None:
+    run_sync(_insert_credit_logs_op(get_client(), rows))
+
+
+def _insert_credit_logs_op(sb: Client, rows: List[Dict[str, Any]]) -> StorageOp[None]:
+    # entry_key is unique, so a batch replayed after a crash is not inserted twice
+    yield sb.table(T_CREDIT_LOG).upsert(rows, on_conflict="entry_key", ignore_duplicates=True,
+                                        returning=ReturnMethod.minimal)
+
+
+credit_log_queue = register_queue(WriteBehindQueue(
+    "credit_log",
+    spool_dir=os.getenv("CREDIT_LOG_SPOOL_DIR", str(HERE / "spool" / "credit_log")),
+    sink=_insert_credit_logs,
+    flush_rows=int(os.getenv("CREDIT_LOG_FLUSH_ROWS", "500")),
+    flush_seconds=float(os.getenv("CREDIT_LOG_FLUSH_SECONDS", "1")),
+    fsync=os.getenv("CREDIT_LOG_FSYNC", "0").strip().lower() in ("1", "true", "yes"),
+))
+atexit.register(credit_log_queue.close)
+
+# In-process serialization per account (see locks.py): payments of one bill
+# and redemptions of one user run one at a time; db_async.py has the asyncio
+# flavour for the API handlers.
+account_locks = LockManager("reward_account_sync")
+
+# Stock tokens for hot credit_shop items (see reservations.py): an item with
+# REDEEM_HOT_RATE or more redemptions per second is sold from in-memory units
+# reserved REDEEM_TOKEN_BATCH at a time; idle units go back after
+# REDEEM_TOKEN_IDLE_SECONDS. REDEEM_HOT_RATE=0 disables tokens.
+_stock_tokens = StockTokens(
+    batch=int(os.getenv("REDEEM_TOKEN_BATCH", "20")),
+    hot_rate=int(os.getenv("REDEEM_HOT_RATE", "20")),
+    idle_seconds=float(os.getenv("REDEEM_TOKEN_IDLE_SECONDS", "10")),
+)
 
 # ---------- Helper functions ----------
 
-def _safe_single(query_builder):
+def _user_id_int(user_id: str) -> int:
+    """Integer key used by credit_log/leaderboard (they predate uuid profiles)."""
+    return int(user_id.replace('-', '')[:9], 16) % 2147483647
+
+
+def _safe_single(query_builder) -> StorageOp[Optional[Dict[str, Any]]]:
     """Safely execute a query that expects a single result.
     
     Returns None if no results found instead of raising an error.
     This is a workaround for Supabase Python client's .single() behavior.
+    Use with `yield from` inside a storage operation.
     """
     try:
-        result = query_builder.limit(1).execute()
+        result = yield query_builder.limit(1)
         return result.data[0] if result.data else None
     except Exception:
         return None
 
+# ---------- Column projections + keyset pagination ----------
+
+# Columns each mapper below reads; list queries fetch only these
+BILL_COLUMNS = ("id, user_id, title, description, receiver_bank, receiver_name, amount, "
+                "due_date, status, category, created_at")
+PAYMENT_COLUMNS = ("id, bill_id, user_id, payer_bank, payer_name, payment_time, order_number, "
+                   "amount_paid, payment_method, status, credit_awarded, remark, created_at")
+CREDIT_LOG_COLUMNS = "log_id, user_id, source_type, source_id, change_amount, balance_after, created_at"
+CREDIT_LEDGER_COLUMNS = "entry_id, user_id, delta, source_type, source_id, created_at"
+REDEMPTION_COLUMNS = "id, user_id, reward_id, redemption_type, amount, description, created_at"
+
+
+def _keyset(q, column: str, limit: Optional[int] = None, after: Optional[Any] = None):
+    """Keyset (cursor) page: rows with column > after, ordered by column, at most limit.
+
+    column must be unique and indexed (primary keys here) so pages are stable.
+    """
+    if after is not None:
+        q = q.gt(column, after)
+    q = q.order(column)
+    if limit is not None:
+        q = q.limit(limit)
+    return q
+
 # ---------- Mapping helpers (DB row -> API dict with aliased keys) ----------
 
 def _user_to_api(row: Dict[str, Any], current_credit: Optional[int] = None) -> Dict[str, Any]:
@@ -103,16 +264,17 @@ def _user_to_api(row: Dict[str, Any], current_credit: Optional[int] = None) -> D
     }
 
 
-def _bill_to_api(row: Dict[str, Any]) -> Dict[str, Any]:
+def _bill_to_api(row: Dict[str, Any], rates: Optional[RateTable] = None) -> Dict[str, Any]:
     """Map bills table row to API format.
     Schema: id, user_id, title, amount, due_date, status, created_at, 
             description, receiver_bank, receiver_name, category
+    RewardRate/RewardEarned use the reward rules in force now; list callers
+    pass `rates` resolved once for all rows.
     """
     amount = float(row.get("amount", 0) or 0)
-    category = (row.get("category") or "rent").lower()
-    rate_by_cat = {"rent": 5.0, "utility": 3.0, "subscription": 2.0}
-    reward_rate = rate_by_cat.get(category, 5.0)
-    reward_earned = int(amount * reward_rate / 100.0)
+    rates = rates or reward_rules.table()
+    reward_rate = rates.rate(row.get("category"))
+    reward_earned = rates.credit(amount, row.get("category"))
     status = row.get("status") or "unpaid"
     
     return {
@@ -136,7 +298,8 @@ def _bill_to_api(row: Dict[str, Any]) -> Dict[str, Any]:
 def _payment_to_api(row: Dict[str, Any], credit_awarded: Optional[int] = None) -> Dict[str, Any]:
     """Map payments table row to API format.
     Schema: id, user_id, bill_id, amount_paid, status, created_at,
-            payer_bank, payer_name, order_number, payment_method, payment_time, remark
+            payer_bank, payer_name, order_number, payment_method, payment_time, remark,
+            credit_awarded (int, see migrations/001_payments_credit_awarded.sql)
     """
     return {
         "PaymentID": row.get("id"),
@@ -171,6 +334,21 @@ def _credit_log_to_api(row: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
+def _ledger_entry_to_api(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Map credit_ledger table row to API format.
+    Schema: entry_id (bigint), user_id (uuid), delta (int), source_type,
+            source_id (text), created_at
+    """
+    return {
+        "EntryID": row.get("entry_id"),
+        "UserID": row.get("user_id"),
+        "Delta": int(row.get("delta", 0) or 0),
+        "SourceType": row.get("source_type"),
+        "SourceID": row.get("source_id"),
+        "Timestamp": row.get("created_at"),
+    }
+
+
 def _reward_to_api(row: Dict[str, Any]) -> Dict[str, Any]:
     """Map credit_shop table row to API format.
     Schema: shop_item_id (int), item_name, item_description, credit_cost (int),
@@ -191,10 +369,15 @@ def _redemption_to_api(row: Dict[str, Any]) -> Dict[str, Any]:
     """Map redemptions table row to API format.
     Schema: id, user_id, reward_id, redemption_type, amount, description, created_at
     """
+    reward_id = row.get("reward_id")
+    description = row.get("description") or ""
+    if reward_id is None and description.startswith("shop_item:"):
+        # credit_shop redemptions keep the shop item reference in description
+        reward_id = description[len("shop_item:"):]
     return {
         "RedemptionID": row.get("id"),
         "UserID": row.get("user_id"),
-        "RewardID": row.get("reward_id"),
+        "RewardID": reward_id,
         "RedemptionType": row.get("redemption_type"),
         "Amount": int(row.get("amount", 0) or 0),
         "CreditSpent": int(row.get("amount", 0) or 0),  # Alias for Amount
@@ -209,57 +392,90 @@ def _leaderboard_to_api(row: Dict[str, Any]) -> Dict[str, Any]:
     Schema: user_id (int), total_credit_earned (int), total_redeemed (int), last_updated
     """
     return {
-        "UserID": row.get("user_id"),
+        "UserID": str(row.get("user_id")),
         "TotalCreditEarned": int(row.get("total_credit_earned", 0) or 0),
         "TotalRedeemed": int(row.get("total_redeemed", 0) or 0),
         "LastUpdated": row.get("last_updated"),
     }
 
 # ---------- Public operations ----------
+#
+# Each operation is a generator (<name>_op) that takes the client, yields
+# queries and receives their responses; the plain function runs it with the
+# blocking client and db_async.py runs the same generator on the async client.
 
 # Users
 
+# Columns needed by _user_to_api; credits lives on the same profiles row
+USER_COLUMNS = "id, full_name, email, created_at, credits"
+
+
 def get_user(user_id: str) -> Optional[Dict[str, Any]]:
-    sb = get_client()
-    res = sb.table(T_USER).select("*").eq("id", user_id).limit(1).execute()
+    return run_sync(get_user_op(get_client(), user_id))
+
+
+def get_user_op(sb: Client, user_id: str) -> StorageOp[Optional[Dict[str, Any]]]:
+    res = yield sb.table(T_USER).select(USER_COLUMNS).eq("id", user_id).limit(1)
     rows = res.data or []
     if not rows:
         return None
-    row = rows[0]
-    # Get current credit from rewards table (total_credits field)
-    current_credit = _recalc_user_credit(sb, user_id)
-    return _user_to_api(row, current_credit=current_credit)
+    current_credit = yield from _recalc_user_credit(sb, user_id)
+    return _user_to_api(rows[0], current_credit=current_credit)
 
 
-def list_users() -> List[Dict[str, Any]]:
-    sb = get_client()
-    res = sb.table(T_USER).select("*").order("id").execute()
-    out = []
-    for r in (res.data or []):
-        # Get current credit from rewards table for each user
-        current_credit = _recalc_user_credit(sb, r.get("id"))
-        api = _user_to_api(r, current_credit=current_credit)
-        out.append(api)
-    return out
+def list_users(limit: Optional[int] = None, offset: int = 0,
+               stats: Optional[Dict[str, int]] = None,
+               after: Optional[str] = None) -> List[Dict[str, Any]]:
+    """List profiles (with credits) from one projected query.
+
+    CurrentCredit comes from profiles.credits, which every ledger append
+    increments in the same transaction; get_user reads the ledger itself.
+
+    Pages server-side: `after` is a keyset cursor (last UserID seen), and
+    limit/offset become a range request. If `stats` is given,
+    stats["round_trips"] is incremented by the number of storage requests made.
+    """
+    return run_sync(list_users_op(get_client(), limit, offset, stats, after))
+
+
+def list_users_op(sb: Client, limit: Optional[int] = None, offset: int = 0,
+                  stats: Optional[Dict[str, int]] = None,
+                  after: Optional[str] = None) -> StorageOp[List[Dict[str, Any]]]:
+    q = _keyset(sb.table(T_USER).select(USER_COLUMNS), "id", after=after)
+    if limit is not None:
+        q = q.range(offset, offset + limit - 1)
+    elif offset:
+        q = q.offset(offset)
+    res = yield q
+    if stats is not None:
+        stats["round_trips"] = stats.get("round_trips", 0) + 1
+    return [_user_to_api(r, current_credit=_credits_of(r)) for r in (res.data or [])]
 
 
 def create_user(username: str, email: str, password_hash: Optional[str] = None) -> Dict[str, Any]:
     """Create a new user profile.
     Note: In production, users are created via Supabase Auth, not directly.
     """
-    sb = get_client()
+    return run_sync(create_user_op(get_client(), username, email, password_hash))
+
+
+def create_user_op(sb: Client, username: str, email: str,
+                   password_hash: Optional[str] = None) -> StorageOp[Dict[str, Any]]:
     now = datetime.utcnow().isoformat()
     payload = {
         "full_name": username,
         "email": email,
         "created_at": now,
     }
-    res = sb.table(T_USER).insert(payload).select("*").single().execute()
-    
+    res = yield sb.table(T_USER).insert(payload)
+    row = res.data[0] if res.data else None
+    if not row:
+        raise ValueError("Failed to create user")
+
     # Credits are now stored in profiles.credits field (initialized to 0 by default)
     # No need to create separate rewards record
-    
-    return _user_to_api(res.data, current_credit=0)
+
+    return _user_to_api(row, current_credit=0)
 
 def ensure_user(user_id: str, email: str, username: Optional[str] = None) -> Dict[str, Any]:
     """Ensure a profile row exists for the given auth user id.
@@ -267,9 +483,13 @@ def ensure_user(user_id: str, email: str, username: Optional[str] = None) -> Dic
     - If a row with id exists, update email/full_name if provided and return it.
     - Otherwise, insert a new row with explicit id.
     """
-    sb = get_client()
+    return run_sync(ensure_user_op(get_client(), user_id, email, username))
+
+
+def ensure_user_op(sb: Client, user_id: str, email: str,
+                   username: Optional[str] = None) -> StorageOp[Dict[str, Any]]:
     # Try fetch by id - use limit(1) instead of single() to avoid error when no results
-    existing_rows = sb.table(T_USER).select("*").eq("id", user_id).limit(1).execute().data
+    existing_rows = (yield sb.table(T_USER).select("*").eq("id", user_id).limit(1)).data
     existing = existing_rows[0] if existing_rows else None
     
     now = datetime.utcnow().isoformat()
@@ -280,10 +500,10 @@ def ensure_user(user_id: str, email: str, username: Optional[str] = None) -> Dic
         if username and (existing.get("full_name") or existing.get("username")) != username:
             updates["full_name"] = username
         if updates:
-            sb.table(T_USER).update(updates).eq("id", user_id).execute()
+            yield sb.table(T_USER).update(updates).eq("id", user_id)
             existing.update(updates)
         # Get current credit from rewards table
-        current_credit = _recalc_user_credit(sb, user_id)
+        current_credit = yield from _recalc_user_credit(sb, user_id)
         return _user_to_api(existing, current_credit=current_credit)
 
     # Insert with explicit id
@@ -293,14 +513,14 @@ def ensure_user(user_id: str, email: str, username: Optional[str] = None) -> Dic
         "email": email,
         "created_at": now,
     }
-    res = sb.table(T_USER).insert(payload).execute()
+    res = yield sb.table(T_USER).insert(payload)
     new_user = res.data[0] if res.data else None
     if not new_user:
         raise ValueError("Failed to create user")
     
     # Credits are now stored in profiles.credits field
     # Fetch the actual credit value from the database
-    current_credit = _recalc_user_credit(sb, user_id)
+    current_credit = yield from _recalc_user_credit(sb, user_id)
     
     return _user_to_api(new_user, current_credit=current_credit)
 
@@ -309,13 +529,17 @@ def delete_user_by_email(email: str) -> Dict[str, Any]:
     """Delete all records associated with profiles.email == email.
 
     Affected tables (by user_id):
-    - redemptions, credit_log, credits, payments, bills, leaderboard, profiles
+    - redemptions, credit_log, credits, credit_ledger, credit_snapshots,
+      spending_rollups, payments, bills, leaderboard, profiles
 
     Returns a summary including the list of deleted user IDs.
     """
-    sb = get_client()
+    return run_sync(delete_user_by_email_op(get_client(), email))
+
+
+def delete_user_by_email_op(sb: Client, email: str) -> StorageOp[Dict[str, Any]]:
     # Find all profiles matching the email
-    prof_res = sb.table(T_USER).select("id, email").eq("email", email).execute()
+    prof_res = yield sb.table(T_USER).select("id, email").eq("email", email)
     users = prof_res.data or []
     if not users:
         return {"status": "ok", "user_ids": [], "note": "no profiles matched"}
@@ -326,54 +550,65 @@ def delete_user_by_email(email: str) -> Dict[str, Any]:
         if not uid:
             continue
         deleted_ids.append(uid)
+        invalidate_spending_history(uid)
 
-        # Convert UUID to integer for credit_log and leaderboard tables
-        # These tables use integer user_id instead of uuid
-        user_id_int = int(uid.replace('-', '')[:9], 16) % 2147483647
+        # credit_log and leaderboard use integer user_id instead of uuid
+        user_id_int = _user_id_int(uid)
 
         # Fetch bill ids for this user to delete payments referencing bills
-        bills = sb.table(T_BILL).select("id").eq("user_id", uid).execute().data or []
+        bills = (yield sb.table(T_BILL).select("id").eq("user_id", uid)).data or []
         bill_ids = [b.get("id") for b in bills if b.get("id")]
 
         # Delete redemptions
         try:
-            sb.table(T_REDEMPTION).delete().eq("user_id", uid).execute()
+            yield sb.table(T_REDEMPTION).delete().eq("user_id", uid)
         except Exception:
             pass
         # Delete credit logs (uses integer user_id)
         try:
-            sb.table(T_CREDIT_LOG).delete().eq("user_id", user_id_int).execute()
+            yield sb.table(T_CREDIT_LOG).delete().eq("user_id", user_id_int)
         except Exception:
             pass
         # Delete credits ledger entries
         try:
-            sb.table(T_CREDITS).delete().eq("user_id", uid).execute()
+            yield sb.table(T_CREDITS).delete().eq("user_id", uid)
+        except Exception:
+            pass
+        # Delete the append-only credit ledger and its snapshot
+        try:
+            yield sb.table(T_CREDIT_SNAPSHOTS).delete().eq("user_id", uid)
+            yield sb.table(T_CREDIT_LEDGER).delete().eq("user_id", uid)
+        except Exception:
+            pass
+        # Delete spending rollups
+        try:
+            yield sb.table(T_SPENDING_ROLLUPS).delete().eq("user_id", uid)
         except Exception:
             pass
         # Delete payments directly linked by user_id
         try:
-            sb.table(T_PAYMENT).delete().eq("user_id", uid).execute()
+            yield sb.table(T_PAYMENT).delete().eq("user_id", uid)
         except Exception:
             pass
         # Delete payments linked via bill_id
         if bill_ids:
             try:
-                sb.table(T_PAYMENT).delete().in_("bill_id", bill_ids).execute()  # type: ignore[attr-defined]
+                yield sb.table(T_PAYMENT).delete().in_("bill_id", bill_ids)  # type: ignore[attr-defined]
             except Exception:
                 pass
         # Delete bills
         try:
-            sb.table(T_BILL).delete().eq("user_id", uid).execute()
+            yield sb.table(T_BILL).delete().eq("user_id", uid)
         except Exception:
             pass
         # Delete leaderboard rows if present (uses integer user_id)
         try:
-            sb.table(T_LEADERBOARD).delete().eq("user_id", user_id_int).execute()
+            yield sb.table(T_LEADERBOARD).delete().eq("user_id", user_id_int)
         except Exception:
             pass
         # Finally delete profile
         try:
-            sb.table(T_USER).delete().eq("id", uid).execute()
+            yield sb.table(T_USER).delete().eq("id", uid)
         except Exception:
             pass
 
@@ -388,39 +623,43 @@ def init_user(user_id: str, email: str, username: Optional[str] = None) -> Dict[
     - Ensures rewards record exists for credit balance
     Returns the profile API dict with CurrentCredit computed.
     """
-    sb = get_client()
-    profile = ensure_user(user_id=user_id, email=email, username=username)
+    return run_sync(init_user_op(get_client(), user_id, email, username))
+
+
+def init_user_op(sb: Client, user_id: str, email: str,
+                 username: Optional[str] = None) -> StorageOp[Dict[str, Any]]:
+    profile = yield from ensure_user_op(sb, user_id=user_id, email=email, username=username)
 
     # Leaderboard row - Schema: leaderboard(user_id int, total_credit_earned, total_redeemed, last_updated)
     # Note: leaderboard.user_id is integer, but profiles.id is uuid - we hash it
     try:
-        user_id_int = int(user_id.replace('-', '')[:9], 16) % 2147483647
-        lb = sb.table(T_LEADERBOARD).select("*").eq("user_id", user_id_int).limit(1).execute().data or []
+        user_id_int = _user_id_int(user_id)
+        lb = (yield sb.table(T_LEADERBOARD).select("*").eq("user_id", user_id_int).limit(1)).data or []
         if not lb:
             now = datetime.utcnow().isoformat()
-            sb.table(T_LEADERBOARD).insert({
+            yield sb.table(T_LEADERBOARD).insert({
                 "user_id": user_id_int,
                 "total_credit_earned": 0,
                 "total_redeemed": 0,
                 "last_updated": now,
-            }).execute()
+            })
     except Exception as e:
         # Leaderboard is optional, log but continue
         print(f"Warning: Could not initialize leaderboard for user {user_id}: {e}")
 
     # Ensure rewards record exists - Schema: rewards(id, user_id, total_credits)
     try:
-        reward_rows = sb.table(T_CREDITS).select("id").eq("user_id", user_id).limit(1).execute().data or []
+        reward_rows = (yield sb.table(T_CREDITS).select("id").eq("user_id", user_id).limit(1)).data or []
         if not reward_rows:
-            sb.table(T_CREDITS).insert({
+            yield sb.table(T_CREDITS).insert({
                 "user_id": user_id,
                 "total_credits": 0
-            }).execute()
+            })
     except Exception as e:
         print(f"Warning: Could not initialize rewards for user {user_id}: {e}")
 
     # Get current credit from rewards table
-    current_credit = _recalc_user_credit(sb, user_id)
+    current_credit = yield from _recalc_user_credit(sb, user_id)
     profile["CurrentCredit"] = current_credit
     return profile
 
@@ -429,9 +668,30 @@ def init_user(user_id: str, email: str, username: Optional[str] = None) -> Dict[
 def create_bill(user_id: str, title: str, amount: float, due_date: date, category: str,
                 description: Optional[str] = None, receiver_bank: Optional[str] = None,
                 receiver_name: Optional[str] = None) -> Dict[str, Any]:
-    sb = get_client()
-    now = datetime.utcnow().isoformat()
-    payload = {
+    return run_sync(create_bill_op(
+        get_client(), user_id, title, amount, due_date, category,
+        description=description, receiver_bank=receiver_bank, receiver_name=receiver_name,
+    ))
+
+
+def create_bill_op(sb: Client, user_id: str, title: str, amount: float, due_date: date,
+                   category: str, description: Optional[str] = None,
+                   receiver_bank: Optional[str] = None,
+                   receiver_name: Optional[str] = None) -> StorageOp[Dict[str, Any]]:
+    payload = _bill_payload(user_id, title, amount, due_date, category,
+                            description, receiver_bank, receiver_name)
+    res = yield sb.table(T_BILL).insert(payload)
+    row = res.data[0] if res.data else None
+    if not row:
+        raise ValueError("Failed to create bill")
+    invalidate_spending_history(user_id)
+    return _bill_to_api(row)
+
+
+def _bill_payload(user_id: str, title: str, amount: float, due_date: date, category: str,
+                  description: Optional[str] = None, receiver_bank: Optional[str] = None,
+                  receiver_name: Optional[str] = None, now: Optional[str] = None) -> Dict[str, Any]:
+    return {
         "user_id": user_id,
         "title": title,
         "description": description,
@@ -441,179 +701,480 @@ def create_bill(user_id: str, title: str, amount: float, due_date: date, categor
         "due_date": due_date.isoformat() if isinstance(due_date, date) else due_date,
         "status": "Pending",
         "category": category,
-        "created_at": now,
+        "created_at": now or datetime.utcnow().isoformat(),
     }
-    res = sb.table(T_BILL).insert(payload).select("*").single().execute()
-    return _bill_to_api(res.data)
+
+
+# Rows per multi-row INSERT when importing bills
+BILL_IMPORT_BATCH = int(os.getenv("BILL_IMPORT_BATCH", "1000"))
+
+
+BillImportResult = Tuple[List[Dict[str, Any]], List[Tuple[int, str]]]
+
+
+def create_bills(bills: List[Dict[str, Any]]) -> BillImportResult:
+    """Insert many bills with one multi-row insert per BILL_IMPORT_BATCH rows.
+
+    Each item takes the create_bill keyword arguments. Returns the created
+    bills and (index, error) for items whose batch failed to insert.
+    """
+    return run_sync(create_bills_op(get_client(), bills))
+
+
+def create_bills_op(sb: Client, bills: List[Dict[str, Any]],
+                    batch_size: Optional[int] = None) -> StorageOp[BillImportResult]:
+    batch_size = batch_size or BILL_IMPORT_BATCH
+    now = datetime.utcnow().isoformat()
+    created: List[Dict[str, Any]] = []
+    errors: List[Tuple[int, str]] = []
+    for start in range(0, len(bills), batch_size):
+        batch = bills[start:start + batch_size]
+        try:
+            res = yield sb.table(T_BILL).insert([_bill_payload(now=now, **b) for b in batch])
+        except Exception as e:
+            errors.extend((start + i, str(e)) for i in range(len(batch)))
+            continue
+        rates = reward_rules.table()
+        created.extend(_bill_to_api(row, rates) for row in res.data or [])
+        invalidate_spending_history(*{b["user_id"] for b in batch})
+    return created, errors
 
 
 def get_bill(bill_id: str) -> Optional[Dict[str, Any]]:
-    sb = get_client()
-    res = sb.table(T_BILL).select("*").eq("id", bill_id).single().execute()
+    return run_sync(get_bill_op(get_client(), bill_id))
+
+
+def get_bill_op(sb: Client, bill_id: str) -> StorageOp[Optional[Dict[str, Any]]]:
+    res = yield sb.table(T_BILL).select("*").eq("id", bill_id).single()
     row = res.data
     return _bill_to_api(row) if row else None
 
 
-def list_bills(user_id: Optional[str] = None) -> List[Dict[str, Any]]:
-    sb = get_client()
-    q = sb.table(T_BILL).select("*")
+def list_bills(user_id: Optional[str] = None, limit: Optional[int] = None,
+               after: Optional[str] = None) -> List[Dict[str, Any]]:
+    return run_sync(list_bills_op(get_client(), user_id, limit=limit, after=after))
+
+
+def list_bills_op(sb: Client, user_id: Optional[str] = None, limit: Optional[int] = None,
+                  after: Optional[str] = None) -> StorageOp[List[Dict[str, Any]]]:
+    q = sb.table(T_BILL).select(BILL_COLUMNS)
     if user_id is not None:
         q = q.eq("user_id", user_id)
-    res = q.order("id").execute()
-    return [_bill_to_api(r) for r in (res.data or [])]
+    res = yield _keyset(q, "id", limit, after)
+    rates = reward_rules.table()
+    return [_bill_to_api(r, rates) for r in (res.data or [])]
 
 # Payments + credit awarding
 
-def _recalc_user_credit(sb: Client, user_id: str) -> int:
+def _recalc_user_credit(sb: Client, user_id: str) -> StorageOp[int]:
+    """
+    Current credit balance: the user's snapshot plus the ledger entries after
+    it, summed server-side by credit_balance (one round trip). A long tail is
+    folded into a new snapshot so the next read stays short.
     """
-    Calculate user's current credit balance from the profiles table.
-    The 'profiles' table stores user credit balances in the 'credits' field.
+    res = yield sb.rpc("credit_balance", {"p_user_id": user_id})
+    data = res.data[0] if isinstance(res.data, list) and res.data else (res.data or {})
+    if int(data.get("tail_entries") or 0) >= CREDIT_SNAPSHOT_EVERY:
+        try:
+            yield from snapshot_credit_balances_op(sb, user_id)
+        except Exception as e:
+            print(f"Warning: Could not snapshot credit balance for user {user_id}: {e}")
+    return int(data.get("balance") or 0)
+
+
+def _credits_of(row: Dict[str, Any]) -> int:
+    """Credit balance stored on a profiles row."""
+    return int(float(row.get("credits", 0) or 0))
+
+
+def snapshot_credit_balances(user_id: Optional[str] = None) -> int:
+    """Fold settled ledger entries into per-user snapshots (all users by default).
+
+    Entries younger than CREDIT_SNAPSHOT_LAG seconds stay in the tail.
+    Returns the number of snapshots written.
     """
-    # Fetch the user's profile record (which stores credit balance)
-    profile = sb.table(T_USER).select("credits").eq("id", user_id).execute().data or []
-    # Get credits from profile (should be just one row)
-    if profile:
-        balance = int(float(profile[0].get("credits", 0) or 0))
-    else:
-        balance = 0
-    return balance
+    return run_sync(snapshot_credit_balances_op(get_client(), user_id))
+
+
+def snapshot_credit_balances_op(sb: Client, user_id: Optional[str] = None) -> StorageOp[int]:
+    before = datetime.utcnow() - timedelta(seconds=CREDIT_SNAPSHOT_LAG)
+    res = yield sb.rpc("credit_snapshot", {"p_user_id": user_id, "p_before": before.isoformat()})
+    data = res.data[0] if isinstance(res.data, list) and res.data else res.data
+    return int(data or 0)
 
 
 def create_payment(bill_id: str, amount_paid: float, payment_method: str,
                    payer_name: Optional[str] = None, payer_bank: Optional[str] = None,
                    order_number: Optional[str] = None, remark: Optional[str] = None) -> Dict[str, Any]:
-    sb = get_client()
-    # Fetch bill and user
-    bill = _safe_single(sb.table(T_BILL).select("*").eq("id", bill_id))
-    if not bill:
-        raise ValueError("Bill not found")
-    user_id = bill["user_id"]
-    # Compute credits from category rule
-    category = (bill.get("category") or "rent").lower()
-    rate_by_cat = {"rent": 5.0, "utility": 3.0, "subscription": 2.0}
-    reward_rate = rate_by_cat.get(category, 5.0)
-    credit_awarded = int(float(amount_paid) * reward_rate / 100.0)
-
-    now = datetime.utcnow().isoformat()
-
-    # Insert payment
-    p_row = {
-        "bill_id": bill_id,
-        "user_id": user_id,
-        "payer_bank": payer_bank,
-        "payer_name": payer_name,
-        "payment_time": now,
-        "order_number": order_number,
-        "amount_paid": float(amount_paid),
-        "payment_method": payment_method,
-        "remark": remark,
-        "status": "success",  # Match DB default: 'success'
-        "created_at": now,
+    """Record a payment and award credits as one transaction.
+
+    The payment insert, bill status flip, credit ledger append and
+    credit_log row all happen server-side in create_payment_tx
+    (migrations/002_create_payment_tx.sql, 008_credit_ledger.sql;
+    sqlite_store has the local equivalent), so this is a single round trip
+    and concurrent payments for one user cannot lose credit updates.
+    Raises ValueError if the bill is missing or already paid.
+    """
+    with account_locks.hold(f"bill:{bill_id}"):
+        return run_sync(create_payment_op(
+            get_client(), bill_id, amount_paid, payment_method,
+            payer_name=payer_name, payer_bank=payer_bank, order_number=order_number, remark=remark,
+        ))
+
+
+def create_payment_op(sb: Client, bill_id: str, amount_paid: float, payment_method: str,
+                      payer_name: Optional[str] = None, payer_bank: Optional[str] = None,
+                      order_number: Optional[str] = None,
+                      remark: Optional[str] = None) -> StorageOp[Dict[str, Any]]:
+    # Rates and caps in force now are passed in, so the server-side function
+    # applies the same reward rules as the API
+    now = datetime.utcnow()
+    params = {
+        "p_bill_id": bill_id,
+        "p_amount_paid": float(amount_paid),
+        "p_payment_method": payment_method,
+        "p_payer_name": payer_name,
+        "p_payer_bank": payer_bank,
+        "p_order_number": order_number,
+        "p_remark": remark,
+        **reward_rules.table(now).server_params(),
+        "p_now": now.isoformat(),
     }
-    payment_res = sb.table(T_PAYMENT).insert(p_row).execute()
-    payment = payment_res.data[0] if payment_res.data else None
+    try:
+        res = yield sb.rpc("create_payment_tx", params)
+    except Exception as e:
+        message = getattr(e, "message", None) or str(e)
+        if "Bill not found" in message:
+            raise ValueError("Bill not found") from e
+        if "Bill already paid" in message:
+            raise ValueError(message) from e
+        raise
+    payment = res.data[0] if isinstance(res.data, list) and res.data else res.data
     if not payment:
         raise ValueError("Failed to create payment")
-
-    # Update bill status to 'paid' (match DB schema: lowercase)
-    sb.table(T_BILL).update({"status": "paid"}).eq("id", bill_id).execute()
-
-    # Update user's credit balance in the profiles table
-    # Schema: profiles(id, credits numeric)
-    profile = sb.table(T_USER).select("credits").eq("id", user_id).execute().data
-    
-    if profile:
-        # Update existing profile credits
-        current_total = float(profile[0].get("credits", 0) or 0)
-        new_total = current_total + credit_awarded
-        sb.table(T_USER).update({
-            "credits": new_total
-        }).eq("id", user_id).execute()
-        balance_after = int(new_total)
-    else:
-        # Profile should exist, but if not, initialize credits
-        sb.table(T_USER).update({
-            "credits": credit_awarded
-        }).eq("id", user_id).execute()
-        balance_after = credit_awarded
-
-    # Credit log (credit_log.user_id is integer, profiles.id is uuid)
-    # Convert UUID to int hash for compatibility
+    if payment.get("user_id"):
+        invalidate_spending_history(payment["user_id"])
+        _leaderboard.record_earned(_user_id_int(payment["user_id"]), int(payment.get("credit_awarded") or 0),
+                                   at=params["p_now"])
+    return _payment_to_api(payment, credit_awarded=payment.get("credit_awarded"))
+
+
+def create_payments_batch(items: List[Dict[str, Any]], payment_method: str,
+                          payer_name: Optional[str] = None, payer_bank: Optional[str] = None,
+                          remark: Optional[str] = None) -> Dict[str, Any]:
+    """Pay several bills in one all-or-nothing transaction.
+
+    items are {"bill_id", "amount_paid", "order_number"?}. create_payments_batch_tx
+    (migrations/005_create_payments_batch_tx.sql) validates every bill first,
+    then inserts the payments, marks the bills paid, appends one ledger entry
+    per payment and writes one credit_log row per user. Raises ValueError if any bill is
+    missing, already paid or listed twice; nothing is written in that case.
+    Returns {"payments": [...] in input order, "balances": {user_id: credits}}.
+    """
+    return run_sync(create_payments_batch_op(
+        get_client(), items, payment_method,
+        payer_name=payer_name, payer_bank=payer_bank, remark=remark,
+    ))
+
+
+_BATCH_PAYMENT_ERRORS = ("Bill not found", "Bill already paid", "Duplicate bill")
+
+
+def create_payments_batch_op(sb: Client, items: List[Dict[str, Any]], payment_method: str,
+                             payer_name: Optional[str] = None, payer_bank: Optional[str] = None,
+                             remark: Optional[str] = None) -> StorageOp[Dict[str, Any]]:
+    now = datetime.utcnow()
+    params = {
+        "p_items": [
+            {
+                "bill_id": item["bill_id"],
+                "amount_paid": float(item["amount_paid"]),
+                "order_number": item.get("order_number"),
+            }
+            for item in items
+        ],
+        "p_payment_method": payment_method,
+        "p_payer_name": payer_name,
+        "p_payer_bank": payer_bank,
+        "p_remark": remark,
+        **reward_rules.table(now).server_params(),
+        "p_now": now.isoformat(),
+    }
     try:
-        # Simple hash: take first 9 chars of uuid (no dashes), convert to int
-        user_id_int = int(user_id.replace('-', '')[:9], 16) % 2147483647
-        sb.table(T_CREDIT_LOG).insert({
-            "user_id": user_id_int,
-            "source_type": "Payment",
-            "source_id": None,  # source_id is integer in schema, payment.id is uuid
-            "change_amount": credit_awarded,
-            "balance_after": balance_after,
-            "created_at": now,
-        }).execute()
+        res = yield sb.rpc("create_payments_batch_tx", params)
     except Exception as e:
-        # Credit log is optional, continue even if it fails
-        print(f"Warning: Could not insert into credit_log: {e}")
+        message = getattr(e, "message", None) or str(e)  # postgrest APIError carries .message
+        if any(known in message for known in _BATCH_PAYMENT_ERRORS):
+            raise ValueError(message) from e
+        raise
+    data = res.data[0] if isinstance(res.data, list) and res.data else (res.data or {})
+    by_bill = {p["bill_id"]: p for p in data.get("payments") or []}
+    payments = [by_bill[item["bill_id"]] for item in items if item["bill_id"] in by_bill]
+
+    earned: Dict[str, int] = {}
+    for p in payments:
+        if p.get("user_id"):
+            earned[p["user_id"]] = earned.get(p["user_id"], 0) + int(p.get("credit_awarded") or 0)
+    for user_id, credit in earned.items():
+        _leaderboard.record_earned(_user_id_int(user_id), credit, at=params["p_now"])
+    invalidate_spending_history(*earned)
+
+    return {
+        "payments": [_payment_to_api(p, credit_awarded=p.get("credit_awarded")) for p in payments],
+        "balances": {str(k): int(v) for k, v in (data.get("balances") or {}).items()},
+    }
+
+
+# PostgREST puts in_() filters in the URL; keep each batch well under URL limits
+_IN_BATCH = 200
 
-    return _payment_to_api(payment, credit_awarded=credit_awarded)
 
+def _payment_credits(sb: Client, rows: List[Dict[str, Any]]) -> StorageOp[List[int]]:
+    """credit_awarded for each payment row.
 
-def list_payments(user_id: Optional[str] = None, bill_id: Optional[str] = None) -> List[Dict[str, Any]]:
-    sb = get_client()
-    q = sb.table(T_PAYMENT).select("*")
+    Rows written by create_payment carry a persisted credit_awarded. Older rows
+    fall back to the reward rules for their bill's category at the payment
+    time, with the categories looked up for all of them in one batched
+    in_("id", ...) request instead of one request per payment.
+    """
+    missing = list({r.get("bill_id") for r in rows
+                    if r.get("credit_awarded") is None and r.get("bill_id")})
+    categories: Dict[str, str] = {}
+    for i in range(0, len(missing), _IN_BATCH):
+        try:
+            bills = (yield sb.table(T_BILL).select("id, category").in_(  # type: ignore[attr-defined]
+                "id", missing[i:i + _IN_BATCH])).data or []
+        except Exception:
+            bills = []
+        for b in bills:
+            categories[b["id"]] = b.get("category")
+
+    out = [int(r["credit_awarded"]) if r.get("credit_awarded") is not None else 0 for r in rows]
+    fallback = [i for i, r in enumerate(rows) if r.get("credit_awarded") is None and r.get("bill_id") in categories]
+    if fallback:
+        computed = reward_rules.credits(
+            [rows[i].get("amount_paid") for i in fallback],
+            [categories[rows[i]["bill_id"]] for i in fallback],
+            times=[rows[i].get("payment_time") or rows[i].get("created_at") for i in fallback],
+        )
+        for i, credit in zip(fallback, computed):
+            out[i] = credit
+    return out
+
+
+def list_payments(user_id: Optional[str] = None, bill_id: Optional[str] = None,
+                  limit: Optional[int] = None, after: Optional[str] = None) -> List[Dict[str, Any]]:
+    return run_sync(list_payments_op(get_client(), user_id=user_id, bill_id=bill_id, limit=limit, after=after))
+
+
+def list_payments_op(sb: Client, user_id: Optional[str] = None, bill_id: Optional[str] = None,
+                     limit: Optional[int] = None,
+                     after: Optional[str] = None) -> StorageOp[List[Dict[str, Any]]]:
+    q = sb.table(T_PAYMENT).select(PAYMENT_COLUMNS)
     if user_id is not None:
         q = q.eq("user_id", user_id)
     if bill_id is not None:
         q = q.eq("bill_id", bill_id)
-    res = q.order("id").execute()
+    res = yield _keyset(q, "id", limit, after)
     rows = res.data or []
-    # We don't store credit_awarded on payment row; recompute per bill rate for response
-    out: List[Dict[str, Any]] = []
-    for r in rows:
-        # try retrieve bill to compute
-        try:
-            b = sb.table(T_BILL).select("category, amount").eq("id", r.get("bill_id")).single().execute().data
-            category = (b.get("category") or "rent").lower() if b else "rent"
-            rate_by_cat = {"rent": 5.0, "utility": 3.0, "subscription": 2.0}
-            credit_awarded = int(float(r.get("amount_paid", 0) or 0) * rate_by_cat.get(category, 5.0) / 100.0)
-        except Exception:
-            credit_awarded = 0
-        out.append(_payment_to_api(r, credit_awarded=credit_awarded))
-    return out
+    credits = yield from _payment_credits(sb, rows)
+    return [_payment_to_api(r, credit_awarded=c) for r, c in zip(rows, credits)]
 
 def get_payment(payment_id: str) -> Optional[Dict[str, Any]]:
     """Fetch a single payment row and map to API shape."""
-    sb = get_client()
-    res = sb.table(T_PAYMENT).select("*").eq("id", payment_id).single().execute()
+    return run_sync(get_payment_op(get_client(), payment_id))
+
+
+def get_payment_op(sb: Client, payment_id: str) -> StorageOp[Optional[Dict[str, Any]]]:
+    res = yield sb.table(T_PAYMENT).select("*").eq("id", payment_id).single()
     row = res.data
     if not row:
         return None
-    # Compute credit_awarded similar to list_payments
-    try:
-        b = sb.table(T_BILL).select("category, amount").eq("id", row.get("bill_id")).single().execute().data
-        category = (b.get("category") or "rent").lower() if b else "rent"
-        rate_by_cat = {"rent": 5.0, "utility": 3.0, "subscription": 2.0}
-        credit_awarded = int(float(row.get("amount_paid", 0) or 0) * rate_by_cat.get(category, 5.0) / 100.0)
-    except Exception:
-        credit_awarded = 0
-    return _payment_to_api(row, credit_awarded=credit_awarded)
+    credits = yield from _payment_credits(sb, [row])
+    return _payment_to_api(row, credit_awarded=credits[0])
+
+# Spending analytics (analytics.py)
+
+# Rows per page when loading a user's history; PostgREST caps responses at
+# 1000 rows by default
+ANALYTICS_PAGE_SIZE = int(os.getenv("ANALYTICS_PAGE_SIZE", "1000"))
+ANALYTICS_PAYMENT_COLUMNS = "id, bill_id, amount_paid, credit_awarded, payment_time, created_at"
+ANALYTICS_BILL_COLUMNS = "id, amount, due_date, status, category"
+
+
+# Column arrays of recently analysed users. Payment and bill writes made here
+# drop the user's entry; writes by other workers show up within
+# ANALYTICS_CACHE_TTL seconds.
+_analytics_cache = register_cache(TTLCache(
+    maxsize=int(os.getenv("ANALYTICS_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("ANALYTICS_CACHE_TTL", "60")),
+    name="analytics",
+))
+
+
+def invalidate_spending_history(*user_ids: Any) -> None:
+    for user_id in user_ids:
+        if user_id:
+            _analytics_cache.invalidate(str(user_id))
+
+
+def cached_spending_history(user_id: str) -> Optional[SpendingHistory]:
+    return _analytics_cache.get(user_id)
+
+
+def build_spending_history(user_id: str, payments: List[Dict[str, Any]],
+                           bills: List[Dict[str, Any]]) -> SpendingHistory:
+    """Columns from spending_history_op rows, cached for the next request."""
+    history = SpendingHistory(payments, bills)
+    _analytics_cache.set(user_id, history)
+    return history
+
+
+def get_spending_analytics(user_id: str, months: int = 12) -> Dict[str, Any]:
+    """Spending summary of one user (see analytics.spending_summary)."""
+    history = cached_spending_history(user_id)
+    if history is None:
+        payments, bills = run_sync(spending_history_op(get_client(), user_id))
+        history = build_spending_history(user_id, payments, bills)
+    return spending_summary(user_id, history, months=months)
+
+
+def spending_history_op(sb: Client, user_id: str) -> StorageOp[Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]]:
+    """All payments and bills of a user, only the columns analytics needs.
+
+    Payments without a persisted credit_awarded get the reward rules' credit
+    at their payment time, as in list_payments.
+    """
+    history: Dict[str, List[Dict[str, Any]]] = {}
+    for table, columns in ((T_PAYMENT, ANALYTICS_PAYMENT_COLUMNS), (T_BILL, ANALYTICS_BILL_COLUMNS)):
+        rows: List[Dict[str, Any]] = []
+        after = None
+        while True:
+            res = yield _keyset(sb.table(table).select(columns).eq("user_id", user_id), "id",
+                                ANALYTICS_PAGE_SIZE, after)
+            page = res.data or []
+            rows.extend(page)
+            if len(page) < ANALYTICS_PAGE_SIZE:
+                break
+            after = page[-1]["id"]
+        history[table] = rows
+    payments, bills = history[T_PAYMENT], history[T_BILL]
+
+    legacy = [p for p in payments if p.get("credit_awarded") is None]
+    if legacy:
+        category_of = {b["id"]: b.get("category") for b in bills}
+        credits = reward_rules.credits(
+            [p.get("amount_paid") for p in legacy],
+            [category_of.get(p.get("bill_id")) for p in legacy],
+            times=[p.get("payment_time") or p.get("created_at") for p in legacy],
+        )
+        for p, credit in zip(legacy, credits):
+            p["credit_awarded"] = credit
+    return payments, bills
+
+
+# Spending rollups (migrations/013_spending_rollups.sql)
+#
+# create_payment_tx and create_payments_batch_tx add every payment to its
+# user's (month, category) row in the same transaction, so a monthly spend
+# chart reads one row per month and category instead of the payment history.
+
+SPENDING_ROLLUP_COLUMNS = "month, category, payments, total_paid, credits"
+# Users per spending_rollups_rebuild call; each call is one transaction
+SPENDING_ROLLUP_REBUILD_CHUNK = int(os.getenv("SPENDING_ROLLUP_REBUILD_CHUNK", "100"))
+
+
+def _spending_rollup_to_api(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "Month": str(row.get("month") or "")[:7],
+        "Category": row.get("category"),
+        "Payments": int(row.get("payments") or 0),
+        "TotalPaid": round(float(row.get("total_paid") or 0), 2),
+        "Credits": int(row.get("credits") or 0),
+    }
+
+
+def list_spending_rollups(user_id: str, months: int = 12) -> List[Dict[str, Any]]:
+    """Monthly spend per category of one user for the last `months` months
+    (current month included), oldest first."""
+    return run_sync(list_spending_rollups_op(get_client(), user_id, months))
+
+
+def list_spending_rollups_op(sb: Client, user_id: str, months: int = 12) -> StorageOp[List[Dict[str, Any]]]:
+    today = datetime.utcnow().date()
+    index = today.year * 12 + today.month - max(1, months)
+    first = date(index // 12, index % 12 + 1, 1)
+    res = yield (sb.table(T_SPENDING_ROLLUPS).select(SPENDING_ROLLUP_COLUMNS)
+                 .eq("user_id", user_id).gte("month", first.isoformat())
+                 .order("month").order("category"))
+    return [_spending_rollup_to_api(r) for r in res.data or []]
+
+
+def rebuild_spending_rollups(user_id: Optional[str] = None) -> Dict[str, int]:
+    """Recompute rollups from the raw payments (all users by default).
+
+    Users are processed SPENDING_ROLLUP_REBUILD_CHUNK at a time, each chunk
+    in its own transaction, so a rebuild never holds every user at once.
+    Returns the number of users and rollup rows rebuilt.
+    """
+    return run_sync(rebuild_spending_rollups_op(get_client(), user_id))
+
+
+def rebuild_spending_rollups_op(sb: Client, user_id: Optional[str] = None,
+                                chunk: Optional[int] = None) -> StorageOp[Dict[str, int]]:
+    chunk = max(1, chunk or SPENDING_ROLLUP_REBUILD_CHUNK)
+    users = rows = 0
+    after = None
+    while True:
+        if user_id is not None:
+            ids = [user_id] if after is None else []
+        else:
+            res = yield _keyset(sb.table(T_USER).select("id"), "id", chunk, after)
+            ids = [r["id"] for r in res.data or []]
+        if not ids:
+            break
+        res = yield sb.rpc("spending_rollups_rebuild", {"p_user_ids": ids})
+        data = res.data[0] if isinstance(res.data, list) and res.data else res.data
+        users += len(ids)
+        rows += int(data or 0)
+        if len(ids) < chunk:
+            break
+        after = ids[-1]
+    return {"users": users, "rows": rows}
 
 # Credit logs
 
-def list_credit_logs(user_id: str) -> List[Dict[str, Any]]:
-    sb = get_client()
-    # Try credit_log first (legacy numeric user_id), then fall back to credits table
-    try:
-        # Convert UUID to integer for credit_log table
-        user_id_int = int(user_id.replace('-', '')[:9], 16) % 2147483647
-        res = sb.table(T_CREDIT_LOG).select("*").eq("user_id", user_id_int).order("log_id").execute()
-        rows = res.data or []
-        if rows:
-            return [_credit_log_to_api(r) for r in rows]
-    except Exception:
-        pass
+def list_credit_logs(user_id: str, limit: Optional[int] = None,
+                     after: Optional[Any] = None) -> List[Dict[str, Any]]:
+    return run_sync(list_credit_logs_op(get_client(), user_id, limit=limit, after=after))
+
+
+def list_credit_logs_op(sb: Client, user_id: str, limit: Optional[int] = None,
+                        after: Optional[Any] = None) -> StorageOp[List[Dict[str, Any]]]:
+    # Try credit_log first (legacy numeric user_id), then fall back to credits table.
+    # An integer cursor is a credit_log log_id; anything else is a rewards-table id
+    # from a previous fallback page.
+    fallback_after = None
+    if after is not None and not str(after).isdigit():
+        fallback_after = str(after)
+    if fallback_after is None:
+        try:
+            user_id_int: Optional[int] = _user_id_int(user_id)
+        except ValueError:
+            # not a uuid, so no legacy credit_log rows can exist
+            user_id_int = None
+        if user_id_int is not None:
+            q = sb.table(T_CREDIT_LOG).select(CREDIT_LOG_COLUMNS).eq("user_id", user_id_int)
+            res = yield _keyset(q, "log_id", limit, int(after) if after is not None else None)
+            rows = res.data or []
+            if rows or after is not None:
+                return [_credit_log_to_api(r) for r in rows]
+        elif after is not None:
+            return []
     # fallback: map credits rows to credit log-like structures
     # rewards table has: id, user_id, total_credits (NO created_at field)
-    res2 = sb.table(T_CREDITS).select("*").eq("user_id", user_id).execute()
+    q2 = sb.table(T_CREDITS).select("*").eq("user_id", user_id)
+    res2 = yield _keyset(q2, "id", limit, fallback_after)
     rows2 = res2.data or []
     out = []
     for r in rows2:
@@ -628,75 +1189,119 @@ def list_credit_logs(user_id: str) -> List[Dict[str, Any]]:
         }))
     return out
 
+# Credit ledger
+
+def list_credit_ledger(user_id: str, limit: Optional[int] = None,
+                       after: Optional[int] = None) -> List[Dict[str, Any]]:
+    return run_sync(list_credit_ledger_op(get_client(), user_id, limit=limit, after=after))
+
+
+def list_credit_ledger_op(sb: Client, user_id: str, limit: Optional[int] = None,
+                          after: Optional[int] = None) -> StorageOp[List[Dict[str, Any]]]:
+    q = sb.table(T_CREDIT_LEDGER).select(CREDIT_LEDGER_COLUMNS).eq("user_id", user_id)
+    res = yield _keyset(q, "entry_id", limit, int(after) if after is not None else None)
+    return [_ledger_entry_to_api(r) for r in (res.data or [])]
+
 # Rewards
 
-def create_reward(type_: str, credit_cost: int, description: Optional[str] = None, icon: Optional[str] = None) -> Dict[str, Any]:
-    sb = get_client()
+def create_reward(type_: str, credit_cost: int, description: Optional[str] = None, icon: Optional[str] = None,
+                  stock: Optional[int] = None) -> Dict[str, Any]:
+    return run_sync(create_reward_op(get_client(), type_, credit_cost, description, icon, stock))
+
+
+def create_reward_op(sb: Client, type_: str, credit_cost: int, description: Optional[str] = None,
+                     icon: Optional[str] = None, stock: Optional[int] = None) -> StorageOp[Dict[str, Any]]:
     now = datetime.utcnow().isoformat()
     payload = {
         "item_name": type_,
         "item_description": description,
         "credit_cost": int(credit_cost),
-        "stock": 9999,  # default large stock unless managed separately
+        "stock": 9999 if stock is None else int(stock),  # default large stock unless limited
         "status": "active",
         "created_at": now,
         # Note: icon field not in credit_shop table, omitted
     }
-    res = sb.table(T_CREDIT_SHOP).insert(payload).execute()
+    res = yield sb.table(T_CREDIT_SHOP).insert(payload)
     # Get the inserted data - insert returns list of rows
     row = res.data[0] if res.data else None
     if not row:
         raise ValueError("Failed to create reward")
+    invalidate_catalog_cache(row.get("shop_item_id"))
     return _reward_to_api(row)
 
 
 def get_reward(reward_id: str) -> Optional[Dict[str, Any]]:
-    sb = get_client()
+    return run_sync(get_reward_op(get_client(), reward_id))
+
+
+def get_reward_op(sb: Client, reward_id: str) -> StorageOp[Optional[Dict[str, Any]]]:
+    row = yield from _shop_item(sb, reward_id)
+    return _reward_to_api(row) if row else None
+
+
+def _shop_item(sb: Client, reward_id: Any) -> StorageOp[Optional[Dict[str, Any]]]:
+    """credit_shop row by shop_item_id, read through the catalog cache."""
+    key = ("item", str(reward_id))
+    row = _catalog_cache.get(key)
+    if row is not None:
+        return row
     # try numeric shop_item_id first
     try:
         sid = int(reward_id)
-        row = _safe_single(sb.table(T_CREDIT_SHOP).select("*").eq("shop_item_id", sid))
-        return _reward_to_api(row) if row else None
+        row = yield from _safe_single(sb.table(T_CREDIT_SHOP).select("*").eq("shop_item_id", sid))
     except Exception:
         # fallback: try to find by other identifier (not implemented)
-        row = _safe_single(sb.table(T_CREDIT_SHOP).select("*").eq("shop_item_id", reward_id))
-        return _reward_to_api(row) if row else None
+        row = yield from _safe_single(sb.table(T_CREDIT_SHOP).select("*").eq("shop_item_id", reward_id))
+    if row:
+        _catalog_cache.set(key, row)
+    return row
 
 
 def list_rewards(active: Optional[bool] = None) -> List[Dict[str, Any]]:
-    sb = get_client()
+    return run_sync(list_rewards_op(get_client(), active))
+
+
+def list_rewards_op(sb: Client, active: Optional[bool] = None) -> StorageOp[List[Dict[str, Any]]]:
+    key = ("list", active)
+    rows = _catalog_cache.get(key)
+    if rows is None:
+        rows = yield from _list_shop_items(sb, active)
+        _catalog_cache.set(key, rows)
+    return [_reward_to_api(r) for r in rows]
+
+
+def _list_shop_items(sb: Client, active: Optional[bool]) -> StorageOp[List[Dict[str, Any]]]:
     q = sb.table(T_CREDIT_SHOP).select("*")
     if active is not None:
         if active:
             q = q.in_("status", ["active", "enabled", "available"])  # type: ignore[attr-defined]
         else:
             q = q.in_("status", ["inactive", "disabled"])  # type: ignore[attr-defined]
-    res = q.order("shop_item_id").execute()
-    return [_reward_to_api(r) for r in (res.data or [])]
+    res = yield q.order("shop_item_id")
+    return res.data or []
 
 # Redemption + debit credits
 
 def redeem_reward(user_id: str, reward_id: str) -> Dict[str, Any]:
-    sb = get_client()
-    now = datetime.utcnow().isoformat()
+    """Redeem a shop item: balance check, stock decrement, redemption row,
+    ledger debit and leaderboard update run as one transaction
+    (redeem_reward_tx, migrations/010_redeem_reward_tx.sql), so concurrent
+    redemptions can neither oversell the item nor overspend credits.
+    Hot items are served from in-memory stock tokens (_stock_tokens).
+    """
+    with account_locks.hold(f"user:{user_id}"):
+        return run_sync(redeem_reward_op(get_client(), user_id, reward_id))
 
-    # Fetch user profile
-    user_row = _safe_single(sb.table(T_USER).select("*").eq("id", user_id))
-    if not user_row:
-        raise ValueError("User not found")
 
-    # Determine shop item: reward_id may be numeric shop_item_id or uuid; try numeric first
-    shop_item = None
-    shop_item_id = None
-    try:
-        shop_item_id = int(reward_id)
-        shop_item = _safe_single(sb.table(T_CREDIT_SHOP).select("*").eq("shop_item_id", shop_item_id))
-    except Exception:
-        shop_item = None
+_REDEEM_ERRORS = ("User not found", "Reward not found", "Reward not active",
+                  "Insufficient credit", "Out of stock")
 
-    if not shop_item:
-        # fallback: try to match by shop item name or other identifier
-        shop_item = _safe_single(sb.table(T_CREDIT_SHOP).select("*").eq("shop_item_id", reward_id))
+
+def redeem_reward_op(sb: Client, user_id: str, reward_id: str) -> StorageOp[Dict[str, Any]]:
+    now = datetime.utcnow().isoformat()
+
+    # Determine shop item: reward_id may be numeric shop_item_id or uuid (served from catalog cache)
+    shop_item = yield from _shop_item(sb, reward_id)
 
     if not shop_item:
         raise ValueError("Reward not found")
@@ -705,60 +1310,157 @@ def redeem_reward(user_id: str, reward_id: str) -> Dict[str, Any]:
     if status not in ("active", "enabled", "available"):
         raise ValueError("Reward not active")
 
-    cost = int(shop_item.get("credit_cost", 0) or 0)
-    
-    # Get user's current credit balance from rewards table
-    balance = _recalc_user_credit(sb, user_id)
-    if balance < cost:
-        raise ValueError("Insufficient credit")
-
-    # Insert redemption into redemptions table (SQL schema uses reward_id uuid; we'll store reference in description)
-    red_payload = {
-        "user_id": user_id,
-        "reward_id": None,
-        "redemption_type": "credit_shop",
-        "amount": cost,
-        "description": f"shop_item:{shop_item.get('shop_item_id')}",
-        "created_at": now,
-    }
-    red_res = sb.table(T_REDEMPTION).insert(red_payload).execute()
-    red = red_res.data[0] if red_res.data else None
+    item_id = int(shop_item["shop_item_id"])
+    reserved = yield from _take_stock_token(sb, item_id)
+    try:
+        res = yield sb.rpc("redeem_reward_tx", {
+            "p_user_id": user_id,
+            "p_shop_item_id": item_id,
+            "p_reserved": reserved,
+            "p_now": now,
+        })
+    except Exception as e:
+        if reserved:
+            _stock_tokens.put_back(item_id)
+        message = getattr(e, "message", None) or str(e)  # postgrest APIError carries .message
+        for known in _REDEEM_ERRORS:
+            if known in message:
+                raise ValueError(known) from e
+        raise
+    red = res.data[0] if isinstance(res.data, list) and res.data else res.data
     if not red:
         raise ValueError("Failed to create redemption")
+    cost = int(red.get("amount") or 0)
+
+    # Credit log (-), written behind the request (credit_log_queue); the spool
+    # append is file I/O, so the async path runs it off the event loop
+    yield BlockingCall(credit_log_queue.append, {
+        "user_id": _user_id_int(user_id),
+        "source_type": "Redemption",
+        "source_id": item_id,
+        "change_amount": -cost,
+        "balance_after": red.get("balance_after"),
+        "created_at": now,
+    })
+    _leaderboard.record_redeemed(_user_id_int(user_id), cost, at=now)
 
-    # Update user's credit balance in profiles table
-    new_balance = balance - cost
-    sb.table(T_USER).update({
-        "credits": new_balance
-    }).eq("id", user_id).execute()
+    yield from _release_stock_tokens(sb, _stock_tokens.drain_idle())
+    return _redemption_to_api(red)
 
-    # Credit log (-) - handle integer user_id type mismatch
-    try:
-        sb.table(T_CREDIT_LOG).insert({
-            "user_id": int(user_id.replace('-', '')[:9], 16) % 2147483647,
-            "source_type": "Redemption",
-            "source_id": shop_item.get("shop_item_id"),
-            "change_amount": -cost,
-            "balance_after": new_balance,
-            "created_at": now,
-        }).execute()
-    except Exception as e:
-        # If credit_log fails (type mismatch), skip it but continue
-        print(f"Warning: Could not insert into credit_log: {e}")
 
-    # Return redemption record
-    return _redemption_to_api(red)
+def _take_stock_token(sb: Client, item_id: int) -> StorageOp[bool]:
+    """True when the redemption is backed by a locally reserved unit of stock.
+
+    Cold items return False (redeem_reward_tx decrements the stock row).
+    For hot items a token is taken from memory, reserving the next
+    REDEEM_TOKEN_BATCH units from the database when none are left.
+    """
+    if not _stock_tokens.hit(item_id):
+        return False
+    if _stock_tokens.take(item_id):
+        return True
+    res = yield sb.rpc("reserve_stock", {"p_shop_item_id": item_id, "p_count": _stock_tokens.batch})
+    granted = int((res.data[0] if isinstance(res.data, list) and res.data else res.data) or 0)
+    if granted <= 0:
+        # Units held by redemptions that failed meanwhile are put back locally
+        if _stock_tokens.take(item_id):
+            return True
+        raise ValueError("Out of stock")
+    _stock_tokens.add(item_id, granted - 1)
+    return True
+
+
+def _release_stock_tokens(sb: Client, drained: List[Tuple[Any, int]]) -> StorageOp[None]:
+    for item_id, count in drained:
+        try:
+            yield sb.rpc("release_stock", {"p_shop_item_id": item_id, "p_count": count})
+        except Exception as e:
+            print(f"Warning: Could not release {count} reserved units of shop item {item_id}: {e}")
+
+
+def release_stock_tokens() -> None:
+    """Hand every locally reserved unit of stock back (on shutdown)."""
+    run_sync(release_stock_tokens_op(get_client()))
+
+
+def release_stock_tokens_op(sb: Client) -> StorageOp[None]:
+    yield from _release_stock_tokens(sb, _stock_tokens.drain_all())
+
+
+def stock_token_stats() -> Dict[str, Any]:
+    return _stock_tokens.stats()
 
 # Redemptions
 
-def list_redemptions(user_id: str) -> List[Dict[str, Any]]:
-    sb = get_client()
-    res = sb.table(T_REDEMPTION).select("*").eq("user_id", user_id).order("id").execute()
+def list_redemptions(user_id: str, limit: Optional[int] = None,
+                     after: Optional[str] = None) -> List[Dict[str, Any]]:
+    return run_sync(list_redemptions_op(get_client(), user_id, limit=limit, after=after))
+
+
+def list_redemptions_op(sb: Client, user_id: str, limit: Optional[int] = None,
+                        after: Optional[str] = None) -> StorageOp[List[Dict[str, Any]]]:
+    q = sb.table(T_REDEMPTION).select(REDEMPTION_COLUMNS).eq("user_id", user_id)
+    res = yield _keyset(q, "id", limit, after)
     return [_redemption_to_api(r) for r in (res.data or [])]
 
 # Leaderboard
 
 def get_leaderboard(limit: int = 10) -> List[Dict[str, Any]]:
-    sb = get_client()
-    res = sb.table(T_LEADERBOARD).select("*").order("total_credit_earned", desc=True).limit(limit).execute()
-    return [_leaderboard_to_api(r) for r in (res.data or [])]
\ No newline at end of file
+    return run_sync(get_leaderboard_op(get_client(), limit))
+
+
+def get_leaderboard_op(sb: Client, limit: int = 10) -> StorageOp[List[Dict[str, Any]]]:
+    """Top `limit` users by credits earned, read from the in-memory board."""
+    yield from _ensure_leaderboard(sb)
+    return [_leaderboard_to_api(r) for r in _leaderboard.top(limit)]
+
+
+def get_leaderboard_rank(user_id: str) -> Optional[Dict[str, Any]]:
+    return run_sync(get_leaderboard_rank_op(get_client(), user_id))
+
+
+def get_leaderboard_rank_op(sb: Client, user_id: str) -> StorageOp[Optional[Dict[str, Any]]]:
+    """Leaderboard entry plus 1-based Rank for a profiles uuid (None if unranked)."""
+    yield from _ensure_leaderboard(sb)
+    key = _user_id_int(user_id)
+    entry = _leaderboard.get(key)
+    if entry is None:
+        return None
+    return {**_leaderboard_to_api(entry), "Rank": _leaderboard.rank(key)}
+
+
+# Rows fetched per request when rebuilding the board
+_LEADERBOARD_PAGE = 1000
+LEADERBOARD_COLUMNS = "user_id, total_credit_earned, total_redeemed, last_updated"
+
+
+def _ensure_leaderboard(sb: Client) -> StorageOp[None]:
+    if _leaderboard.needs_rebuild():
+        since = _leaderboard.begin_rebuild()
+        try:
+            totals = yield from _leaderboard_totals(sb)
+        except BaseException:
+            _leaderboard.end_rebuild()
+            raise
+        _leaderboard.rebuild(totals, since)
+
+
+def _leaderboard_totals(sb: Client) -> StorageOp[List[Dict[str, Any]]]:
+    """Every leaderboard row (paged by user_id), each tagged with the board
+    position it was read at.
+
+    The payment and redemption functions update the leaderboard table in
+    their own transactions (leaderboard_add), so it is complete and current;
+    credit_log is not, since redemption rows are written behind.
+    """
+    totals: List[Dict[str, Any]] = []
+    after = None
+    while True:
+        as_of = _leaderboard.position()
+        res = yield _keyset(sb.table(T_LEADERBOARD).select(LEADERBOARD_COLUMNS), "user_id",
+                            _LEADERBOARD_PAGE, after)
+        rows = res.data or []
+        totals.extend({**r, "as_of": as_of} for r in rows)
+        if len(rows) < _LEADERBOARD_PAGE:
+            return totals
+        after = rows[-1]["user_id"]
@@ -0,0 +1,183 @@
+"""Async variants of the db.py operations.
+
+Same operations, names and return shapes as db.py; each one runs the shared
+db.<name>_op generator on the async client (see storage.run_async), so the
+FastAPI handlers in reward.py can await storage without tying up the
+threadpool.
+"""
+from __future__ import annotations
+
+import asyncio
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+import db
+from analytics import spending_summary
+from locks import AsyncLockManager
+from storage import run_async
+
+# Payments of one bill and redemptions of one user run one at a time in this
+# process; other bills and users are not held up (LockTimeout after
+# LOCK_TIMEOUT_SECONDS).
+account_locks = AsyncLockManager("reward_account")
+
+
+# Users
+
+async def get_user(user_id: str) -> Optional[Dict[str, Any]]:
+    return await run_async(db.get_user_op(await db.get_async_client(), user_id))
+
+
+async def list_users(limit: Optional[int] = None, offset: int = 0,
+                     stats: Optional[Dict[str, int]] = None,
+                     after: Optional[str] = None) -> List[Dict[str, Any]]:
+    return await run_async(db.list_users_op(await db.get_async_client(), limit, offset, stats, after))
+
+
+async def create_user(username: str, email: str, password_hash: Optional[str] = None) -> Dict[str, Any]:
+    return await run_async(db.create_user_op(await db.get_async_client(), username, email, password_hash))
+
+
+async def ensure_user(user_id: str, email: str, username: Optional[str] = None) -> Dict[str, Any]:
+    return await run_async(db.ensure_user_op(await db.get_async_client(), user_id, email, username))
+
+
+async def delete_user_by_email(email: str) -> Dict[str, Any]:
+    return await run_async(db.delete_user_by_email_op(await db.get_async_client(), email))
+
+
+async def init_user(user_id: str, email: str, username: Optional[str] = None) -> Dict[str, Any]:
+    return await run_async(db.init_user_op(await db.get_async_client(), user_id, email, username))
+
+
+# Bills
+
+async def create_bill(user_id: str, title: str, amount: float, due_date: date, category: str,
+                      description: Optional[str] = None, receiver_bank: Optional[str] = None,
+                      receiver_name: Optional[str] = None) -> Dict[str, Any]:
+    return await run_async(db.create_bill_op(
+        await db.get_async_client(), user_id, title, amount, due_date, category,
+        description=description, receiver_bank=receiver_bank, receiver_name=receiver_name,
+    ))
+
+
+async def create_bills(bills: List[Dict[str, Any]]) -> db.BillImportResult:
+    return await run_async(db.create_bills_op(await db.get_async_client(), bills))
+
+
+async def get_bill(bill_id: str) -> Optional[Dict[str, Any]]:
+    return await run_async(db.get_bill_op(await db.get_async_client(), bill_id))
+
+
+async def list_bills(user_id: Optional[str] = None, limit: Optional[int] = None,
+                     after: Optional[str] = None) -> List[Dict[str, Any]]:
+    return await run_async(db.list_bills_op(await db.get_async_client(), user_id, limit=limit, after=after))
+
+
+# Payments
+
+async def create_payment(bill_id: str, amount_paid: float, payment_method: str,
+                         payer_name: Optional[str] = None, payer_bank: Optional[str] = None,
+                         order_number: Optional[str] = None, remark: Optional[str] = None) -> Dict[str, Any]:
+    async with account_locks.hold(f"bill:{bill_id}"):
+        return await run_async(db.create_payment_op(
+            await db.get_async_client(), bill_id, amount_paid, payment_method,
+            payer_name=payer_name, payer_bank=payer_bank, order_number=order_number, remark=remark,
+        ))
+
+
+async def list_payments(user_id: Optional[str] = None, bill_id: Optional[str] = None,
+                        limit: Optional[int] = None, after: Optional[str] = None) -> List[Dict[str, Any]]:
+    return await run_async(db.list_payments_op(
+        await db.get_async_client(), user_id=user_id, bill_id=bill_id, limit=limit, after=after,
+    ))
+
+
+async def create_payments_batch(items: List[Dict[str, Any]], payment_method: str,
+                                payer_name: Optional[str] = None, payer_bank: Optional[str] = None,
+                                remark: Optional[str] = None) -> Dict[str, Any]:
+    return await run_async(db.create_payments_batch_op(
+        await db.get_async_client(), items, payment_method,
+        payer_name=payer_name, payer_bank=payer_bank, remark=remark,
+    ))
+
+
+async def get_payment(payment_id: str) -> Optional[Dict[str, Any]]:
+    return await run_async(db.get_payment_op(await db.get_async_client(), payment_id))
+
+
+async def get_spending_analytics(user_id: str, months: int = 12) -> Dict[str, Any]:
+    history = db.cached_spending_history(user_id)
+    if history is None:
+        payments, bills = await run_async(db.spending_history_op(await db.get_async_client(), user_id))
+        # Building the columns is per-row Python work; keep it off the event loop
+        history = await asyncio.to_thread(db.build_spending_history, user_id, payments, bills)
+    return spending_summary(user_id, history, months=months)
+
+
+async def list_spending_rollups(user_id: str, months: int = 12) -> List[Dict[str, Any]]:
+    return await run_async(db.list_spending_rollups_op(await db.get_async_client(), user_id, months))
+
+
+async def rebuild_spending_rollups(user_id: Optional[str] = None) -> Dict[str, int]:
+    return await run_async(db.rebuild_spending_rollups_op(await db.get_async_client(), user_id))
+
+
+# Credit logs
+
+async def list_credit_logs(user_id: str, limit: Optional[int] = None,
+                           after: Optional[Any] = None) -> List[Dict[str, Any]]:
+    return await run_async(db.list_credit_logs_op(await db.get_async_client(), user_id, limit=limit, after=after))
+
+
+# Credit ledger
+
+async def list_credit_ledger(user_id: str, limit: Optional[int] = None,
+                             after: Optional[int] = None) -> List[Dict[str, Any]]:
+    return await run_async(db.list_credit_ledger_op(await db.get_async_client(), user_id, limit=limit, after=after))
+
+
+async def snapshot_credit_balances(user_id: Optional[str] = None) -> int:
+    return await run_async(db.snapshot_credit_balances_op(await db.get_async_client(), user_id))
+
+
+# Rewards
+
+async def create_reward(type_: str, credit_cost: int, description: Optional[str] = None,
+                        icon: Optional[str] = None, stock: Optional[int] = None) -> Dict[str, Any]:
+    return await run_async(db.create_reward_op(await db.get_async_client(), type_, credit_cost, description,
+                                               icon, stock))
+
+
+async def get_reward(reward_id: str) -> Optional[Dict[str, Any]]:
+    return await run_async(db.get_reward_op(await db.get_async_client(), reward_id))
+
+
+async def list_rewards(active: Optional[bool] = None) -> List[Dict[str, Any]]:
+    return await run_async(db.list_rewards_op(await db.get_async_client(), active))
+
+
+# Redemptions
+
+async def redeem_reward(user_id: str, reward_id: str) -> Dict[str, Any]:
+    async with account_locks.hold(f"user:{user_id}"):
+        return await run_async(db.redeem_reward_op(await db.get_async_client(), user_id, reward_id))
+
+
+async def release_stock_tokens() -> None:
+    await run_async(db.release_stock_tokens_op(await db.get_async_client()))
+
+
+async def list_redemptions(user_id: str, limit: Optional[int] = None,
+                           after: Optional[str] = None) -> List[Dict[str, Any]]:
+    return await run_async(db.list_redemptions_op(await db.get_async_client(), user_id, limit=limit, after=after))
+
+
+# Leaderboard
+
+async def get_leaderboard(limit: int = 10) -> List[Dict[str, Any]]:
+    return await run_async(db.get_leaderboard_op(await db.get_async_client(), limit))
+
+
+async def get_leaderboard_rank(user_id: str) -> Optional[Dict[str, Any]]:
+    return await run_async(db.get_leaderboard_rank_op(await db.get_async_client(), user_id))
@@ -0,0 +1,88 @@
+"""Streaming NDJSON/CSV exports of a user's history.
+
+Rows are fetched a page at a time with the same keyset cursors the list routes
+use (see pagination.py) and written out as they arrive, so memory stays flat
+and the first bytes go out after the first page, however long the history is.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import json
+import os
+import re
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Type
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from pagination import field_names
+
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "500"))
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# Characters allowed in the Content-Disposition filename; anything else
+# (quotes, CR/LF, non-ASCII from path parameters) becomes "_"
+_UNSAFE_FILENAME = re.compile(r"[^A-Za-z0-9_-]")
+
+# fetch(limit, after) -> one page of API dicts
+PageFetcher = Callable[[int, Optional[Any]], Awaitable[List[Dict[str, Any]]]]
+
+
+async def iter_rows(fetch: PageFetcher, cursor_key: str,
+                    page_size: int = EXPORT_PAGE_SIZE) -> AsyncIterator[Dict[str, Any]]:
+    """Yield every row, walking pages until a short one comes back."""
+    after: Optional[Any] = None
+    while True:
+        page = await fetch(page_size, after)
+        for row in page:
+            yield row
+        if len(page) < page_size:
+            return
+        after = page[-1][cursor_key]
+
+
+async def _ndjson(rows: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    async for row in rows:
+        yield json.dumps(row, default=str) + "\n"
+
+
+async def _csv(rows: AsyncIterator[Dict[str, Any]], columns: List[str]) -> AsyncIterator[str]:
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=columns, extrasaction="ignore")
+    writer.writeheader()
+    async for row in rows:
+        writer.writerow(row)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def export_response(fetch: PageFetcher, cursor_key: str, model: Type[BaseModel],
+                    fmt: str, filename: str) -> StreamingResponse:
+    """StreamingResponse of every row `fetch` pages through, as NDJSON or CSV."""
+    fmt = (fmt or "ndjson").lower()
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported format {fmt!r}; expected one of {', '.join(EXPORT_FORMATS)}",
+        )
+
+    async def rows() -> AsyncIterator[Dict[str, Any]]:
+        async for row in iter_rows(fetch, cursor_key):
+            yield model(**row).model_dump(mode="json", by_alias=True)
+
+    body = _ndjson(rows()) if fmt == "ndjson" else _csv(rows(), field_names(model))
+    filename = _UNSAFE_FILENAME.sub("_", filename) or "export"
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'},
+    )
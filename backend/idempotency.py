@@ -0,0 +1,239 @@
+"""Idempotency-Key support for payment endpoints.
+
+A client sends `Idempotency-Key: <unique string>` with a request. The first
+request with a key runs normally and its successful (2xx) response is
+stored; repeats with the same key get the stored response back (with
+`Idempotent-Replayed: true`) without running the handler again, so a
+retry after a timeout cannot charge a card or award credits twice.
+
+- Completed responses live in a bounded, expiring in-process store
+  (IDEMPOTENCY_CACHE_SIZE entries for IDEMPOTENCY_TTL seconds).
+- A duplicate that arrives while the first attempt is still running waits
+  for it instead of racing it.
+- With IDEMPOTENCY_PERSIST=1, keys are also claimed in the
+  idempotency_keys table (migrations/007_idempotency_keys.sql), which
+  extends the guarantee across workers and restarts: a worker that finds a
+  pending claim polls until the owner completes or IDEMPOTENCY_WAIT_SECONDS
+  pass (then answers 409).
+
+Reusing a key with a different request body is rejected with 422. Failed
+attempts (exceptions, non-2xx, and 2xx bodies the route's `should_store`
+rejects, e.g. a declined card payment) are not stored, so they can be
+retried.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from cache import TTLCache
+from metrics import register_cache
+from storage import StorageOp, run_async
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_PERSIST = os.getenv("IDEMPOTENCY_PERSIST", "0").strip().lower() in ("1", "true", "yes")
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+IDEMPOTENCY_PENDING_TIMEOUT = float(os.getenv("IDEMPOTENCY_PENDING_TIMEOUT", "120"))
+MAX_KEY_LENGTH = 255
+
+T_IDEMPOTENCY = "idempotency_keys"
+
+# (request fingerprint, status code, JSON body) per scoped key
+StoredResponse = Tuple[str, int, Any]
+
+_completed = register_cache(TTLCache(
+    maxsize=int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000")),
+    ttl=IDEMPOTENCY_TTL,
+    name="idempotency",
+))
+_in_flight: Dict[str, "asyncio.Future[None]"] = {}
+
+
+def fingerprint(payload: Any) -> str:
+    """Stable hash of a request body (pydantic model or JSON-able value)."""
+    body = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def _replay(stored: StoredResponse, request_hash: str) -> JSONResponse:
+    stored_hash, status_code, body = stored
+    if stored_hash != request_hash:
+        raise HTTPException(
+            status_code=422,
+            detail=f"{IDEMPOTENCY_HEADER} was already used with a different request",
+        )
+    return JSONResponse(content=body, status_code=status_code, headers={REPLAYED_HEADER: "true"})
+
+
+async def idempotent(key: Optional[str], scope: str, payload: Any,
+                     handler: Callable[[], Awaitable[Any]],
+                     should_store: Optional[Callable[[Any], bool]] = None) -> Any:
+    """Run handler at most once per (scope, key); replay its response after that.
+
+    `should_store(body)` can reject a 2xx JSON body that reports a failure,
+    so the key stays free for a retry. Without a key this is just
+    `await handler()`.
+    """
+    if not key:
+        return await handler()
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"{IDEMPOTENCY_HEADER} is longer than {MAX_KEY_LENGTH}")
+    scoped = f"{scope}:{key}"
+    request_hash = fingerprint(payload)
+
+    while True:
+        stored = _completed.get(scoped)
+        if stored is not None:
+            return _replay(stored, request_hash)
+        pending = _in_flight.get(scoped)
+        if pending is None:
+            break
+        # Same key already running in this worker: wait for it, then re-check
+        await asyncio.shield(pending)
+
+    done: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+    _in_flight[scoped] = done
+    try:
+        if IDEMPOTENCY_PERSIST:
+            stored = await _claim_persistent(scoped, request_hash)
+            if stored is not None:
+                _completed.set(scoped, stored)
+                return _replay(stored, request_hash)
+        try:
+            result = await handler()
+        except BaseException:
+            if IDEMPOTENCY_PERSIST:
+                await _release_persistent(scoped)
+            raise
+        status_code = getattr(result, "status_code", 200)
+        body = _response_body(result)
+        if (body is None or not 200 <= status_code < 300
+                or (should_store is not None and not should_store(body))):
+            if IDEMPOTENCY_PERSIST:
+                await _release_persistent(scoped)
+            return result
+        stored = (request_hash, status_code, body)
+        _completed.set(scoped, stored)
+        if IDEMPOTENCY_PERSIST:
+            await _complete_persistent(scoped, stored)
+        return JSONResponse(content=body, status_code=status_code)
+    finally:
+        _in_flight.pop(scoped, None)
+        done.set_result(None)
+
+
+def _response_body(result: Any) -> Any:
+    """JSON body of a handler result; None for responses we cannot store."""
+    if isinstance(result, JSONResponse):
+        return json.loads(result.body)
+    if hasattr(result, "status_code") and hasattr(result, "body"):
+        return None
+    return jsonable_encoder(result, by_alias=True)
+
+
+# ---------- Persistent claims (IDEMPOTENCY_PERSIST=1) ----------
+
+async def _client() -> Any:
+    import db
+    return await db.get_async_client()
+
+
+def _age_seconds(row: Dict[str, Any]) -> float:
+    try:
+        created_at = datetime.fromisoformat(str(row.get("created_at")).replace("Z", "+00:00"))
+    except ValueError:
+        return 0.0
+    return (datetime.utcnow() - created_at.replace(tzinfo=None)).total_seconds()
+
+
+def _expired(row: Dict[str, Any]) -> bool:
+    """Completed rows expire after IDEMPOTENCY_TTL; pending claims left behind by
+    a crashed worker are abandoned after IDEMPOTENCY_PENDING_TIMEOUT."""
+    limit = IDEMPOTENCY_TTL if row.get("status_code") is not None else IDEMPOTENCY_PENDING_TIMEOUT
+    return _age_seconds(row) > limit
+
+
+def _stored_from_row(row: Dict[str, Any]) -> Optional[StoredResponse]:
+    if row.get("status_code") is None:
+        return None
+    return (row["request_hash"], int(row["status_code"]), json.loads(row["response_body"]))
+
+
+def claim_op(sb: Any, scoped: str, request_hash: str) -> StorageOp[Tuple[bool, Optional[Dict[str, Any]]]]:
+    """Try to claim the key; returns (claimed, existing row)."""
+    res = yield sb.table(T_IDEMPOTENCY).select("*").eq("idempotency_key", scoped).limit(1)
+    row = (res.data or [None])[0]
+    if row is not None and _expired(row):
+        yield sb.table(T_IDEMPOTENCY).delete().eq("idempotency_key", scoped)
+        row = None
+    if row is not None:
+        return False, row
+    try:
+        yield sb.table(T_IDEMPOTENCY).insert({
+            "idempotency_key": scoped,
+            "request_hash": request_hash,
+            "created_at": datetime.utcnow().isoformat(),
+        })
+    except Exception:
+        # Another worker claimed it between our select and insert
+        res = yield sb.table(T_IDEMPOTENCY).select("*").eq("idempotency_key", scoped).limit(1)
+        return False, (res.data or [None])[0]
+    return True, None
+
+
+async def _claim_persistent(scoped: str, request_hash: str) -> Optional[StoredResponse]:
+    """Claim the key, or wait for the worker that holds it and return its response."""
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    delay = 0.02
+    while True:
+        claimed, row = await run_async(claim_op(await _client(), scoped, request_hash))
+        if claimed:
+            return None
+        if row is not None:
+            stored = _stored_from_row(row)
+            if stored is not None:
+                return stored
+        if time.monotonic() >= deadline:
+            raise HTTPException(
+                status_code=409,
+                detail=f"A request with this {IDEMPOTENCY_HEADER} is still being processed",
+            )
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.5)
+
+
+async def _complete_persistent(scoped: str, stored: StoredResponse) -> None:
+    _, status_code, body = stored
+    try:
+        sb = await _client()
+        await run_async(_single(sb.table(T_IDEMPOTENCY).update({
+            "status_code": status_code,
+            "response_body": json.dumps(body),
+        }).eq("idempotency_key", scoped)))
+    except Exception as e:
+        print(f"Warning: Could not persist idempotent response for {scoped}: {e}")
+
+
+async def _release_persistent(scoped: str) -> None:
+    try:
+        sb = await _client()
+        await run_async(_single(sb.table(T_IDEMPOTENCY).delete().eq("idempotency_key", scoped)))
+    except Exception as e:
+        print(f"Warning: Could not release idempotency key {scoped}: {e}")
+
+
+def _single(query: Any) -> StorageOp[Any]:
+    res = yield query
+    return res
@@ -2,8 +2,20 @@
 
 This script creates 10 UK bank cards with £1000 each.
 Run this script to populate the bank database.
+
+With --synthetic N it also generates N Luhn-valid UK cards (realistic sort
+codes per bank) for benchmarking at scale; all cards are bulk-inserted in
+batches (--batch-size, default BANK_SEED_BATCH) and the result is verified
+with one aggregate query.
+
+    python init_bank_cards.py --reset --synthetic 1000000
 """
-from bank_db import create_bank_card, list_bank_cards, delete_all_cards
+import argparse
+import random
+import time
+from typing import Dict, Iterator
+
+from bank_db import create_bank_cards, delete_all_cards, get_bank_card_by_number, get_card_stats
 
 # UK bank card data - 10 cards with different UK banks
 UK_BANK_CARDS = [
@@ -90,11 +102,82 @@ UK_BANK_CARDS = [
 ]
 
 
-def init_bank_cards(reset: bool = False):
+# Synthetic card issuers: (bank, 6-digit BIN, sort code prefixes).
+# BINs do not overlap the fixed cards above, so generated numbers never clash.
+SYNTHETIC_BANKS = [
+    ("Barclays", "465943", ["20"]),
+    ("HSBC", "465858", ["40"]),
+    ("Lloyds Bank", "475118", ["30", "77"]),
+    ("NatWest", "475710", ["60", "50"]),
+    ("Santander UK", "476344", ["09"]),
+    ("Royal Bank of Scotland", "475131", ["83", "16"]),
+    ("Metro Bank", "535522", ["23"]),
+    ("Nationwide", "475183", ["07"]),
+    ("TSB Bank", "492181", ["87", "77"]),
+    ("Monzo", "535589", ["04"]),
+]
+
+FIRST_NAMES = [
+    "Oliver", "George", "Harry", "Jack", "Noah", "Charlie", "Leo", "Arthur", "Oscar", "Henry",
+    "Olivia", "Amelia", "Isla", "Ava", "Mia", "Ivy", "Lily", "Sophia", "Grace", "Freya",
+]
+LAST_NAMES = [
+    "Smith", "Jones", "Taylor", "Brown", "Williams", "Wilson", "Johnson", "Davies", "Robinson",
+    "Wright", "Thompson", "Evans", "Walker", "White", "Roberts", "Green", "Hall", "Wood",
+    "Jackson", "Clarke",
+]
+
+# Multiplier coprime with 10**9: spreads serial numbers without repeats
+_SERIAL_STRIDE = 738_219_047
+
+
+# Luhn value of a doubled digit (2d, minus 9 when it has two digits)
+_LUHN_DOUBLED = (0, 2, 4, 6, 8, 1, 3, 5, 7, 9)
+
+
+def luhn_check_digit(partial: str) -> str:
+    """Digit that makes partial + digit pass the Luhn check."""
+    digits = [int(ch) for ch in reversed(partial)]
+    total = sum(_LUHN_DOUBLED[d] for d in digits[0::2]) + sum(digits[1::2])
+    return str((10 - total % 10) % 10)
+
+
+def generate_uk_cards(count: int, seed: int = 0) -> Iterator[Dict[str, str]]:
+    """Yield `count` unique, Luhn-valid synthetic UK debit cards.
+
+    Card i belongs to SYNTHETIC_BANKS[i % 10]; its 9-digit serial and 8-digit
+    account number are permutations of i, so numbers are unique up to 10**9
+    cards per bank. Names come from a seeded RNG, so runs are reproducible.
+    """
+    rng = random.Random(seed)
+    banks = len(SYNTHETIC_BANKS)
+    for i in range(count):
+        bank_name, bin_prefix, sort_prefixes = SYNTHETIC_BANKS[i % banks]
+        serial = (i // banks * _SERIAL_STRIDE + seed) % 10**9
+        partial = f"{bin_prefix}{serial:09d}"
+        yield {
+            "card_number": partial + luhn_check_digit(partial),
+            "card_holder_name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "sort_code": f"{rng.choice(sort_prefixes)}-{rng.randrange(100):02d}-{rng.randrange(100):02d}",
+            "account_number": f"{(i * 7_919 + seed) % 10**8:08d}",
+            "bank_name": bank_name,
+            "card_type": "Debit",
+        }
+
+
+def _with_balance(cards, balance: float) -> Iterator[Dict[str, object]]:
+    for card in cards:
+        yield {**card, "balance": balance}
+
+
+def init_bank_cards(reset: bool = False, synthetic: int = 0, batch_size: int = 0, seed: int = 0):
     """Initialize bank cards in the database.
     
     Args:
         reset: If True, delete all existing cards before creating new ones
+        synthetic: Number of generated cards to add after the fixed ten
+        batch_size: Rows per insert statement (0 = BANK_SEED_BATCH)
+        seed: Seed for generated card numbers and names
     """
     print("🏦 UK Bank Card System - Initialization")
     print("=" * 50)
@@ -107,56 +190,57 @@ def init_bank_cards(reset: bool = False):
     print(f"\n📝 Creating {len(UK_BANK_CARDS)} UK bank cards...")
     print("-" * 50)
     
-    created_count = 0
+    # £1000 initial balance; existing card numbers are left untouched
+    existing = {c["card_number"] for c in UK_BANK_CARDS
+                if get_bank_card_by_number(c["card_number"], fresh=True)}
+    create_bank_cards(_with_balance(UK_BANK_CARDS, 1000.00), batch_size=batch_size or None)
     for card_data in UK_BANK_CARDS:
-        try:
-            card = create_bank_card(
-                card_number=card_data["card_number"],
-                card_holder_name=card_data["card_holder_name"],
-                sort_code=card_data["sort_code"],
-                account_number=card_data["account_number"],
-                balance=1000.00,  # £1000 initial balance
-                bank_name=card_data["bank_name"],
-                card_type=card_data["card_type"],
-            )
-            created_count += 1
-            print(f"✓ Created card for {card_data['card_holder_name']:20} | "
+        if card_data["card_number"] in existing:
+            print(f"• Card for {card_data['card_holder_name']:20} | "
+                  f"{card_data['bank_name']:20} | "
+                  f"Already exists, balance unchanged")
+        else:
+            print(f"✓ Card for {card_data['card_holder_name']:20} | "
                   f"{card_data['bank_name']:20} | "
                   f"Balance: £1000.00")
-        except Exception as e:
-            print(f"✗ Failed to create card for {card_data['card_holder_name']}: {e}")
-    
-    print("-" * 50)
-    print(f"✅ Successfully created {created_count}/{len(UK_BANK_CARDS)} bank cards")
-    
-    # List all cards to verify
-    print("\n📊 Current Bank Cards in Database:")
-    print("-" * 50)
-    cards = list_bank_cards()
-    total_balance = 0
     
-    for i, card in enumerate(cards, 1):
-        balance = float(card.get("balance", 0))
-        total_balance += balance
-        print(f"{i:2}. {card.get('card_holder_name'):20} | "
-              f"{card.get('bank_name'):20} | "
-              f"Card: ****{card.get('card_number', '')[-4:]} | "
-              f"Balance: £{balance:.2f}")
+    if synthetic:
+        print("-" * 50)
+        print(f"🧪 Generating {synthetic:,} synthetic UK cards...")
+        before = get_card_stats()["card_count"]
+        started = time.perf_counter()
+        sent = create_bank_cards(
+            _with_balance(generate_uk_cards(synthetic, seed=seed), 1000.00),
+            batch_size=batch_size or None,
+        )
+        elapsed = time.perf_counter() - started
+        # duplicates are skipped by the upsert, so count what actually landed
+        inserted = get_card_stats()["card_count"] - before
+        print(f"✓ Inserted {inserted:,} of {sent:,} cards sent in {elapsed:.1f}s "
+              f"({sent / max(elapsed, 1e-9):,.0f} cards/s)")
     
+    # Verify with one aggregate query
     print("-" * 50)
-    print(f"📈 Total Balance Across All Cards: £{total_balance:.2f}")
-    print(f"💳 Total Cards: {len(cards)}")
+    stats = get_card_stats()
+    print(f"📈 Total Balance Across All Cards: £{stats['total_balance']:,.2f}")
+    print(f"💳 Total Cards: {stats['card_count']:,}")
     print("\n✨ Initialization complete!")
 
 
 if __name__ == "__main__":
     import sys
     
-    # Check if --reset flag is provided
-    reset = "--reset" in sys.argv or "-r" in sys.argv
+    parser = argparse.ArgumentParser(description="Seed the bank card database")
+    parser.add_argument("-r", "--reset", action="store_true", help="delete all cards first")
+    parser.add_argument("--synthetic", type=int, default=0, metavar="N",
+                        help="also generate N Luhn-valid synthetic cards")
+    parser.add_argument("--batch-size", type=int, default=0, help="rows per insert statement")
+    parser.add_argument("--seed", type=int, default=0, help="seed for synthetic cards")
+    args = parser.parse_args()
     
     try:
-        init_bank_cards(reset=reset)
+        init_bank_cards(reset=args.reset, synthetic=args.synthetic,
+                        batch_size=args.batch_size, seed=args.seed)
     except Exception as e:
         print(f"\n❌ Error: {e}")
         print("\n💡 Make sure you have set BANK_SUPABASE_URL and BANK_SUPABASE_KEY in your .env file")
@@ -0,0 +1,146 @@
+"""In-memory leaderboard engine.
+
+Keeps every user's totals plus a sorted array of (-total_credit_earned, user_id)
+keys, so the board is maintained incrementally as credits are awarded or
+redeemed instead of being re-sorted per request:
+
+- top(k): O(k) slice of the sorted array
+- rank(user_id): O(log n) bisect
+- record_earned / record_redeemed: O(log n) search + one list insert/delete
+
+rebuild() reloads the whole board from the leaderboard table (cold start,
+or periodically so other workers' updates are picked up). The scan takes
+several requests, so updates recorded here meanwhile are journaled and
+replayed on top of the rows the scan read before them; see begin_rebuild.
+"""
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class LeaderboardEngine:
+    def __init__(self, refresh_seconds: float = 300.0):
+        self.refresh_seconds = refresh_seconds
+        self._keys: List[Tuple[int, str]] = []
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._loaded_at: Optional[float] = None
+        # Updates recorded so far; journaled while a rebuild scan is running
+        self._position = 0
+        self._scans = 0
+        self._journal: List[Tuple[int, str, int, int, str]] = []
+
+    def needs_rebuild(self) -> bool:
+        if self._loaded_at is None:
+            return True
+        return self.refresh_seconds > 0 and time.monotonic() - self._loaded_at > self.refresh_seconds
+
+    def position(self) -> int:
+        """Number of updates recorded so far (a scan's "as_of" marker)."""
+        with self._lock:
+            return self._position
+
+    def begin_rebuild(self) -> int:
+        """Start journaling updates for a rebuild scan; returns its start position.
+
+        The scan tags each row with the position() taken just before the row
+        was requested ("as_of"). rebuild() then replays the journaled updates
+        recorded after that, and every journaled update of users the scan did
+        not return, so updates made during the scan are neither lost nor
+        counted twice. Each begin_rebuild() needs a rebuild() or end_rebuild().
+        """
+        with self._lock:
+            self._scans += 1
+            return self._position
+
+    def end_rebuild(self) -> None:
+        """Stop journaling for a scan that was abandoned."""
+        with self._lock:
+            self._end_scan()
+
+    def _end_scan(self) -> None:
+        self._scans = max(0, self._scans - 1)
+        if not self._scans:
+            self._journal = []
+
+    def rebuild(self, totals: Iterable[Dict[str, Any]], since: Optional[int] = None) -> None:
+        """Replace the board with rows of user_id, total_credit_earned,
+        total_redeemed and last_updated (plus "as_of" when `since`, the
+        begin_rebuild() position, is given)."""
+        entries: Dict[str, Dict[str, Any]] = {}
+        read_at: Dict[str, int] = {}
+        for row in totals:
+            uid = str(row["user_id"])
+            entries[uid] = {
+                "user_id": uid,
+                "total_credit_earned": int(row.get("total_credit_earned") or 0),
+                "total_redeemed": int(row.get("total_redeemed") or 0),
+                "last_updated": row.get("last_updated"),
+            }
+            read_at[uid] = int(row.get("as_of", since or 0))
+        with self._lock:
+            if since is not None:
+                for position, uid, earned, redeemed, at in self._journal:
+                    if position <= read_at.get(uid, since):
+                        continue  # already in the row the scan read
+                    entry = entries.get(uid)
+                    if entry is None:
+                        entry = entries[uid] = {"user_id": uid, "total_credit_earned": 0,
+                                                "total_redeemed": 0, "last_updated": at}
+                    entry["total_credit_earned"] += earned
+                    entry["total_redeemed"] += redeemed
+                    entry["last_updated"] = at
+                self._end_scan()
+            self._entries = entries
+            self._keys = sorted((-e["total_credit_earned"], uid) for uid, e in entries.items())
+            self._loaded_at = time.monotonic()
+
+    def record_earned(self, user_id: Any, amount: int, at: Optional[str] = None) -> None:
+        self._apply(str(user_id), earned=int(amount), redeemed=0, at=at)
+
+    def record_redeemed(self, user_id: Any, amount: int, at: Optional[str] = None) -> None:
+        self._apply(str(user_id), earned=0, redeemed=int(amount), at=at)
+
+    def _apply(self, uid: str, earned: int, redeemed: int, at: Optional[str]) -> None:
+        at = at or datetime.utcnow().isoformat()
+        with self._lock:
+            self._position += 1
+            if self._scans:
+                self._journal.append((self._position, uid, earned, redeemed, at))
+            entry = self._entries.get(uid)
+            if entry is None:
+                entry = {"user_id": uid, "total_credit_earned": 0, "total_redeemed": 0, "last_updated": at}
+                self._entries[uid] = entry
+                bisect.insort(self._keys, (0, uid))
+            if earned:
+                old_key = (-entry["total_credit_earned"], uid)
+                del self._keys[bisect.bisect_left(self._keys, old_key)]
+                entry["total_credit_earned"] += earned
+                bisect.insort(self._keys, (-entry["total_credit_earned"], uid))
+            entry["total_redeemed"] += redeemed
+            entry["last_updated"] = at
+
+    def top(self, k: int = 10) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(self._entries[uid]) for _, uid in self._keys[:max(k, 0)]]
+
+    def rank(self, user_id: Any) -> Optional[int]:
+        """1-based position of the user (ties broken by user id), None if absent."""
+        uid = str(user_id)
+        with self._lock:
+            entry = self._entries.get(uid)
+            if entry is None:
+                return None
+            return bisect.bisect_left(self._keys, (-entry["total_credit_earned"], uid)) + 1
+
+    def get(self, user_id: Any) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(str(user_id))
+            return dict(entry) if entry else None
+
+    def __len__(self) -> int:
+        return len(self._entries)
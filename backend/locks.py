@@ -0,0 +1,143 @@
+"""Per-key locks for serializing work on one account inside a process.
+
+A lock manager hands out one lock per key (card number, user id, ...), so
+operations on the same key run one at a time while operations on different
+keys never wait for each other. Keys are spread over `shards` tables, each
+with its own small mutex, so looking a key's lock up does not funnel every
+request through one global lock; a key's lock is dropped from its table as
+soon as nobody holds or waits for it.
+
+- LockManager: threading flavour, `with locks.hold(key): ...`
+- AsyncLockManager: asyncio flavour, `async with locks.hold(key): ...`
+
+Waiting longer than `timeout` seconds raises LockTimeout. Wait time,
+contended acquisitions and timeouts are exported per lock and shard
+(metrics.observe_lock_wait).
+
+These locks only order work within one process; the database functions
+remain the cross-worker guarantee.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+import zlib
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+from metrics import observe_lock_wait
+
+LOCK_SHARDS = int(os.getenv("LOCK_SHARDS", "16"))
+LOCK_TIMEOUT_SECONDS = float(os.getenv("LOCK_TIMEOUT_SECONDS", "5"))
+
+
+class LockTimeout(TimeoutError):
+    """A key lock was not acquired within the timeout."""
+
+    def __init__(self, lock: str, key: Any, timeout: float):
+        super().__init__(f"Timed out after {timeout:g}s waiting for {lock} lock on {key}")
+        self.lock = lock
+        self.key = key
+
+
+class _Entry:
+    __slots__ = ("lock", "users")
+
+    def __init__(self, lock: Any) -> None:
+        self.lock = lock
+        self.users = 0  # holders + waiters
+
+
+class _KeyLocks:
+    def __init__(self, name: str, new_lock: Callable[[], Any], shards: Optional[int] = None,
+                 timeout: Optional[float] = None):
+        self.name = name
+        self._new_lock = new_lock
+        self.shards = max(1, shards or LOCK_SHARDS)
+        self.timeout = LOCK_TIMEOUT_SECONDS if timeout is None else timeout
+        self._tables: List[Dict[Any, _Entry]] = [{} for _ in range(self.shards)]
+        self._mutexes = [threading.Lock() for _ in range(self.shards)]
+
+    def shard_of(self, key: Any) -> int:
+        # crc32 rather than hash(): stable across processes, so shard labels line up
+        return zlib.crc32(str(key).encode()) % self.shards
+
+    def _checkout(self, key: Any) -> Tuple[int, _Entry]:
+        shard = self.shard_of(key)
+        with self._mutexes[shard]:
+            entry = self._tables[shard].get(key)
+            if entry is None:
+                entry = self._tables[shard][key] = _Entry(self._new_lock())
+            entry.users += 1
+        return shard, entry
+
+    def _checkin(self, shard: int, key: Any, entry: _Entry) -> None:
+        with self._mutexes[shard]:
+            entry.users -= 1
+            if entry.users == 0 and self._tables[shard].get(key) is entry:
+                del self._tables[shard][key]
+
+    def _timeout(self, timeout: Optional[float]) -> Optional[float]:
+        timeout = self.timeout if timeout is None else timeout
+        return timeout if timeout > 0 else None
+
+    def active_keys(self) -> int:
+        return sum(len(table) for table in self._tables)
+
+
+class LockManager(_KeyLocks):
+    """Per-key threading locks."""
+
+    def __init__(self, name: str, shards: Optional[int] = None, timeout: Optional[float] = None):
+        super().__init__(name, threading.Lock, shards, timeout)
+
+    @contextmanager
+    def hold(self, key: Any, timeout: Optional[float] = None) -> Iterator[None]:
+        wait = self._timeout(timeout)
+        shard, entry = self._checkout(key)
+        start = time.perf_counter()
+        contended = entry.lock.locked()
+        acquired = entry.lock.acquire(timeout=wait if wait is not None else -1)
+        observe_lock_wait(self.name, shard, time.perf_counter() - start, contended, not acquired)
+        if not acquired:
+            self._checkin(shard, key, entry)
+            raise LockTimeout(self.name, key, wait or 0)
+        try:
+            yield
+        finally:
+            entry.lock.release()
+            self._checkin(shard, key, entry)
+
+
+class AsyncLockManager(_KeyLocks):
+    """Per-key asyncio locks (use from one event loop)."""
+
+    def __init__(self, name: str, shards: Optional[int] = None, timeout: Optional[float] = None):
+        super().__init__(name, asyncio.Lock, shards, timeout)
+
+    @asynccontextmanager
+    async def hold(self, key: Any, timeout: Optional[float] = None) -> AsyncIterator[None]:
+        wait = self._timeout(timeout)
+        shard, entry = self._checkout(key)
+        start = time.perf_counter()
+        contended = entry.lock.locked()
+        try:
+            if contended:
+                await asyncio.wait_for(entry.lock.acquire(), wait)
+            else:
+                await entry.lock.acquire()
+        except asyncio.TimeoutError:
+            observe_lock_wait(self.name, shard, time.perf_counter() - start, contended, True)
+            self._checkin(shard, key, entry)
+            raise LockTimeout(self.name, key, wait or 0) from None
+        except BaseException:
+            self._checkin(shard, key, entry)
+            raise
+        observe_lock_wait(self.name, shard, time.perf_counter() - start, contended, False)
+        try:
+            yield
+        finally:
+            entry.lock.release()
+            self._checkin(shard, key, entry)
@@ -1,13 +1,71 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 from pydantic import BaseModel
 from typing import List
 
+import metrics
+from middleware import STORAGE_CALLS_HEADER, MetricsMiddleware, StorageCallCountMiddleware
+from idempotency import REPLAYED_HEADER
+from pagination import NEXT_CURSOR_HEADER
+from db import credit_log_queue
+from db_async import release_stock_tokens, snapshot_credit_balances
+from bank_db import BANK_CARD_CACHE_REVALIDATE_SECONDS
+from bank_db_async import revalidate_card_cache
+
 # Import routers
 from reward import router as reward_router
 from bank_api import router as bank_router
 
-app = FastAPI(title="GUHack2025 API", version="1.0.0")
+# Seconds between credit balance snapshots of all users (0 disables; reads
+# also snapshot a user lazily once their ledger tail grows, see db.py)
+CREDIT_SNAPSHOT_INTERVAL = float(os.getenv("CREDIT_SNAPSHOT_INTERVAL", "300"))
+
+
+async def _snapshot_credit_balances_forever(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await snapshot_credit_balances()
+        except Exception as e:
+            print(f"Warning: Could not snapshot credit balances: {e}")
+
+
+async def _revalidate_card_cache_forever(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await revalidate_card_cache()
+        except Exception as e:
+            print(f"Warning: Could not revalidate bank card cache: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Delivers credit_log rows spooled by a previous run, then new ones
+    await asyncio.to_thread(credit_log_queue.start)
+    tasks = []
+    if CREDIT_SNAPSHOT_INTERVAL > 0:
+        tasks.append(asyncio.create_task(_snapshot_credit_balances_forever(CREDIT_SNAPSHOT_INTERVAL)))
+    if BANK_CARD_CACHE_REVALIDATE_SECONDS > 0:
+        tasks.append(asyncio.create_task(_revalidate_card_cache_forever(BANK_CARD_CACHE_REVALIDATE_SECONDS)))
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        try:
+            await release_stock_tokens()
+        except Exception as e:
+            print(f"Warning: Could not release reserved stock: {e}")
+        await asyncio.to_thread(credit_log_queue.close)
+
+
+app = FastAPI(title="GUHack2025 API", version="1.0.0", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -19,7 +77,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[STORAGE_CALLS_HEADER, NEXT_CURSOR_HEADER, REPLAYED_HEADER],
 )
+app.add_middleware(StorageCallCountMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 # Include routers
 app.include_router(reward_router)
@@ -44,6 +105,11 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/api/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus scrape endpoint (see metrics.py)."""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/api/items", response_model=List[Item])
 async def get_items():
     return items
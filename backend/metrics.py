@@ -0,0 +1,285 @@
+"""In-process Prometheus metrics (text exposition format 0.0.4).
+
+Served at /api/metrics (main.py). Recorded series:
+
+- guhack_http_request_duration_seconds{method,route,status}: histogram per
+  route template (MetricsMiddleware in middleware.py)
+- guhack_http_requests_in_flight: requests currently being handled
+- guhack_storage_call_duration_seconds{table,op}: histogram of storage calls
+  (storage.record_storage_call, i.e. every traced select/insert/update/
+  delete/upsert/rpc execute)
+- guhack_lock_wait_seconds{lock,shard}, guhack_lock_{contended,timeouts}_total
+  {lock,shard}: key lock waits (locks.py)
+- guhack_cache_{hits,misses}_total{cache}, guhack_cache_hit_ratio{cache},
+  guhack_cache_size{cache}: caches registered with register_cache
+- guhack_writebehind_{flushed_rows,flush_failures}_total{queue},
+  guhack_writebehind_pending_rows{queue}: queues registered with
+  register_queue
+
+Recording is lock-free: each thread writes to its own shard (threading.local)
+and a scrape sums the shards. The only lock is taken once per thread, the
+first time it records into a metric.
+"""
+from __future__ import annotations
+
+import bisect
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Seconds; covers sub-millisecond SQLite calls up to slow remote requests
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[str, ...]
+
+
+class _Sharded:
+    """Per-thread storage for one metric; shards are merged at scrape time."""
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._shards: List[Dict[Labels, Any]] = []
+        self._lock = threading.Lock()
+
+    def _shard(self) -> Dict[Labels, Any]:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def _all_shards(self) -> List[Dict[Labels, Any]]:
+        with self._lock:
+            return list(self._shards)
+
+
+class Histogram(_Sharded):
+    def __init__(self, name: str, help: str, labelnames: Sequence[str],
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__()
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels: Labels, value: float) -> None:
+        shard = self._shard()
+        series = shard.get(labels)
+        if series is None:
+            # [count per bucket..., +Inf count, sum]
+            series = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def collect(self) -> Dict[Labels, List[float]]:
+        merged: Dict[Labels, List[float]] = {}
+        for shard in self._all_shards():
+            for labels, series in list(shard.items()):
+                total = merged.get(labels)
+                if total is None:
+                    merged[labels] = list(series)
+                else:
+                    for i, v in enumerate(series):
+                        total[i] += v
+        return merged
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in sorted(self.collect().items()):
+            base = _labels(self.labelnames, labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(self.labelnames + ('le',), labels + (_fmt(bound),))} {cumulative}"
+            cumulative += series[len(self.buckets)]
+            yield f"{self.name}_bucket{_labels(self.labelnames + ('le',), labels + ('+Inf',))} {cumulative}"
+            yield f"{self.name}_sum{base} {_fmt(series[-1])}"
+            yield f"{self.name}_count{base} {cumulative}"
+
+
+class Counter(_Sharded):
+    """Monotonic counter with labels."""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str]):
+        super().__init__()
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def inc(self, labels: Labels, amount: float = 1) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def collect(self) -> Dict[Labels, float]:
+        merged: Dict[Labels, float] = {}
+        for shard in self._all_shards():
+            for labels, value in list(shard.items()):
+                merged[labels] = merged.get(labels, 0) + value
+        return merged
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in sorted(self.collect().items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_fmt(value)}"
+
+
+class Gauge(_Sharded):
+    """Unlabelled up/down counter (per-thread deltas, summed on scrape)."""
+
+    def __init__(self, name: str, help: str):
+        super().__init__()
+        self.name = name
+        self.help = help
+
+    def inc(self, amount: float = 1) -> None:
+        shard = self._shard()
+        shard[()] = shard.get((), 0) + amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.inc(-amount)
+
+    def value(self) -> float:
+        return sum(shard.get((), 0) for shard in self._all_shards())
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {_fmt(self.value())}"
+
+
+def _fmt(value: float) -> str:
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)) + "}"
+
+
+# ---------- Registered metrics ----------
+
+REQUEST_DURATION = Histogram(
+    "guhack_http_request_duration_seconds",
+    "HTTP request latency by route template.",
+    ("method", "route", "status"),
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "guhack_http_requests_in_flight",
+    "HTTP requests currently being handled.",
+)
+STORAGE_CALL_DURATION = Histogram(
+    "guhack_storage_call_duration_seconds",
+    "Storage call latency by table (or rpc function) and operation.",
+    ("table", "op"),
+)
+LOCK_WAIT = Histogram(
+    "guhack_lock_wait_seconds",
+    "Time spent waiting for a key lock, by lock manager and key shard (locks.py).",
+    ("lock", "shard"),
+)
+LOCK_CONTENDED = Counter(
+    "guhack_lock_contended_total",
+    "Lock acquisitions that had to wait for another holder of the same key.",
+    ("lock", "shard"),
+)
+LOCK_TIMEOUTS = Counter(
+    "guhack_lock_timeouts_total",
+    "Lock acquisitions that gave up after the timeout.",
+    ("lock", "shard"),
+)
+
+_caches: List[Any] = []
+_queues: List[Any] = []
+_collectors: List[Callable[[], Iterable[str]]] = []
+
+
+def observe_request(method: str, route: str, status: int, seconds: float) -> None:
+    REQUEST_DURATION.observe((method, route, str(status)), seconds)
+
+
+def observe_storage_call(table: str, op: str, seconds: float) -> None:
+    STORAGE_CALL_DURATION.observe((table, op), seconds)
+
+
+def observe_lock_wait(lock: str, shard: int, seconds: float, contended: bool, timed_out: bool) -> None:
+    labels = (lock, str(shard))
+    LOCK_WAIT.observe(labels, seconds)
+    if contended:
+        LOCK_CONTENDED.inc(labels)
+    if timed_out:
+        LOCK_TIMEOUTS.inc(labels)
+
+
+def register_cache(cache: Any) -> Any:
+    """Export hit/miss counters of an object with stats() (e.g. cache.TTLCache)."""
+    _caches.append(cache)
+    return cache
+
+
+def register_queue(queue: Any) -> Any:
+    """Export delivery counters of a writebehind.WriteBehindQueue."""
+    _queues.append(queue)
+    return queue
+
+
+def register_collector(collect: Callable[[], Iterable[str]]) -> None:
+    """Add a callable yielding extra exposition lines at scrape time."""
+    _collectors.append(collect)
+
+
+def _render_caches() -> Iterable[str]:
+    stats = [c.stats() for c in _caches]
+    if not stats:
+        return
+    families = (
+        ("guhack_cache_hits_total", "counter", "Cache lookups served from the cache.", "hits"),
+        ("guhack_cache_misses_total", "counter", "Cache lookups that went to storage.", "misses"),
+        ("guhack_cache_hit_ratio", "gauge", "hits / (hits + misses) since start.", "hit_ratio"),
+        ("guhack_cache_size", "gauge", "Entries currently cached.", "size"),
+    )
+    for name, kind, help, key in families:
+        yield f"# HELP {name} {help}"
+        yield f"# TYPE {name} {kind}"
+        for s in stats:
+            value = s.get(key)
+            yield f"{name}{_labels(('cache',), (s['name'],))} {_fmt(value if value is not None else 0)}"
+
+
+def _render_queues() -> Iterable[str]:
+    stats = [q.stats() for q in _queues]
+    if not stats:
+        return
+    families = (
+        ("guhack_writebehind_flushed_rows_total", "counter", "Rows delivered by write-behind queues.", "flushed"),
+        ("guhack_writebehind_flush_failures_total", "counter", "Failed write-behind flushes (retried).", "failures"),
+        ("guhack_writebehind_pending_rows", "gauge", "Rows spooled but not yet delivered.", "pending"),
+    )
+    for name, kind, help, key in families:
+        yield f"# HELP {name} {help}"
+        yield f"# TYPE {name} {kind}"
+        for s in stats:
+            yield f"{name}{_labels(('queue',), (s['name'],))} {_fmt(s[key])}"
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in (REQUEST_DURATION, REQUESTS_IN_FLIGHT, STORAGE_CALL_DURATION,
+                   LOCK_WAIT, LOCK_CONTENDED, LOCK_TIMEOUTS):
+        lines.extend(metric.render())
+    lines.extend(_render_caches())
+    lines.extend(_render_queues())
+    for collect in _collectors:
+        lines.extend(collect())
+    return "\n".join(lines) + "\n"
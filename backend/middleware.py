@@ -0,0 +1,70 @@
+"""ASGI middleware shared by all routers."""
+from __future__ import annotations
+
+import time
+from typing import Any, Callable
+
+from metrics import REQUESTS_IN_FLIGHT, observe_request
+from storage import count_storage_calls
+
+STORAGE_CALLS_HEADER = "X-Storage-Calls"
+
+
+class StorageCallCountMiddleware:
+    """Expose the number of storage calls a request made as X-Storage-Calls.
+
+    Pure ASGI (no BaseHTTPMiddleware) so the counter set here is the one the
+    endpoint sees, including sync endpoints run in the threadpool.
+    """
+
+    def __init__(self, app: Callable[..., Any]):
+        self.app = app
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with count_storage_calls() as counter:
+            async def send_with_count(message: dict) -> None:
+                if message["type"] == "http.response.start":
+                    headers = list(message.get("headers", []))
+                    headers.append((STORAGE_CALLS_HEADER.lower().encode(), str(counter.count).encode()))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            await self.app(scope, receive, send_with_count)
+
+
+class MetricsMiddleware:
+    """Record request latency per route template and the in-flight gauge.
+
+    Routes are labelled by their template (/api/reward/users/{user_id}), so
+    label cardinality stays bounded; unmatched paths share one label.
+    """
+
+    def __init__(self, app: Callable[..., Any]):
+        self.app = app
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+
+        async def send_with_status(message: dict) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            route = scope.get("route")
+            observe_request(scope["method"], getattr(route, "path", "unmatched"), status,
+                            time.perf_counter() - start)
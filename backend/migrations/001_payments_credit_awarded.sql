@@ -0,0 +1,5 @@
+-- Persist the credits granted by each payment so listing payments no longer
+-- needs a bills lookup per row. Older rows keep NULL and are resolved from
+-- the bill category by db._payment_credits.
+alter table public.payments
+    add column if not exists credit_awarded integer;
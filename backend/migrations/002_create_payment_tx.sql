@@ -0,0 +1,66 @@
+-- Atomic payment: insert payment, mark bill paid, increment profiles.credits
+-- and append credit_log in one transaction (one PostgREST round trip).
+-- The bill row is locked for the duration and a bill already marked paid is
+-- rejected, so a bill cannot be paid (and credited) twice; the credits
+-- increment is a single UPDATE, so concurrent payments for the same user
+-- never lose credits.
+-- Credit rates are passed in by the caller (db.create_payment).
+create or replace function public.create_payment_tx(
+    p_bill_id uuid,
+    p_amount_paid numeric,
+    p_payment_method text,
+    p_payer_name text default null,
+    p_payer_bank text default null,
+    p_order_number text default null,
+    p_remark text default null,
+    p_rates jsonb default '{}'::jsonb,
+    p_default_rate numeric default 5.0,
+    p_now timestamptz default now()
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_bill public.bills%rowtype;
+    v_credit integer;
+    v_balance numeric;
+    v_payment public.payments%rowtype;
+begin
+    select * into v_bill from public.bills where id = p_bill_id for update;
+    if not found then
+        raise exception 'Bill not found' using errcode = 'P0002';
+    end if;
+    if lower(coalesce(v_bill.status, '')) = 'paid' then
+        raise exception 'Bill already paid: %', p_bill_id using errcode = 'P0001';
+    end if;
+
+    v_credit := floor(
+        p_amount_paid
+        * coalesce((p_rates ->> lower(coalesce(v_bill.category, 'rent')))::numeric, p_default_rate)
+        / 100.0
+    );
+
+    insert into public.payments (
+        bill_id, user_id, payer_bank, payer_name, payment_time, order_number,
+        amount_paid, payment_method, remark, status, credit_awarded, created_at
+    ) values (
+        p_bill_id, v_bill.user_id, p_payer_bank, p_payer_name, p_now, p_order_number,
+        p_amount_paid, p_payment_method, p_remark, 'success', v_credit, p_now
+    ) returning * into v_payment;
+
+    update public.bills set status = 'paid' where id = p_bill_id;
+
+    update public.profiles
+       set credits = coalesce(credits, 0) + v_credit
+     where id = v_bill.user_id
+    returning credits into v_balance;
+
+    -- credit_log.user_id is integer: same hash as db.py (first 9 hex digits of the uuid)
+    insert into public.credit_log (user_id, source_type, source_id, change_amount, balance_after, created_at)
+    values (
+        ('x' || lpad(substr(replace(v_bill.user_id::text, '-', ''), 1, 9), 16, '0'))::bit(64)::bigint % 2147483647,
+        'Payment', null, v_credit, coalesce(v_balance, v_credit)::integer, p_now
+    );
+
+    return to_jsonb(v_payment) || jsonb_build_object('balance_after', coalesce(v_balance, v_credit)::integer);
+end;
+$$;
@@ -0,0 +1,26 @@
+-- Bank database: atomic balance changes for bank_db.deduct_balance/add_balance.
+-- debit_card only matches while the balance covers the amount, so concurrent
+-- debits cannot overdraw a card; an empty result means "not found or
+-- insufficient balance".
+create or replace function public.debit_card(p_card_number text, p_amount numeric)
+returns setof public.bank_cards
+language sql
+as $$
+    update public.bank_cards
+       set balance = balance - p_amount,
+           updated_at = now()
+     where card_number = p_card_number
+       and balance >= p_amount
+    returning *;
+$$;
+
+create or replace function public.credit_card(p_card_number text, p_amount numeric)
+returns setof public.bank_cards
+language sql
+as $$
+    update public.bank_cards
+       set balance = balance + p_amount,
+           updated_at = now()
+     where card_number = p_card_number
+    returning *;
+$$;
@@ -0,0 +1,85 @@
+-- Keep leaderboard totals current: total_credit_earned/total_redeemed are
+-- incremented in place by leaderboard_add (one upsert), which
+-- create_payment_tx now calls inside its transaction and redeem_reward calls
+-- after a redemption. The backend serves the board from memory
+-- (leaderboard.py) and rebuilds it from this table on cold start.
+create or replace function public.leaderboard_add(
+    p_user_id integer,
+    p_earned integer default 0,
+    p_redeemed integer default 0,
+    p_now timestamptz default now()
+) returns void
+language sql
+as $$
+    insert into public.leaderboard (user_id, total_credit_earned, total_redeemed, last_updated)
+    values (p_user_id, p_earned, p_redeemed, p_now)
+    on conflict (user_id) do update
+       set total_credit_earned = public.leaderboard.total_credit_earned + excluded.total_credit_earned,
+           total_redeemed = public.leaderboard.total_redeemed + excluded.total_redeemed,
+           last_updated = excluded.last_updated;
+$$;
+
+create or replace function public.create_payment_tx(
+    p_bill_id uuid,
+    p_amount_paid numeric,
+    p_payment_method text,
+    p_payer_name text default null,
+    p_payer_bank text default null,
+    p_order_number text default null,
+    p_remark text default null,
+    p_rates jsonb default '{}'::jsonb,
+    p_default_rate numeric default 5.0,
+    p_now timestamptz default now()
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_bill public.bills%rowtype;
+    v_credit integer;
+    v_balance numeric;
+    v_payment public.payments%rowtype;
+begin
+    select * into v_bill from public.bills where id = p_bill_id for update;
+    if not found then
+        raise exception 'Bill not found' using errcode = 'P0002';
+    end if;
+    if lower(coalesce(v_bill.status, '')) = 'paid' then
+        raise exception 'Bill already paid: %', p_bill_id using errcode = 'P0001';
+    end if;
+
+    v_credit := floor(
+        p_amount_paid
+        * coalesce((p_rates ->> lower(coalesce(v_bill.category, 'rent')))::numeric, p_default_rate)
+        / 100.0
+    );
+
+    insert into public.payments (
+        bill_id, user_id, payer_bank, payer_name, payment_time, order_number,
+        amount_paid, payment_method, remark, status, credit_awarded, created_at
+    ) values (
+        p_bill_id, v_bill.user_id, p_payer_bank, p_payer_name, p_now, p_order_number,
+        p_amount_paid, p_payment_method, p_remark, 'success', v_credit, p_now
+    ) returning * into v_payment;
+
+    update public.bills set status = 'paid' where id = p_bill_id;
+
+    update public.profiles
+       set credits = coalesce(credits, 0) + v_credit
+     where id = v_bill.user_id
+    returning credits into v_balance;
+
+    -- credit_log.user_id is integer: same hash as db.py (first 9 hex digits of the uuid)
+    insert into public.credit_log (user_id, source_type, source_id, change_amount, balance_after, created_at)
+    values (
+        ('x' || lpad(substr(replace(v_bill.user_id::text, '-', ''), 1, 9), 16, '0'))::bit(64)::bigint % 2147483647,
+        'Payment', null, v_credit, coalesce(v_balance, v_credit)::integer, p_now
+    );
+
+    perform public.leaderboard_add(
+        (('x' || lpad(substr(replace(v_bill.user_id::text, '-', ''), 1, 9), 16, '0'))::bit(64)::bigint % 2147483647)::integer,
+        v_credit, 0, p_now
+    );
+
+    return to_jsonb(v_payment) || jsonb_build_object('balance_after', coalesce(v_balance, v_credit)::integer);
+end;
+$$;
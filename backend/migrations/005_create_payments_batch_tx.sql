@@ -0,0 +1,105 @@
+-- Pay several bills at once, all-or-nothing (one PostgREST round trip).
+-- All bills are fetched and locked in one statement and validated before
+-- anything is written; payments are inserted together, the bills flipped to
+-- paid together, and each user gets one profiles.credits increment, one
+-- credit_log row and one leaderboard_add for the total they earned.
+-- p_items: [{"bill_id": uuid, "amount_paid": number, "order_number": text?}, ...]
+-- Requires 004_leaderboard_totals.sql.
+create or replace function public.create_payments_batch_tx(
+    p_items jsonb,
+    p_payment_method text,
+    p_payer_name text default null,
+    p_payer_bank text default null,
+    p_remark text default null,
+    p_rates jsonb default '{}'::jsonb,
+    p_default_rate numeric default 5.0,
+    p_now timestamptz default now()
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_missing uuid;
+    v_paid uuid;
+    v_user record;
+    v_balance numeric;
+    v_payments jsonb;
+    v_balances jsonb := '{}'::jsonb;
+begin
+    create temporary table _batch on commit drop as
+    select (i ->> 'bill_id')::uuid as bill_id,
+           (i ->> 'amount_paid')::numeric as amount_paid,
+           i ->> 'order_number' as order_number,
+           ord
+      from jsonb_array_elements(p_items) with ordinality as t(i, ord);
+
+    select bill_id into v_paid from _batch group by bill_id having count(*) > 1 limit 1;
+    if found then
+        raise exception 'Duplicate bill: %', v_paid using errcode = 'P0001';
+    end if;
+
+    perform 1 from public.bills b join _batch x on x.bill_id = b.id for update of b;
+
+    select x.bill_id into v_missing
+      from _batch x left join public.bills b on b.id = x.bill_id
+     where b.id is null
+     limit 1;
+    if found then
+        raise exception 'Bill not found: %', v_missing using errcode = 'P0002';
+    end if;
+
+    select b.id into v_paid
+      from _batch x join public.bills b on b.id = x.bill_id
+     where lower(coalesce(b.status, '')) = 'paid'
+     limit 1;
+    if found then
+        raise exception 'Bill already paid: %', v_paid using errcode = 'P0001';
+    end if;
+
+    with ins as (
+        insert into public.payments (
+            bill_id, user_id, payer_bank, payer_name, payment_time, order_number,
+            amount_paid, payment_method, remark, status, credit_awarded, created_at
+        )
+        select x.bill_id, b.user_id, p_payer_bank, p_payer_name, p_now, x.order_number,
+               x.amount_paid, p_payment_method, p_remark, 'success',
+               floor(
+                   x.amount_paid
+                   * coalesce((p_rates ->> lower(coalesce(b.category, 'rent')))::numeric, p_default_rate)
+                   / 100.0
+               )::integer,
+               p_now
+          from _batch x join public.bills b on b.id = x.bill_id
+         order by x.ord
+        returning *
+    )
+    select jsonb_agg(to_jsonb(ins)) into v_payments from ins;
+
+    update public.bills set status = 'paid' where id in (select bill_id from _batch);
+
+    for v_user in
+        select (e ->> 'user_id')::uuid as user_id, sum((e ->> 'credit_awarded')::integer)::integer as credit
+          from jsonb_array_elements(coalesce(v_payments, '[]'::jsonb)) as e
+         group by 1
+    loop
+        update public.profiles
+           set credits = coalesce(credits, 0) + v_user.credit
+         where id = v_user.user_id
+        returning credits into v_balance;
+
+        insert into public.credit_log (user_id, source_type, source_id, change_amount, balance_after, created_at)
+        values (
+            ('x' || lpad(substr(replace(v_user.user_id::text, '-', ''), 1, 9), 16, '0'))::bit(64)::bigint % 2147483647,
+            'Payment', null, v_user.credit, coalesce(v_balance, v_user.credit)::integer, p_now
+        );
+
+        perform public.leaderboard_add(
+            (('x' || lpad(substr(replace(v_user.user_id::text, '-', ''), 1, 9), 16, '0'))::bit(64)::bigint % 2147483647)::integer,
+            v_user.credit, 0, p_now
+        );
+
+        v_balances := v_balances || jsonb_build_object(v_user.user_id::text, coalesce(v_balance, v_user.credit)::integer);
+    end loop;
+
+    return jsonb_build_object('payments', coalesce(v_payments, '[]'::jsonb), 'balances', v_balances);
+end;
+$$;
@@ -0,0 +1,9 @@
+-- Bank database: card count and total balance in one aggregate query, used by
+-- init_bank_cards.py to verify seeding without listing every card.
+create or replace function public.bank_card_stats()
+returns table (card_count bigint, total_balance numeric)
+language sql
+stable
+as $$
+    select count(*), coalesce(sum(balance), 0) from public.bank_cards;
+$$;
@@ -0,0 +1,16 @@
+-- Optional cross-worker store for Idempotency-Key (idempotency.py), used when
+-- IDEMPOTENCY_PERSIST=1. A row is inserted when a worker claims a key
+-- (status_code null = still running) and filled in with the response when
+-- the request completes; the primary key makes the claim race-free.
+create table if not exists public.idempotency_keys (
+    idempotency_key text primary key,
+    request_hash text not null,
+    status_code integer,
+    response_body text,
+    created_at timestamptz not null default now()
+);
+
+-- Expired rows are ignored by the backend; prune them periodically, e.g.
+-- delete from public.idempotency_keys where created_at < now() - interval '1 day';
+create index if not exists idx_idempotency_keys_created_at
+    on public.idempotency_keys (created_at);
@@ -0,0 +1,283 @@
+-- Append-only credit ledger keyed by the profiles uuid, with per-user balance
+-- snapshots. A user's balance is their snapshot plus the ledger entries
+-- appended since it (credit_balance); every credit change is one insert
+-- (credit_ledger_append), never a read-modify-write.
+--
+-- profiles.credits is still incremented in the same transaction because the
+-- frontend reads it directly; the backend reads balances from the ledger.
+-- credit_log keeps its legacy integer-keyed history (leaderboard rebuilds).
+-- Requires 004_leaderboard_totals.sql and 005_create_payments_batch_tx.sql.
+create table if not exists public.credit_ledger (
+    entry_id bigserial primary key,
+    user_id uuid not null,
+    delta integer not null,
+    source_type text not null,
+    source_id text,
+    created_at timestamptz not null default now()
+);
+create index if not exists idx_credit_ledger_user_entry
+    on public.credit_ledger (user_id, entry_id);
+
+-- balance = sum(delta) of the user's entries with entry_id <= last_entry_id
+create table if not exists public.credit_snapshots (
+    user_id uuid primary key,
+    balance integer not null,
+    last_entry_id bigint not null,
+    taken_at timestamptz not null default now()
+);
+
+-- Opening balance for users that predate the ledger
+insert into public.credit_ledger (user_id, delta, source_type)
+select p.id, coalesce(p.credits, 0)::integer, 'OpeningBalance'
+  from public.profiles p
+ where coalesce(p.credits, 0) <> 0
+   and not exists (select 1 from public.credit_ledger l where l.user_id = p.id);
+
+-- {"balance": snapshot + tail, "tail_entries": entries past the snapshot}
+create or replace function public.credit_balance(p_user_id uuid)
+returns jsonb
+language sql
+stable
+as $$
+    select jsonb_build_object(
+        'balance', (coalesce(s.balance, 0) + coalesce(t.total, 0))::integer,
+        'tail_entries', coalesce(t.entries, 0)
+    )
+      from (select 1) as one
+      left join public.credit_snapshots s on s.user_id = p_user_id
+      left join lateral (
+          select sum(l.delta) as total, count(*) as entries
+            from public.credit_ledger l
+           where l.user_id = p_user_id
+             and l.entry_id > coalesce(s.last_entry_id, 0)
+      ) t on true;
+$$;
+
+-- Append one entry; returns the balance after it.
+create or replace function public.credit_ledger_append(
+    p_user_id uuid,
+    p_delta integer,
+    p_source_type text,
+    p_source_id text default null
+) returns integer
+language plpgsql
+as $$
+begin
+    insert into public.credit_ledger (user_id, delta, source_type, source_id)
+    values (p_user_id, p_delta, p_source_type, p_source_id);
+
+    update public.profiles
+       set credits = coalesce(credits, 0) + p_delta
+     where id = p_user_id;
+
+    return (public.credit_balance(p_user_id) ->> 'balance')::integer;
+end;
+$$;
+
+-- Fold ledger entries created before p_before into the snapshots of one user
+-- (or of every user when p_user_id is null); returns snapshots written.
+-- bigserial ids are handed out before commit, so entries newer than
+-- p_before may still be missing in-flight neighbours: only the contiguous
+-- run of entries older than p_before is folded.
+create or replace function public.credit_snapshot(
+    p_user_id uuid default null,
+    p_before timestamptz default now() - interval '1 minute'
+) returns integer
+language sql
+as $$
+    with bounds as (
+        select l.user_id,
+               coalesce(s.last_entry_id, 0) as after_id,
+               coalesce(s.balance, 0) as base,
+               min(l.entry_id) filter (where l.created_at >= p_before) as stop_id
+          from public.credit_ledger l
+          left join public.credit_snapshots s on s.user_id = l.user_id
+         where (p_user_id is null or l.user_id = p_user_id)
+           and l.entry_id > coalesce(s.last_entry_id, 0)
+         group by l.user_id, s.last_entry_id, s.balance
+    ), folded as (
+        select b.user_id, b.base + sum(l.delta) as balance, max(l.entry_id) as last_entry_id
+          from bounds b
+          join public.credit_ledger l
+            on l.user_id = b.user_id
+           and l.entry_id > b.after_id
+           and (b.stop_id is null or l.entry_id < b.stop_id)
+         group by b.user_id, b.base
+    ), written as (
+        insert into public.credit_snapshots (user_id, balance, last_entry_id, taken_at)
+        select user_id, balance, last_entry_id, now() from folded
+        on conflict (user_id) do update
+           set balance = excluded.balance,
+               last_entry_id = excluded.last_entry_id,
+               taken_at = excluded.taken_at
+         where public.credit_snapshots.last_entry_id < excluded.last_entry_id
+        returning 1
+    )
+    select count(*)::integer from written;
+$$;
+
+-- Payments now append to the ledger (same signatures as 004/005)
+create or replace function public.create_payment_tx(
+    p_bill_id uuid,
+    p_amount_paid numeric,
+    p_payment_method text,
+    p_payer_name text default null,
+    p_payer_bank text default null,
+    p_order_number text default null,
+    p_remark text default null,
+    p_rates jsonb default '{}'::jsonb,
+    p_default_rate numeric default 5.0,
+    p_now timestamptz default now()
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_bill public.bills%rowtype;
+    v_credit integer;
+    v_balance integer;
+    v_payment public.payments%rowtype;
+begin
+    select * into v_bill from public.bills where id = p_bill_id for update;
+    if not found then
+        raise exception 'Bill not found' using errcode = 'P0002';
+    end if;
+    if lower(coalesce(v_bill.status, '')) = 'paid' then
+        raise exception 'Bill already paid: %', p_bill_id using errcode = 'P0001';
+    end if;
+
+    v_credit := floor(
+        p_amount_paid
+        * coalesce((p_rates ->> lower(coalesce(v_bill.category, 'rent')))::numeric, p_default_rate)
+        / 100.0
+    );
+
+    insert into public.payments (
+        bill_id, user_id, payer_bank, payer_name, payment_time, order_number,
+        amount_paid, payment_method, remark, status, credit_awarded, created_at
+    ) values (
+        p_bill_id, v_bill.user_id, p_payer_bank, p_payer_name, p_now, p_order_number,
+        p_amount_paid, p_payment_method, p_remark, 'success', v_credit, p_now
+    ) returning * into v_payment;
+
+    update public.bills set status = 'paid' where id = p_bill_id;
+
+    v_balance := public.credit_ledger_append(v_bill.user_id, v_credit, 'Payment', v_payment.id::text);
+
+    insert into public.credit_log (user_id, source_type, source_id, change_amount, balance_after, created_at)
+    values (
+        ('x' || lpad(substr(replace(v_bill.user_id::text, '-', ''), 1, 9), 16, '0'))::bit(64)::bigint % 2147483647,
+        'Payment', null, v_credit, v_balance, p_now
+    );
+
+    perform public.leaderboard_add(
+        (('x' || lpad(substr(replace(v_bill.user_id::text, '-', ''), 1, 9), 16, '0'))::bit(64)::bigint % 2147483647)::integer,
+        v_credit, 0, p_now
+    );
+
+    return to_jsonb(v_payment) || jsonb_build_object('balance_after', v_balance);
+end;
+$$;
+
+create or replace function public.create_payments_batch_tx(
+    p_items jsonb,
+    p_payment_method text,
+    p_payer_name text default null,
+    p_payer_bank text default null,
+    p_remark text default null,
+    p_rates jsonb default '{}'::jsonb,
+    p_default_rate numeric default 5.0,
+    p_now timestamptz default now()
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_missing uuid;
+    v_paid uuid;
+    v_user record;
+    v_balance integer;
+    v_payments jsonb;
+    v_balances jsonb := '{}'::jsonb;
+begin
+    create temporary table _batch on commit drop as
+    select (i ->> 'bill_id')::uuid as bill_id,
+           (i ->> 'amount_paid')::numeric as amount_paid,
+           i ->> 'order_number' as order_number,
+           ord
+      from jsonb_array_elements(p_items) with ordinality as t(i, ord);
+
+    select bill_id into v_paid from _batch group by bill_id having count(*) > 1 limit 1;
+    if found then
+        raise exception 'Duplicate bill: %', v_paid using errcode = 'P0001';
+    end if;
+
+    perform 1 from public.bills b join _batch x on x.bill_id = b.id for update of b;
+
+    select x.bill_id into v_missing
+      from _batch x left join public.bills b on b.id = x.bill_id
+     where b.id is null
+     limit 1;
+    if found then
+        raise exception 'Bill not found: %', v_missing using errcode = 'P0002';
+    end if;
+
+    select b.id into v_paid
+      from _batch x join public.bills b on b.id = x.bill_id
+     where lower(coalesce(b.status, '')) = 'paid'
+     limit 1;
+    if found then
+        raise exception 'Bill already paid: %', v_paid using errcode = 'P0001';
+    end if;
+
+    with ins as (
+        insert into public.payments (
+            bill_id, user_id, payer_bank, payer_name, payment_time, order_number,
+            amount_paid, payment_method, remark, status, credit_awarded, created_at
+        )
+        select x.bill_id, b.user_id, p_payer_bank, p_payer_name, p_now, x.order_number,
+               x.amount_paid, p_payment_method, p_remark, 'success',
+               floor(
+                   x.amount_paid
+                   * coalesce((p_rates ->> lower(coalesce(b.category, 'rent')))::numeric, p_default_rate)
+                   / 100.0
+               )::integer,
+               p_now
+          from _batch x join public.bills b on b.id = x.bill_id
+         order by x.ord
+        returning *
+    )
+    select jsonb_agg(to_jsonb(ins)) into v_payments from ins;
+
+    update public.bills set status = 'paid' where id in (select bill_id from _batch);
+
+    -- One ledger entry per payment; profiles.credits gets one increment per user
+    insert into public.credit_ledger (user_id, delta, source_type, source_id)
+    select (e ->> 'user_id')::uuid, (e ->> 'credit_awarded')::integer, 'Payment', e ->> 'id'
+      from jsonb_array_elements(coalesce(v_payments, '[]'::jsonb)) as e;
+
+    for v_user in
+        select (e ->> 'user_id')::uuid as user_id, sum((e ->> 'credit_awarded')::integer)::integer as credit
+          from jsonb_array_elements(coalesce(v_payments, '[]'::jsonb)) as e
+         group by 1
+    loop
+        update public.profiles
+           set credits = coalesce(credits, 0) + v_user.credit
+         where id = v_user.user_id;
+        v_balance := (public.credit_balance(v_user.user_id) ->> 'balance')::integer;
+
+        insert into public.credit_log (user_id, source_type, source_id, change_amount, balance_after, created_at)
+        values (
+            ('x' || lpad(substr(replace(v_user.user_id::text, '-', ''), 1, 9), 16, '0'))::bit(64)::bigint % 2147483647,
+            'Payment', null, v_user.credit, v_balance, p_now
+        );
+
+        perform public.leaderboard_add(
+            (('x' || lpad(substr(replace(v_user.user_id::text, '-', ''), 1, 9), 16, '0'))::bit(64)::bigint % 2147483647)::integer,
+            v_user.credit, 0, p_now
+        );
+
+        v_balances := v_balances || jsonb_build_object(v_user.user_id::text, v_balance);
+    end loop;
+
+    return jsonb_build_object('payments', coalesce(v_payments, '[]'::jsonb), 'balances', v_balances);
+end;
+$$;
@@ -0,0 +1,8 @@
+-- Unique key per credit_log row written through the backend's write-behind
+-- queue (writebehind.py). Spooled rows are inserted with
+-- on conflict (entry_key) do nothing, so a batch replayed after a crash is
+-- not logged twice. Rows written by the payment functions leave it null.
+alter table public.credit_log add column if not exists entry_key text;
+
+create unique index if not exists idx_credit_log_entry_key
+    on public.credit_log (entry_key);
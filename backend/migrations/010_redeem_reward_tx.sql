@@ -0,0 +1,98 @@
+-- Redeem a credit_shop item as one transaction: the balance check, stock
+-- decrement, redemption insert, ledger debit and leaderboard update either
+-- all happen or none do. The user's profiles row is locked first, so two
+-- redemptions by one user cannot both spend the same credits, and the stock
+-- decrement is conditional (stock > 0), so an item cannot be oversold.
+--
+-- Hot items: a backend worker takes stock in batches with reserve_stock and
+-- hands the units out from memory; redemptions backed by such a unit pass
+-- p_reserved = true and skip the credit_shop row entirely, so concurrent
+-- redeemers do not queue on it. Unused units go back with release_stock.
+-- Requires 004_leaderboard_totals.sql and 008_credit_ledger.sql.
+create or replace function public.reserve_stock(
+    p_shop_item_id integer,
+    p_count integer
+) returns integer
+language plpgsql
+as $$
+declare
+    v_stock integer;
+    v_granted integer;
+begin
+    select stock into v_stock
+      from public.credit_shop
+     where shop_item_id = p_shop_item_id
+       and lower(coalesce(status, 'active')) in ('active', 'enabled', 'available')
+       for update;
+    if not found or coalesce(v_stock, 0) <= 0 then
+        return 0;
+    end if;
+    v_granted := least(v_stock, greatest(p_count, 0));
+    update public.credit_shop set stock = stock - v_granted where shop_item_id = p_shop_item_id;
+    return v_granted;
+end;
+$$;
+
+create or replace function public.release_stock(
+    p_shop_item_id integer,
+    p_count integer
+) returns void
+language sql
+as $$
+    update public.credit_shop set stock = stock + greatest(p_count, 0) where shop_item_id = p_shop_item_id;
+$$;
+
+create or replace function public.redeem_reward_tx(
+    p_user_id uuid,
+    p_shop_item_id integer,
+    p_reserved boolean default false,
+    p_now timestamptz default now()
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_item public.credit_shop%rowtype;
+    v_balance integer;
+    v_redemption public.redemptions%rowtype;
+begin
+    perform 1 from public.profiles where id = p_user_id for update;
+    if not found then
+        raise exception 'User not found' using errcode = 'P0002';
+    end if;
+
+    select * into v_item from public.credit_shop where shop_item_id = p_shop_item_id;
+    if not found then
+        raise exception 'Reward not found' using errcode = 'P0002';
+    end if;
+    if lower(coalesce(v_item.status, 'active')) not in ('active', 'enabled', 'available') then
+        raise exception 'Reward not active' using errcode = 'P0001';
+    end if;
+
+    v_balance := (public.credit_balance(p_user_id) ->> 'balance')::integer;
+    if v_balance < v_item.credit_cost then
+        raise exception 'Insufficient credit' using errcode = 'P0001';
+    end if;
+
+    if not p_reserved then
+        update public.credit_shop set stock = stock - 1
+         where shop_item_id = p_shop_item_id and stock > 0;
+        if not found then
+            raise exception 'Out of stock' using errcode = 'P0001';
+        end if;
+    end if;
+
+    -- redemptions.reward_id references rewards; the shop item goes in description
+    insert into public.redemptions (user_id, reward_id, redemption_type, amount, description, created_at)
+    values (p_user_id, null, 'credit_shop', v_item.credit_cost, 'shop_item:' || p_shop_item_id, p_now)
+    returning * into v_redemption;
+
+    v_balance := public.credit_ledger_append(p_user_id, -v_item.credit_cost, 'Redemption', v_redemption.id::text);
+
+    perform public.leaderboard_add(
+        (('x' || lpad(substr(replace(p_user_id::text, '-', ''), 1, 9), 16, '0'))::bit(64)::bigint % 2147483647)::integer,
+        0, v_item.credit_cost, p_now
+    );
+
+    return to_jsonb(v_redemption) || jsonb_build_object('balance_after', v_balance);
+end;
+$$;
@@ -0,0 +1,44 @@
+-- Bank database: a version number on every card row, bumped by each balance
+-- change, so backend workers caching card rows (bank_db.py) can tell which
+-- copy is newer and drop the ones another worker has since updated. Any other
+-- writer that changes bank_cards rows must bump version as well.
+-- Requires 003_bank_card_balance.sql.
+alter table public.bank_cards add column if not exists version bigint not null default 0;
+
+create or replace function public.debit_card(p_card_number text, p_amount numeric)
+returns setof public.bank_cards
+language sql
+as $$
+    update public.bank_cards
+       set balance = balance - p_amount,
+           version = version + 1,
+           updated_at = now()
+     where card_number = p_card_number
+       and balance >= p_amount
+    returning *;
+$$;
+
+create or replace function public.credit_card(p_card_number text, p_amount numeric)
+returns setof public.bank_cards
+language sql
+as $$
+    update public.bank_cards
+       set balance = balance + p_amount,
+           version = version + 1,
+           updated_at = now()
+     where card_number = p_card_number
+    returning *;
+$$;
+
+-- Absolute balance (bank_db.update_balance)
+create or replace function public.set_card_balance(p_card_number text, p_balance numeric)
+returns setof public.bank_cards
+language sql
+as $$
+    update public.bank_cards
+       set balance = p_balance,
+           version = version + 1,
+           updated_at = now()
+     where card_number = p_card_number
+    returning *;
+$$;
@@ -0,0 +1,183 @@
+-- Per-category credit caps for the payment functions. Rates, caps and
+-- promotions live in the backend's reward rules (reward_rules.py); the backend
+-- resolves the ones in force and passes them in as p_rates / p_caps /
+-- p_default_rate, so the credits written here match the ones shown by the API.
+-- p_caps maps a category to the most credits one payment can earn.
+-- The functions gain a parameter, so the previous versions are dropped first
+-- (PostgREST cannot choose between overloads).
+-- Requires 008_credit_ledger.sql.
+drop function if exists public.create_payment_tx(uuid, numeric, text, text, text, text, text, jsonb, numeric, timestamptz);
+drop function if exists public.create_payments_batch_tx(jsonb, text, text, text, text, jsonb, numeric, timestamptz);
+
+create or replace function public.create_payment_tx(
+    p_bill_id uuid,
+    p_amount_paid numeric,
+    p_payment_method text,
+    p_payer_name text default null,
+    p_payer_bank text default null,
+    p_order_number text default null,
+    p_remark text default null,
+    p_rates jsonb default '{}'::jsonb,
+    p_default_rate numeric default 5.0,
+    p_now timestamptz default now(),
+    p_caps jsonb default '{}'::jsonb
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_bill public.bills%rowtype;
+    v_credit integer;
+    v_balance integer;
+    v_payment public.payments%rowtype;
+begin
+    select * into v_bill from public.bills where id = p_bill_id for update;
+    if not found then
+        raise exception 'Bill not found' using errcode = 'P0002';
+    end if;
+    if lower(coalesce(v_bill.status, '')) = 'paid' then
+        raise exception 'Bill already paid: %', p_bill_id using errcode = 'P0001';
+    end if;
+
+    v_credit := least(
+        floor(
+            p_amount_paid
+            * coalesce((p_rates ->> lower(coalesce(v_bill.category, 'rent')))::numeric, p_default_rate)
+            / 100.0
+        ),
+        coalesce((p_caps ->> lower(coalesce(v_bill.category, 'rent')))::integer, 2147483647)
+    );
+
+    insert into public.payments (
+        bill_id, user_id, payer_bank, payer_name, payment_time, order_number,
+        amount_paid, payment_method, remark, status, credit_awarded, created_at
+    ) values (
+        p_bill_id, v_bill.user_id, p_payer_bank, p_payer_name, p_now, p_order_number,
+        p_amount_paid, p_payment_method, p_remark, 'success', v_credit, p_now
+    ) returning * into v_payment;
+
+    update public.bills set status = 'paid' where id = p_bill_id;
+
+    v_balance := public.credit_ledger_append(v_bill.user_id, v_credit, 'Payment', v_payment.id::text);
+
+    insert into public.credit_log (user_id, source_type, source_id, change_amount, balance_after, created_at)
+    values (
+        ('x' || lpad(substr(replace(v_bill.user_id::text, '-', ''), 1, 9), 16, '0'))::bit(64)::bigint % 2147483647,
+        'Payment', null, v_credit, v_balance, p_now
+    );
+
+    perform public.leaderboard_add(
+        (('x' || lpad(substr(replace(v_bill.user_id::text, '-', ''), 1, 9), 16, '0'))::bit(64)::bigint % 2147483647)::integer,
+        v_credit, 0, p_now
+    );
+
+    return to_jsonb(v_payment) || jsonb_build_object('balance_after', v_balance);
+end;
+$$;
+
+create or replace function public.create_payments_batch_tx(
+    p_items jsonb,
+    p_payment_method text,
+    p_payer_name text default null,
+    p_payer_bank text default null,
+    p_remark text default null,
+    p_rates jsonb default '{}'::jsonb,
+    p_default_rate numeric default 5.0,
+    p_now timestamptz default now(),
+    p_caps jsonb default '{}'::jsonb
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_missing uuid;
+    v_paid uuid;
+    v_user record;
+    v_balance integer;
+    v_payments jsonb;
+    v_balances jsonb := '{}'::jsonb;
+begin
+    create temporary table _batch on commit drop as
+    select (i ->> 'bill_id')::uuid as bill_id,
+           (i ->> 'amount_paid')::numeric as amount_paid,
+           i ->> 'order_number' as order_number,
+           ord
+      from jsonb_array_elements(p_items) with ordinality as t(i, ord);
+
+    select bill_id into v_paid from _batch group by bill_id having count(*) > 1 limit 1;
+    if found then
+        raise exception 'Duplicate bill: %', v_paid using errcode = 'P0001';
+    end if;
+
+    perform 1 from public.bills b join _batch x on x.bill_id = b.id for update of b;
+
+    select x.bill_id into v_missing
+      from _batch x left join public.bills b on b.id = x.bill_id
+     where b.id is null
+     limit 1;
+    if found then
+        raise exception 'Bill not found: %', v_missing using errcode = 'P0002';
+    end if;
+
+    select b.id into v_paid
+      from _batch x join public.bills b on b.id = x.bill_id
+     where lower(coalesce(b.status, '')) = 'paid'
+     limit 1;
+    if found then
+        raise exception 'Bill already paid: %', v_paid using errcode = 'P0001';
+    end if;
+
+    with ins as (
+        insert into public.payments (
+            bill_id, user_id, payer_bank, payer_name, payment_time, order_number,
+            amount_paid, payment_method, remark, status, credit_awarded, created_at
+        )
+        select x.bill_id, b.user_id, p_payer_bank, p_payer_name, p_now, x.order_number,
+               x.amount_paid, p_payment_method, p_remark, 'success',
+               least(
+                   floor(
+                       x.amount_paid
+                       * coalesce((p_rates ->> lower(coalesce(b.category, 'rent')))::numeric, p_default_rate)
+                       / 100.0
+                   )::integer,
+                   coalesce((p_caps ->> lower(coalesce(b.category, 'rent')))::integer, 2147483647)
+               ),
+               p_now
+          from _batch x join public.bills b on b.id = x.bill_id
+         order by x.ord
+        returning *
+    )
+    select jsonb_agg(to_jsonb(ins)) into v_payments from ins;
+
+    update public.bills set status = 'paid' where id in (select bill_id from _batch);
+
+    -- One ledger entry per payment; profiles.credits gets one increment per user
+    insert into public.credit_ledger (user_id, delta, source_type, source_id)
+    select (e ->> 'user_id')::uuid, (e ->> 'credit_awarded')::integer, 'Payment', e ->> 'id'
+      from jsonb_array_elements(coalesce(v_payments, '[]'::jsonb)) as e;
+
+    for v_user in
+        select (e ->> 'user_id')::uuid as user_id, sum((e ->> 'credit_awarded')::integer)::integer as credit
+          from jsonb_array_elements(coalesce(v_payments, '[]'::jsonb)) as e
+         group by 1
+    loop
+        update public.profiles
+           set credits = coalesce(credits, 0) + v_user.credit
+         where id = v_user.user_id;
+        v_balance := (public.credit_balance(v_user.user_id) ->> 'balance')::integer;
+
+        insert into public.credit_log (user_id, source_type, source_id, change_amount, balance_after, created_at)
+        values (
+            ('x' || lpad(substr(replace(v_user.user_id::text, '-', ''), 1, 9), 16, '0'))::bit(64)::bigint % 2147483647,
+            'Payment', null, v_user.credit, v_balance, p_now
+        );
+
+        perform public.leaderboard_add(
+            (('x' || lpad(substr(replace(v_user.user_id::text, '-', ''), 1, 9), 16, '0'))::bit(64)::bigint % 2147483647)::integer,
+            v_user.credit, 0, p_now
+        );
+
+        v_balances := v_balances || jsonb_build_object(v_user.user_id::text, v_balance);
+    end loop;
+
+    return jsonb_build_object('payments', coalesce(v_payments, '[]'::jsonb), 'balances', v_balances);
+end;
+$$;
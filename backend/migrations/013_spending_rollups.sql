@@ -0,0 +1,282 @@
+-- Per-user, per-month, per-category spending totals, kept up to date by the
+-- payment functions in the same transaction as the payment itself, so a
+-- monthly spend chart reads O(months x categories) rows instead of the
+-- user's whole payments history. Months are UTC calendar months of the
+-- payment time; bills without a category count as rent.
+--
+-- spending_rollups_rebuild regenerates the rollups of a set of users from
+-- the raw payments (the backend walks all users in chunks, see
+-- db.rebuild_spending_rollups). It takes the users' profile row locks first:
+-- the payment functions hold them (credit_ledger_append) until commit and
+-- write rollups only after taking them, so a payment is never counted twice
+-- or missed by a rebuild.
+-- Requires 012_reward_rule_caps.sql.
+create table if not exists public.spending_rollups (
+    user_id uuid not null,
+    month date not null,
+    category text not null,
+    payments integer not null default 0,
+    total_paid numeric not null default 0,
+    credits integer not null default 0,
+    updated_at timestamptz not null default now(),
+    primary key (user_id, month, category)
+);
+
+create or replace function public.spending_rollup_add(
+    p_user_id uuid,
+    p_at timestamptz,
+    p_category text,
+    p_payments integer,
+    p_amount numeric,
+    p_credits integer
+) returns void
+language sql
+as $$
+    insert into public.spending_rollups as r (user_id, month, category, payments, total_paid, credits, updated_at)
+    values (p_user_id, date_trunc('month', p_at at time zone 'UTC')::date, lower(coalesce(p_category, 'rent')),
+            p_payments, p_amount, p_credits, now())
+    on conflict (user_id, month, category) do update
+       set payments = r.payments + excluded.payments,
+           total_paid = r.total_paid + excluded.total_paid,
+           credits = r.credits + excluded.credits,
+           updated_at = excluded.updated_at;
+$$;
+
+-- Replace the rollups of p_user_ids with totals recomputed from payments;
+-- returns the number of rollup rows written.
+create or replace function public.spending_rollups_rebuild(p_user_ids uuid[])
+returns integer
+language plpgsql
+as $$
+declare
+    v_rows integer;
+begin
+    perform 1 from public.profiles where id = any(p_user_ids) order by id for update;
+
+    delete from public.spending_rollups where user_id = any(p_user_ids);
+
+    insert into public.spending_rollups (user_id, month, category, payments, total_paid, credits, updated_at)
+    select p.user_id,
+           date_trunc('month', coalesce(p.payment_time, p.created_at) at time zone 'UTC')::date,
+           lower(coalesce(b.category, 'rent')),
+           count(*),
+           sum(coalesce(p.amount_paid, 0)),
+           sum(coalesce(p.credit_awarded, 0)),
+           now()
+      from public.payments p
+      left join public.bills b on b.id = p.bill_id
+     where p.user_id = any(p_user_ids)
+     group by 1, 2, 3;
+    get diagnostics v_rows = row_count;
+    return v_rows;
+end;
+$$;
+
+-- Initial fill from existing payments
+insert into public.spending_rollups (user_id, month, category, payments, total_paid, credits, updated_at)
+select p.user_id,
+       date_trunc('month', coalesce(p.payment_time, p.created_at) at time zone 'UTC')::date,
+       lower(coalesce(b.category, 'rent')),
+       count(*),
+       sum(coalesce(p.amount_paid, 0)),
+       sum(coalesce(p.credit_awarded, 0)),
+       now()
+  from public.payments p
+  left join public.bills b on b.id = p.bill_id
+ where p.user_id is not null
+ group by 1, 2, 3
+on conflict (user_id, month, category) do nothing;
+
+-- Payment functions: same signatures as 012, plus the rollup update
+create or replace function public.create_payment_tx(
+    p_bill_id uuid,
+    p_amount_paid numeric,
+    p_payment_method text,
+    p_payer_name text default null,
+    p_payer_bank text default null,
+    p_order_number text default null,
+    p_remark text default null,
+    p_rates jsonb default '{}'::jsonb,
+    p_default_rate numeric default 5.0,
+    p_now timestamptz default now(),
+    p_caps jsonb default '{}'::jsonb
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_bill public.bills%rowtype;
+    v_credit integer;
+    v_balance integer;
+    v_payment public.payments%rowtype;
+begin
+    select * into v_bill from public.bills where id = p_bill_id for update;
+    if not found then
+        raise exception 'Bill not found' using errcode = 'P0002';
+    end if;
+    if lower(coalesce(v_bill.status, '')) = 'paid' then
+        raise exception 'Bill already paid: %', p_bill_id using errcode = 'P0001';
+    end if;
+
+    v_credit := least(
+        floor(
+            p_amount_paid
+            * coalesce((p_rates ->> lower(coalesce(v_bill.category, 'rent')))::numeric, p_default_rate)
+            / 100.0
+        ),
+        coalesce((p_caps ->> lower(coalesce(v_bill.category, 'rent')))::integer, 2147483647)
+    );
+
+    insert into public.payments (
+        bill_id, user_id, payer_bank, payer_name, payment_time, order_number,
+        amount_paid, payment_method, remark, status, credit_awarded, created_at
+    ) values (
+        p_bill_id, v_bill.user_id, p_payer_bank, p_payer_name, p_now, p_order_number,
+        p_amount_paid, p_payment_method, p_remark, 'success', v_credit, p_now
+    ) returning * into v_payment;
+
+    update public.bills set status = 'paid' where id = p_bill_id;
+
+    v_balance := public.credit_ledger_append(v_bill.user_id, v_credit, 'Payment', v_payment.id::text);
+
+    insert into public.credit_log (user_id, source_type, source_id, change_amount, balance_after, created_at)
+    values (
+        ('x' || lpad(substr(replace(v_bill.user_id::text, '-', ''), 1, 9), 16, '0'))::bit(64)::bigint % 2147483647,
+        'Payment', null, v_credit, v_balance, p_now
+    );
+
+    perform public.leaderboard_add(
+        (('x' || lpad(substr(replace(v_bill.user_id::text, '-', ''), 1, 9), 16, '0'))::bit(64)::bigint % 2147483647)::integer,
+        v_credit, 0, p_now
+    );
+
+    perform public.spending_rollup_add(v_bill.user_id, p_now, v_bill.category, 1, p_amount_paid, v_credit);
+
+    return to_jsonb(v_payment) || jsonb_build_object('balance_after', v_balance);
+end;
+$$;
+
+create or replace function public.create_payments_batch_tx(
+    p_items jsonb,
+    p_payment_method text,
+    p_payer_name text default null,
+    p_payer_bank text default null,
+    p_remark text default null,
+    p_rates jsonb default '{}'::jsonb,
+    p_default_rate numeric default 5.0,
+    p_now timestamptz default now(),
+    p_caps jsonb default '{}'::jsonb
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_missing uuid;
+    v_paid uuid;
+    v_user record;
+    v_balance integer;
+    v_payments jsonb;
+    v_balances jsonb := '{}'::jsonb;
+begin
+    create temporary table _batch on commit drop as
+    select (i ->> 'bill_id')::uuid as bill_id,
+           (i ->> 'amount_paid')::numeric as amount_paid,
+           i ->> 'order_number' as order_number,
+           ord
+      from jsonb_array_elements(p_items) with ordinality as t(i, ord);
+
+    select bill_id into v_paid from _batch group by bill_id having count(*) > 1 limit 1;
+    if found then
+        raise exception 'Duplicate bill: %', v_paid using errcode = 'P0001';
+    end if;
+
+    perform 1 from public.bills b join _batch x on x.bill_id = b.id for update of b;
+
+    select x.bill_id into v_missing
+      from _batch x left join public.bills b on b.id = x.bill_id
+     where b.id is null
+     limit 1;
+    if found then
+        raise exception 'Bill not found: %', v_missing using errcode = 'P0002';
+    end if;
+
+    select b.id into v_paid
+      from _batch x join public.bills b on b.id = x.bill_id
+     where lower(coalesce(b.status, '')) = 'paid'
+     limit 1;
+    if found then
+        raise exception 'Bill already paid: %', v_paid using errcode = 'P0001';
+    end if;
+
+    with ins as (
+        insert into public.payments (
+            bill_id, user_id, payer_bank, payer_name, payment_time, order_number,
+            amount_paid, payment_method, remark, status, credit_awarded, created_at
+        )
+        select x.bill_id, b.user_id, p_payer_bank, p_payer_name, p_now, x.order_number,
+               x.amount_paid, p_payment_method, p_remark, 'success',
+               least(
+                   floor(
+                       x.amount_paid
+                       * coalesce((p_rates ->> lower(coalesce(b.category, 'rent')))::numeric, p_default_rate)
+                       / 100.0
+                   )::integer,
+                   coalesce((p_caps ->> lower(coalesce(b.category, 'rent')))::integer, 2147483647)
+               ),
+               p_now
+          from _batch x join public.bills b on b.id = x.bill_id
+         order by x.ord
+        returning *
+    )
+    select jsonb_agg(to_jsonb(ins)) into v_payments from ins;
+
+    update public.bills set status = 'paid' where id in (select bill_id from _batch);
+
+    -- One ledger entry per payment; profiles.credits gets one increment per user
+    insert into public.credit_ledger (user_id, delta, source_type, source_id)
+    select (e ->> 'user_id')::uuid, (e ->> 'credit_awarded')::integer, 'Payment', e ->> 'id'
+      from jsonb_array_elements(coalesce(v_payments, '[]'::jsonb)) as e;
+
+    for v_user in
+        select (e ->> 'user_id')::uuid as user_id, sum((e ->> 'credit_awarded')::integer)::integer as credit
+          from jsonb_array_elements(coalesce(v_payments, '[]'::jsonb)) as e
+         group by 1
+         order by 1  -- same lock order as spending_rollups_rebuild
+    loop
+        update public.profiles
+           set credits = coalesce(credits, 0) + v_user.credit
+         where id = v_user.user_id;
+        v_balance := (public.credit_balance(v_user.user_id) ->> 'balance')::integer;
+
+        insert into public.credit_log (user_id, source_type, source_id, change_amount, balance_after, created_at)
+        values (
+            ('x' || lpad(substr(replace(v_user.user_id::text, '-', ''), 1, 9), 16, '0'))::bit(64)::bigint % 2147483647,
+            'Payment', null, v_user.credit, v_balance, p_now
+        );
+
+        perform public.leaderboard_add(
+            (('x' || lpad(substr(replace(v_user.user_id::text, '-', ''), 1, 9), 16, '0'))::bit(64)::bigint % 2147483647)::integer,
+            v_user.credit, 0, p_now
+        );
+
+        v_balances := v_balances || jsonb_build_object(v_user.user_id::text, v_balance);
+    end loop;
+
+    insert into public.spending_rollups as r (user_id, month, category, payments, total_paid, credits, updated_at)
+    select (e ->> 'user_id')::uuid,
+           date_trunc('month', p_now at time zone 'UTC')::date,
+           lower(coalesce(b.category, 'rent')),
+           count(*),
+           sum((e ->> 'amount_paid')::numeric),
+           sum((e ->> 'credit_awarded')::integer),
+           now()
+      from jsonb_array_elements(coalesce(v_payments, '[]'::jsonb)) as e
+      join public.bills b on b.id = (e ->> 'bill_id')::uuid
+     group by 1, 2, 3
+    on conflict (user_id, month, category) do update
+       set payments = r.payments + excluded.payments,
+           total_paid = r.total_paid + excluded.total_paid,
+           credits = r.credits + excluded.credits,
+           updated_at = excluded.updated_at;
+
+    return jsonb_build_object('payments', coalesce(v_payments, '[]'::jsonb), 'balances', v_balances);
+end;
+$$;
@@ -0,0 +1,59 @@
+"""Cursor pagination and field selection shared by the list routes.
+
+List routes take `limit` and `after` (a keyset cursor: the last id of the
+previous page). When a page comes back full, the cursor for the next page is
+returned in the X-Next-Cursor header. `fields` is an optional comma-separated
+list of response keys (e.g. "BillID,Amount") to project each item down to.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Sequence, Type
+
+from fastapi import HTTPException, Query
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+MAX_PAGE_SIZE = 1000
+
+LimitParam = Query(None, ge=1, le=MAX_PAGE_SIZE)
+
+
+def field_names(model: Type[BaseModel]) -> List[str]:
+    """Response keys of a model (its aliases)."""
+    return [f.alias or name for name, f in model.model_fields.items()]
+
+
+def parse_fields(fields: Optional[str], allowed: Sequence[str]) -> Optional[List[str]]:
+    """Split a fields parameter, rejecting keys the items do not have."""
+    if not fields:
+        return None
+    wanted = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in wanted if f not in allowed]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}; expected any of {', '.join(allowed)}",
+        )
+    return wanted or None
+
+
+def next_cursor(items: List[Dict[str, Any]], cursor_key: str, limit: Optional[int]) -> Optional[str]:
+    """Cursor for the following page, or None when this page was the last."""
+    if limit is None or not items or len(items) < limit:
+        return None
+    return str(items[-1][cursor_key])
+
+
+def page_response(items: List[Dict[str, Any]], cursor_key: str, limit: Optional[int],
+                  fields: Optional[List[str]] = None,
+                  model: Optional[Type[BaseModel]] = None) -> JSONResponse:
+    """Items (validated as `model`, projected to fields when given) with X-Next-Cursor."""
+    cursor = next_cursor(items, cursor_key, limit)
+    content = items
+    if model is not None:
+        content = [model(**item).model_dump(mode="json", by_alias=True) for item in items]
+    if fields:
+        content = [{f: row.get(f) for f in fields} for row in content]
+    headers = {NEXT_CURSOR_HEADER: cursor} if cursor is not None else None
+    return JSONResponse(content=content, headers=headers)
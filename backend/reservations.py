@@ -0,0 +1,121 @@
+"""In-process stock reservation tokens for hot credit_shop items.
+
+During a flash sale every redemption would otherwise decrement the same
+credit_shop row and queue on its lock. Once an item sees `hot_rate` or more
+redemption attempts within a second, the worker takes its stock from the
+database `batch` units at a time (reserve_stock) and hands the units out
+from memory; redemptions backed by a token skip the stock row
+(redeem_reward_tx with p_reserved).
+
+Tokens are stock already removed from the database, so a crash can only
+under-sell, never oversell. Tokens an item has not used for `idle_seconds`
+are handed back (release_stock) so other workers can sell them, and all of
+them are handed back on shutdown. Near sell-out a redeemer can be told the
+item is out of stock while a unit is still held by a redemption that then
+fails (e.g. insufficient credit); that unit goes back on sale.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+
+class _Item:
+    __slots__ = ("tokens", "window_start", "window_hits", "last_used")
+
+    def __init__(self) -> None:
+        self.tokens = 0
+        self.window_start = 0.0
+        self.window_hits = 0
+        self.last_used = 0.0
+
+
+class StockTokens:
+    def __init__(self, batch: int = 20, hot_rate: int = 20, idle_seconds: float = 10.0):
+        self.batch = batch
+        self.hot_rate = hot_rate
+        self.idle_seconds = idle_seconds
+        self._items: Dict[Any, _Item] = {}
+        self._lock = threading.Lock()
+        self.reserved = 0
+        self.released = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.hot_rate > 0 and self.batch > 1
+
+    def hit(self, item_id: Any) -> bool:
+        """Count a redemption attempt; True when the item should use tokens."""
+        if not self.enabled:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(item_id)
+            if item is None:
+                item = self._items[item_id] = _Item()
+            if now - item.window_start >= 1.0:
+                item.window_start = now
+                item.window_hits = 0
+            item.window_hits += 1
+            item.last_used = now
+            return item.tokens > 0 or item.window_hits >= self.hot_rate
+
+    def take(self, item_id: Any) -> bool:
+        """Use one local token; False when there is none left."""
+        with self._lock:
+            item = self._items.get(item_id)
+            if item is None or item.tokens <= 0:
+                return False
+            item.tokens -= 1
+            return True
+
+    def add(self, item_id: Any, count: int) -> None:
+        """Tokens for units just reserved in the database."""
+        if count <= 0:
+            return
+        with self._lock:
+            item = self._items.get(item_id)
+            if item is None:
+                item = self._items[item_id] = _Item()
+            item.tokens += count
+            item.last_used = time.monotonic()
+            self.reserved += count
+
+    def put_back(self, item_id: Any) -> None:
+        """Return a token whose redemption failed."""
+        with self._lock:
+            item = self._items.get(item_id)
+            if item is None:
+                item = self._items[item_id] = _Item()
+            item.tokens += 1
+
+    def drain_idle(self) -> List[Tuple[Any, int]]:
+        """Remove and return (item_id, tokens) for items idle for idle_seconds."""
+        cutoff = time.monotonic() - self.idle_seconds
+        return self._drain(lambda item: item.last_used <= cutoff)
+
+    def drain_all(self) -> List[Tuple[Any, int]]:
+        return self._drain(lambda item: True)
+
+    def _drain(self, pick: Any) -> List[Tuple[Any, int]]:
+        out: List[Tuple[Any, int]] = []
+        with self._lock:
+            for item_id, item in list(self._items.items()):
+                if not pick(item):
+                    continue
+                if item.tokens > 0:
+                    out.append((item_id, item.tokens))
+                    self.released += item.tokens
+                del self._items[item_id]
+        return out
+
+    def tokens(self, item_id: Any) -> int:
+        with self._lock:
+            item = self._items.get(item_id)
+            return item.tokens if item is not None else 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            held = {str(k): v.tokens for k, v in self._items.items() if v.tokens}
+        return {"reserved": self.reserved, "released": self.released, "held": held}
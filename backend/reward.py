@@ -2,7 +2,9 @@
 
 Replaces prior in-memory implementation. Each endpoint delegates to db.py CRUD
 helpers that map database rows to the alias-based API schema required by the
-frontend (`UserID`, `BillID`, etc.).
+frontend (`UserID`, `BillID`, etc.). Handlers are async and await the
+db_async.py variants, which share one async client instead of blocking a
+threadpool worker per request.
 
 If Supabase environment variables are missing (SUPABASE_URL & SUPABASE_KEY),
 the first attempted DB operation will raise; we translate those into HTTP 500.
@@ -10,32 +12,47 @@ the first attempted DB operation will raise; we translate those into HTTP 500.
 
 from __future__ import annotations
 
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel, Field
-from typing import List, Optional
-from datetime import date
+import csv
+import io
+import os
 
-from db import (
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+from pydantic import BaseModel, Field, ValidationError
+from typing import Any, Dict, List, Optional
+from datetime import date, datetime
+
+from db_async import (
     create_user as db_create_user,
     ensure_user as db_ensure_user,
     delete_user_by_email as db_delete_user_by_email,
     get_user as db_get_user,
     list_users as db_list_users,
     create_bill as db_create_bill,
+    create_bills as db_create_bills,
     get_bill as db_get_bill,
     list_bills as db_list_bills,
     create_payment as db_create_payment,
+    create_payments_batch as db_create_payments_batch,
     get_payment as db_get_payment,
+    get_spending_analytics as db_get_spending_analytics,
+    list_spending_rollups as db_list_spending_rollups,
+    rebuild_spending_rollups as db_rebuild_spending_rollups,
     list_payments as db_list_payments,
     list_credit_logs as db_list_credit_logs,
+    list_credit_ledger as db_list_credit_ledger,
     create_reward as db_create_reward,
     get_reward as db_get_reward,
     list_rewards as db_list_rewards,
     redeem_reward as db_redeem_reward,
     list_redemptions as db_list_redemptions,
     get_leaderboard as db_get_leaderboard,
+    get_leaderboard_rank as db_get_leaderboard_rank,
 )
-from db import get_env_status
+from db import catalog_cache_stats, get_env_status, reward_rules, stock_token_stats
+from export import export_response
+from idempotency import IDEMPOTENCY_HEADER, idempotent
+from locks import LockTimeout
+from pagination import LimitParam, field_names, page_response, parse_fields
 
 router = APIRouter(prefix="/api/reward", tags=["reward"])
 
@@ -100,7 +117,77 @@ class CreditLog(BaseModel):
     source_id: Optional[str] = Field(None, alias="SourceID")
     change_amount: int = Field(..., alias="ChangeAmount")
     balance_after: int = Field(..., alias="BalanceAfter")
-    timestamp: str = Field(..., alias="Timestamp")
+    timestamp: Optional[str] = Field(None, alias="Timestamp")  # rewards-table fallback rows have none
+
+    class Config:
+        populate_by_name = True
+        coerce_numbers_to_str = True  # credit_log ids are integers
+
+
+class CreditLedgerEntry(BaseModel):
+    entry_id: int = Field(..., alias="EntryID")
+    user_id: str = Field(..., alias="UserID")
+    delta: int = Field(..., alias="Delta")
+    source_type: str = Field(..., alias="SourceType")
+    source_id: Optional[str] = Field(None, alias="SourceID")
+    timestamp: Optional[str] = Field(None, alias="Timestamp")
+
+    class Config:
+        populate_by_name = True
+
+
+class CategorySpend(BaseModel):
+    category: str = Field(..., alias="Category")
+    payments: int = Field(..., alias="Payments")
+    total_paid: float = Field(..., alias="TotalPaid")
+    share: Optional[float] = Field(None, alias="Share")
+    average_payment: float = Field(..., alias="AveragePayment")
+    credits: int = Field(..., alias="Credits")
+    credit_rate: Optional[float] = Field(None, alias="CreditRate")
+
+    class Config:
+        populate_by_name = True
+
+
+class MonthlySpend(BaseModel):
+    month: str = Field(..., alias="Month")
+    payments: int = Field(..., alias="Payments")
+    total_paid: float = Field(..., alias="TotalPaid")
+    credits: int = Field(..., alias="Credits")
+
+    class Config:
+        populate_by_name = True
+
+
+class MonthlyCategorySpend(BaseModel):
+    month: str = Field(..., alias="Month")
+    category: str = Field(..., alias="Category")
+    payments: int = Field(..., alias="Payments")
+    total_paid: float = Field(..., alias="TotalPaid")
+    credits: int = Field(..., alias="Credits")
+
+    class Config:
+        populate_by_name = True
+
+
+class SpendingAnalytics(BaseModel):
+    user_id: str = Field(..., alias="UserID")
+    generated_at: str = Field(..., alias="GeneratedAt")
+    payments: int = Field(..., alias="Payments")
+    total_paid: float = Field(..., alias="TotalPaid")
+    average_payment: float = Field(..., alias="AveragePayment")
+    total_credits: int = Field(..., alias="TotalCredits")
+    credit_rate: Optional[float] = Field(None, alias="CreditRate")  # credits per 100 paid
+    on_time_payments: int = Field(..., alias="OnTimePayments")
+    late_payments: int = Field(..., alias="LatePayments")
+    on_time_ratio: Optional[float] = Field(None, alias="OnTimeRatio")
+    unpaid_bills: int = Field(..., alias="UnpaidBills")
+    unpaid_amount: float = Field(..., alias="UnpaidAmount")
+    overdue_bills: int = Field(..., alias="OverdueBills")
+    overdue_amount: float = Field(..., alias="OverdueAmount")
+    categories: List[CategorySpend] = Field(..., alias="Categories")
+    monthly: List[MonthlySpend] = Field(..., alias="Monthly")
+    monthly_trend: float = Field(..., alias="MonthlyTrend")  # change in spend per month
 
     class Config:
         populate_by_name = True
@@ -140,6 +227,10 @@ class Leaderboard(BaseModel):
         populate_by_name = True
 
 
+class LeaderboardRank(Leaderboard):
+    rank: int = Field(..., alias="Rank")
+
+
 # ========== Request/Response Schemas ==========
 
 class CreateUserRequest(BaseModel):
@@ -165,6 +256,23 @@ class CreateBillRequest(BaseModel):
         populate_by_name = True
 
 
+class BillImportError(BaseModel):
+    row: int = Field(..., alias="Row")
+    error: str = Field(..., alias="Error")
+
+    class Config:
+        populate_by_name = True
+
+
+class BillImportResult(BaseModel):
+    created: int = Field(..., alias="Created")
+    bill_ids: List[str] = Field(..., alias="BillIDs")
+    errors: List[BillImportError] = Field(..., alias="Errors")
+
+    class Config:
+        populate_by_name = True
+
+
 class CreatePaymentRequest(BaseModel):
     bill_id: str = Field(..., alias="BillID")
     payer_bank: Optional[str] = Field(None, alias="PayerBank")
@@ -178,11 +286,60 @@ class CreatePaymentRequest(BaseModel):
         populate_by_name = True
 
 
+class BatchPaymentItem(BaseModel):
+    bill_id: str = Field(..., alias="BillID")
+    amount_paid: float = Field(..., gt=0, alias="AmountPaid")
+    order_number: Optional[str] = Field(None, alias="OrderNumber")
+
+    class Config:
+        populate_by_name = True
+
+
+class CreateBatchPaymentRequest(BaseModel):
+    bills: List[BatchPaymentItem] = Field(..., min_length=1, max_length=500, alias="Bills")
+    payer_bank: Optional[str] = Field(None, alias="PayerBank")
+    payer_name: Optional[str] = Field(None, alias="PayerName")
+    payment_method: str = Field(..., alias="PaymentMethod")
+    remark: Optional[str] = Field(None, alias="Remark")
+
+    class Config:
+        populate_by_name = True
+
+
+class BatchPaymentResult(BaseModel):
+    payments: List[Payment] = Field(..., alias="Payments")
+    total_paid: float = Field(..., alias="TotalPaid")
+    total_credit_awarded: int = Field(..., alias="TotalCreditAwarded")
+    balances: Dict[str, int] = Field(..., alias="Balances")
+
+    class Config:
+        populate_by_name = True
+
+
 class CreateRewardRequest(BaseModel):
     type: str = Field(..., alias="Type")
     credit_cost: int = Field(..., gt=0, alias="CreditCost")
     description: Optional[str] = Field(None, alias="Description")
     icon: Optional[str] = Field(None, alias="Icon")
+    stock: Optional[int] = Field(None, ge=0, alias="Stock")  # default 9999
+
+    class Config:
+        populate_by_name = True
+
+
+class RewardQuoteRequest(BaseModel):
+    amounts: List[float] = Field(..., max_length=10000, alias="Amounts")
+    categories: List[Optional[str]] = Field(..., max_length=10000, alias="Categories")
+    at: Optional[datetime] = Field(None, alias="At")  # default: now
+
+    class Config:
+        populate_by_name = True
+
+
+class RewardQuote(BaseModel):
+    rates: List[float] = Field(..., alias="Rates")
+    credits: List[int] = Field(..., alias="Credits")
+    total_credits: int = Field(..., alias="TotalCredits")
 
     class Config:
         populate_by_name = True
@@ -214,39 +371,76 @@ class InitUserRequest(BaseModel):
 
 # ========== Helper Functions ==========
 
-# (No local helper functions; credit logic handled in db.py.)
+# (Credit logic is handled in db.py.)
+
+BILL_IMPORT_MAX_ROWS = int(os.getenv("BILL_IMPORT_MAX_ROWS", "50000"))
+
+
+def _csv_rows(text: str) -> List[Dict[str, Any]]:
+    # Blank CSV cells mean "not given", not empty strings
+    return [{k: v for k, v in row.items() if k and v not in ("", None)}
+            for row in csv.DictReader(io.StringIO(text))]
+
+
+async def _read_bill_rows(request: Request) -> List[Dict[str, Any]]:
+    """Rows from a JSON array body or an uploaded CSV file (multipart field "file")."""
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Expected a CSV upload in the 'file' field")
+        return _csv_rows((await upload.read()).decode("utf-8-sig"))
+    if content_type.startswith("text/csv"):
+        return _csv_rows((await request.body()).decode("utf-8-sig"))
+    try:
+        rows = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be a JSON array of bills or a CSV upload")
+    if not isinstance(rows, list):
+        raise HTTPException(status_code=400, detail="Body must be a JSON array of bills")
+    return rows
+
+
+def _validation_message(e: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(p) for p in err['loc']) or 'row'}: {err['msg']}" for err in e.errors()
+    )
 
 
 # ========== Endpoints ==========
 
 # --- User ---
 @router.post("/users", response_model=User)
-def create_user(payload: CreateUserRequest):
+async def create_user(payload: CreateUserRequest):
     try:
-        data = db_create_user(payload.username, payload.email, payload.password_hash)
+        data = await db_create_user(payload.username, payload.email, payload.password_hash)
         return User(**data)  # type: ignore[arg-type]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/users/{user_id}", response_model=User)
-def get_user(user_id: str):
-    data = db_get_user(user_id)
+async def get_user(user_id: str):
+    data = await db_get_user(user_id)
     if not data:
         raise HTTPException(status_code=404, detail="User not found")
     return User(**data)  # type: ignore[arg-type]
 
 
 @router.get("/users", response_model=List[User])
-def list_users():
-    return [User(**u) for u in db_list_users()]  # type: ignore[list-item]
+async def list_users(limit: Optional[int] = LimitParam, offset: int = Query(0, ge=0),
+                     after: Optional[str] = None, fields: Optional[str] = None):
+    selected = parse_fields(fields, field_names(User))
+    users = await db_list_users(limit=limit, offset=offset, after=after)
+    return page_response(users, "UserID", limit, selected, model=User)
 
 
 # --- Bill ---
 @router.post("/bills", response_model=Bill)
-def create_bill(payload: CreateBillRequest):
+async def create_bill(payload: CreateBillRequest):
     try:
-        data = db_create_bill(
+        data = await db_create_bill(
             user_id=payload.user_id,
             title=payload.title,
             amount=payload.amount,
@@ -263,24 +457,75 @@ def create_bill(payload: CreateBillRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/bills/bulk", response_model=BillImportResult)
+async def import_bills(request: Request):
+    """Create many bills from a JSON array or CSV (columns as in CreateBillRequest).
+
+    Valid rows are inserted in batched multi-row statements; invalid rows are
+    skipped and reported by their 0-based position in the input.
+    """
+    rows = await _read_bill_rows(request)
+    if len(rows) > BILL_IMPORT_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {BILL_IMPORT_MAX_ROWS} bills per import")
+
+    errors: List[BillImportError] = []
+    positions: List[int] = []
+    bills: List[Dict[str, Any]] = []
+    for i, row in enumerate(rows):
+        try:
+            if not isinstance(row, dict):
+                raise ValueError("row must be an object")
+            payload = CreateBillRequest(**row)
+        except ValidationError as e:
+            errors.append(BillImportError(row=i, error=_validation_message(e)))
+            continue
+        except (TypeError, ValueError) as e:
+            errors.append(BillImportError(row=i, error=str(e)))
+            continue
+        positions.append(i)
+        bills.append(payload.model_dump())
+
+    try:
+        created, failed = await db_create_bills(bills)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    errors.extend(BillImportError(row=positions[j], error=msg) for j, msg in failed)
+    errors.sort(key=lambda err: err.row)
+    return BillImportResult(
+        created=len(created),
+        bill_ids=[b["BillID"] for b in created],
+        errors=errors,
+    )
+
+
 @router.get("/bills/{bill_id}", response_model=Bill)
-def get_bill(bill_id: str):
-    data = db_get_bill(bill_id)
+async def get_bill(bill_id: str):
+    data = await db_get_bill(bill_id)
     if not data:
         raise HTTPException(status_code=404, detail="Bill not found")
     return Bill(**data)  # type: ignore[arg-type]
 
 
 @router.get("/bills", response_model=List[Bill])
-def list_bills(user_id: Optional[str] = None):
-    return [Bill(**b) for b in db_list_bills(user_id)]  # type: ignore[list-item]
+async def list_bills(user_id: Optional[str] = None, limit: Optional[int] = LimitParam,
+                     after: Optional[str] = None, fields: Optional[str] = None):
+    selected = parse_fields(fields, field_names(Bill))
+    bills = await db_list_bills(user_id, limit=limit, after=after)
+    return page_response(bills, "BillID", limit, selected, model=Bill)
 
 
 # --- Payment ---
 @router.post("/payments", response_model=Payment)
-def create_payment(payload: CreatePaymentRequest):
+async def create_payment(payload: CreatePaymentRequest,
+                         idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER)):
+    """Record a payment; retries with the same Idempotency-Key replay the first result."""
+    return await idempotent(idempotency_key, "reward.create-payment", payload,
+                            lambda: _create_payment(payload))
+
+
+async def _create_payment(payload: CreatePaymentRequest) -> Payment:
     try:
-        data = db_create_payment(
+        data = await db_create_payment(
             bill_id=payload.bill_id,
             amount_paid=payload.amount_paid,
             payment_method=payload.payment_method,
@@ -290,40 +535,118 @@ def create_payment(payload: CreatePaymentRequest):
             remark=payload.remark,
         )
         return Payment(**data)  # type: ignore[arg-type]
+    except LockTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except ValueError as ve:
-        raise HTTPException(status_code=404, detail=str(ve))
+        status = 404 if "not found" in str(ve) else 409
+        raise HTTPException(status_code=status, detail=str(ve))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/payments/batch", response_model=BatchPaymentResult)
+async def create_payments_batch(payload: CreateBatchPaymentRequest,
+                                idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER)):
+    """Pay several bills at once; either every payment is recorded or none is."""
+    return await idempotent(idempotency_key, "reward.create-payments-batch", payload,
+                            lambda: _create_payments_batch(payload))
+
+
+async def _create_payments_batch(payload: CreateBatchPaymentRequest) -> BatchPaymentResult:
+    ids = [item.bill_id for item in payload.bills]
+    duplicates = sorted({i for i in ids if ids.count(i) > 1})
+    if duplicates:
+        raise HTTPException(status_code=400, detail=f"Duplicate bill: {', '.join(duplicates)}")
+    try:
+        data = await db_create_payments_batch(
+            [item.model_dump() for item in payload.bills],
+            payment_method=payload.payment_method,
+            payer_name=payload.payer_name,
+            payer_bank=payload.payer_bank,
+            remark=payload.remark,
+        )
+    except ValueError as ve:
+        status = 404 if "not found" in str(ve) else 409
+        raise HTTPException(status_code=status, detail=str(ve))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    payments = [Payment(**p) for p in data["payments"]]  # type: ignore[arg-type]
+    return BatchPaymentResult(
+        payments=payments,
+        total_paid=sum(p.amount_paid for p in payments),
+        total_credit_awarded=sum(p.credit_awarded for p in payments),
+        balances=data["balances"],
+    )
+
+
 @router.get("/payments/{payment_id}", response_model=Payment)
-def get_payment(payment_id: str):
-    data = db_get_payment(payment_id)
+async def get_payment(payment_id: str):
+    data = await db_get_payment(payment_id)
     if not data:
         raise HTTPException(status_code=404, detail="Payment not found")
     return Payment(**data)  # type: ignore[arg-type]
 
 
 @router.get("/payments", response_model=List[Payment])
-def list_payments(user_id: Optional[str] = None, bill_id: Optional[str] = None):
-    return [Payment(**p) for p in db_list_payments(user_id=user_id, bill_id=bill_id)]  # type: ignore[list-item]
+async def list_payments(user_id: Optional[str] = None, bill_id: Optional[str] = None,
+                        limit: Optional[int] = LimitParam, after: Optional[str] = None,
+                        fields: Optional[str] = None):
+    selected = parse_fields(fields, field_names(Payment))
+    payments = await db_list_payments(user_id=user_id, bill_id=bill_id, limit=limit, after=after)
+    return page_response(payments, "PaymentID", limit, selected, model=Payment)
 
 
 # --- CreditLog ---
 @router.get("/credit_logs/{user_id}", response_model=List[CreditLog])
-def list_credit_logs(user_id: str):
-    return [CreditLog(**l) for l in db_list_credit_logs(user_id)]  # type: ignore[list-item]
+async def list_credit_logs(user_id: str, limit: Optional[int] = LimitParam,
+                           after: Optional[str] = None, fields: Optional[str] = None):
+    selected = parse_fields(fields, field_names(CreditLog))
+    logs = await db_list_credit_logs(user_id, limit=limit, after=after)
+    return page_response(logs, "LogID", limit, selected, model=CreditLog)
+
+
+# --- Credit ledger ---
+@router.get("/credit_ledger/{user_id}", response_model=List[CreditLedgerEntry])
+async def list_credit_ledger(user_id: str, limit: Optional[int] = LimitParam,
+                             after: Optional[int] = None, fields: Optional[str] = None):
+    """Every credit change for the user, oldest first; the balance is their sum."""
+    selected = parse_fields(fields, field_names(CreditLedgerEntry))
+    entries = await db_list_credit_ledger(user_id, limit=limit, after=after)
+    return page_response(entries, "EntryID", limit, selected, model=CreditLedgerEntry)
+
+
+# --- Analytics ---
+@router.get("/analytics/{user_id}", response_model=SpendingAnalytics)
+async def get_spending_analytics(user_id: str, months: int = Query(12, ge=1, le=120)):
+    """Compact spending summary: per-category totals, monthly series, on-time
+    ratio and credit-earning rate over the user's whole payment history."""
+    try:
+        return SpendingAnalytics(**await db_get_spending_analytics(user_id, months))  # type: ignore[arg-type]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/spending/{user_id}/monthly", response_model=List[MonthlyCategorySpend])
+async def get_monthly_spending(user_id: str, months: int = Query(12, ge=1, le=120)):
+    """Monthly spend per category from the incrementally maintained rollups:
+    one row per month and category, never a scan of the payment history.
+    Months without payments are omitted."""
+    try:
+        return [MonthlyCategorySpend(**r) for r in await db_list_spending_rollups(user_id, months)]  # type: ignore[arg-type]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 # --- Reward ---
 @router.post("/rewards", response_model=Reward)
-def create_reward(payload: CreateRewardRequest):
+async def create_reward(payload: CreateRewardRequest):
     try:
-        data = db_create_reward(
+        data = await db_create_reward(
             type_=payload.type,
             credit_cost=payload.credit_cost,
             description=payload.description,
             icon=payload.icon,
+            stock=payload.stock,
         )
         return Reward(**data)  # type: ignore[arg-type]
     except Exception as e:
@@ -331,29 +654,33 @@ def create_reward(payload: CreateRewardRequest):
 
 
 @router.get("/rewards/{reward_id}", response_model=Reward)
-def get_reward(reward_id: str):
-    data = db_get_reward(reward_id)
+async def get_reward(reward_id: str):
+    data = await db_get_reward(reward_id)
     if not data:
         raise HTTPException(status_code=404, detail="Reward not found")
     return Reward(**data)  # type: ignore[arg-type]
 
 
 @router.get("/rewards", response_model=List[Reward])
-def list_rewards(active: Optional[bool] = None):
-    return [Reward(**r) for r in db_list_rewards(active)]  # type: ignore[list-item]
+async def list_rewards(active: Optional[bool] = None):
+    return [Reward(**r) for r in await db_list_rewards(active)]  # type: ignore[list-item]
 
 
 # --- Redemption ---
 @router.post("/redemptions", response_model=Redemption)
-def redeem_reward(payload: RedeemRewardRequest):
+async def redeem_reward(payload: RedeemRewardRequest):
     try:
-        data = db_redeem_reward(user_id=payload.user_id, reward_id=payload.reward_id)
+        data = await db_redeem_reward(user_id=payload.user_id, reward_id=payload.reward_id)
         return Redemption(**data)  # type: ignore[arg-type]
+    except LockTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except ValueError as ve:
         # Business logic errors
         msg = str(ve)
         if "not found" in msg:
             raise HTTPException(status_code=404, detail=msg)
+        elif "Out of stock" in msg:
+            raise HTTPException(status_code=409, detail=msg)
         elif "Insufficient" in msg or "active" in msg:
             raise HTTPException(status_code=400, detail=msg)
         raise HTTPException(status_code=400, detail=msg)
@@ -362,14 +689,69 @@ def redeem_reward(payload: RedeemRewardRequest):
 
 
 @router.get("/redemptions/{user_id}", response_model=List[Redemption])
-def list_redemptions(user_id: str):
-    return [Redemption(**r) for r in db_list_redemptions(user_id)]  # type: ignore[list-item]
+async def list_redemptions(user_id: str, limit: Optional[int] = LimitParam,
+                           after: Optional[str] = None, fields: Optional[str] = None):
+    selected = parse_fields(fields, field_names(Redemption))
+    redemptions = await db_list_redemptions(user_id, limit=limit, after=after)
+    return page_response(redemptions, "RedemptionID", limit, selected, model=Redemption)
 
 
 # --- Leaderboard ---
 @router.get("/leaderboard", response_model=List[Leaderboard])
-def get_leaderboard(limit: int = 10):
-    return [Leaderboard(**l) for l in db_get_leaderboard(limit)]  # type: ignore[list-item]
+async def get_leaderboard(limit: int = 10):
+    return [Leaderboard(**l) for l in await db_get_leaderboard(limit)]  # type: ignore[list-item]
+
+
+@router.get("/leaderboard/rank/{user_id}", response_model=LeaderboardRank)
+async def get_leaderboard_rank(user_id: str):
+    data = await db_get_leaderboard_rank(user_id)
+    if not data:
+        raise HTTPException(status_code=404, detail="User not on leaderboard")
+    return LeaderboardRank(**data)  # type: ignore[arg-type]
+
+
+# --- Reward rules ---
+@router.get("/reward_rules")
+async def get_reward_rules(at: Optional[datetime] = None):
+    """Rates, caps and promotions in force (now, or at `at`)."""
+    return reward_rules.describe(at)
+
+
+@router.post("/reward_rules/quote", response_model=RewardQuote)
+async def quote_rewards(payload: RewardQuoteRequest):
+    """Credits the given amounts/categories would earn, in one call."""
+    if len(payload.amounts) != len(payload.categories):
+        raise HTTPException(status_code=400, detail="Amounts and Categories must have the same length")
+    credits = reward_rules.credits(payload.amounts, payload.categories, at=payload.at)
+    table = reward_rules.table(payload.at)
+    return RewardQuote(
+        rates=[table.rate(c) for c in payload.categories],
+        credits=credits,
+        total_credits=sum(credits),
+    )
+
+
+# --- Export (streamed, constant memory) ---
+@router.get("/export/payments")
+async def export_payments(user_id: Optional[str] = None, bill_id: Optional[str] = None,
+                          format: str = "ndjson"):
+    async def fetch(limit, after):
+        return await db_list_payments(user_id=user_id, bill_id=bill_id, limit=limit, after=after)
+    return export_response(fetch, "PaymentID", Payment, format, "payments")
+
+
+@router.get("/export/credit_logs/{user_id}")
+async def export_credit_logs(user_id: str, format: str = "ndjson"):
+    async def fetch(limit, after):
+        return await db_list_credit_logs(user_id, limit=limit, after=after)
+    return export_response(fetch, "LogID", CreditLog, format, f"credit_logs_{user_id}")
+
+
+@router.get("/export/redemptions/{user_id}")
+async def export_redemptions(user_id: str, format: str = "ndjson"):
+    async def fetch(limit, after):
+        return await db_list_redemptions(user_id, limit=limit, after=after)
+    return export_response(fetch, "RedemptionID", Redemption, format, f"redemptions_{user_id}")
 
 
 # ========== Seed Demo Data ==========
@@ -380,19 +762,29 @@ def get_leaderboard(limit: int = 10):
 # ========== Admin/Maintenance ==========
 
 @router.delete("/users/by-email")
-def delete_user_by_email(email: str):
+async def delete_user_by_email(email: str):
     """Delete all records for the given email across related tables.
 
     WARNING: This is a destructive operation intended for maintenance/testing.
     """
     try:
-        return db_delete_user_by_email(email)
+        return await db_delete_user_by_email(email)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/spending/rebuild")
+async def rebuild_spending_rollups(user_id: Optional[str] = None):
+    """Recompute spending rollups from raw payments (one user, or all users
+    in chunks), e.g. after editing payments by hand."""
+    try:
+        return {"status": "ok", **await db_rebuild_spending_rollups(user_id)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/diagnostics/supabase")
-def diagnostics_supabase():
+async def diagnostics_supabase():
     """Return basic environment/connection diagnostics (no secrets)."""
     try:
         status = get_env_status()
@@ -400,20 +792,26 @@ def diagnostics_supabase():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/diagnostics/cache")
+async def diagnostics_cache():
+    """Hit/miss counters of the in-process reward catalog cache, plus stock
+    tokens reserved for hot items."""
+    return {"status": "ok", "catalog": catalog_cache_stats(), "stock_tokens": stock_token_stats()}
+
 @router.post("/users/ensure", response_model=User)
-def ensure_user(payload: EnsureUserRequest):
+async def ensure_user(payload: EnsureUserRequest):
     try:
-        data = db_ensure_user(user_id=payload.user_id, email=payload.email, username=payload.username)
+        data = await db_ensure_user(user_id=payload.user_id, email=payload.email, username=payload.username)
         return User(**data)  # type: ignore[arg-type]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-from db import init_user as db_init_user  # placed after pydantic models
+from db_async import init_user as db_init_user  # placed after pydantic models
 
 @router.post("/users/init", response_model=User)
-def init_user(payload: InitUserRequest):
+async def init_user(payload: InitUserRequest):
     try:
-        data = db_init_user(user_id=payload.user_id, email=payload.email, username=payload.username)
+        data = await db_init_user(user_id=payload.user_id, email=payload.email, username=payload.username)
         return User(**data)  # type: ignore[arg-type]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
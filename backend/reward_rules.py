@@ -0,0 +1,274 @@
+"""Reward-rate rules: how many credits a payment earns, from one config.
+
+Rules are read from a JSON file (REWARD_RULES_PATH, default
+reward_rules.json next to this module):
+
+    {
+      "default_rate": 5.0,
+      "categories": {
+        "rent": {"rate": 5.0},
+        "utility": {"rate": 3.0, "cap": 500}
+      },
+      "promotions": [
+        {"name": "winter-utility", "categories": ["utility"], "rate": 6.0,
+         "starts": "2025-12-01", "ends": "2026-01-01"}
+      ]
+    }
+
+A payment earns floor(amount * rate / 100) credits, at most `cap` if its
+category has one. While a promotion runs (starts <= time < ends, UTC) its
+rate, and its cap if given, replace the category's; a promotion without
+`categories` covers every category, and overlapping promotions take the
+highest rate. Categories match case-insensitively; bills without one count
+as rent; unknown categories earn `default_rate` and are never capped.
+
+The rules are compiled into one lookup table per stretch of time between
+promotion boundaries, so a credit is one dict lookup. The file is re-read
+when its mtime changes (checked at most every `reload_seconds`), so edits
+apply without a restart; a file that fails to load keeps the previous rules.
+"""
+from __future__ import annotations
+
+import bisect
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_CATEGORY = "rent"
+
+DEFAULT_RULES: Dict[str, Any] = {
+    "default_rate": 5.0,
+    "categories": {
+        "rent": {"rate": 5.0},
+        "utility": {"rate": 3.0},
+        "subscription": {"rate": 2.0},
+    },
+    "promotions": [],
+}
+
+
+def _to_utc(value: Any) -> datetime:
+    """Naive UTC datetime from a datetime, date or ISO string."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    elif isinstance(value, date) and not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    if not isinstance(value, datetime):
+        raise ValueError(f"Not a date/time: {value!r}")
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _cap(value: Any) -> Optional[int]:
+    if value is None:
+        return None
+    cap = int(value)
+    if cap < 0:
+        raise ValueError(f"Negative cap: {value!r}")
+    return cap
+
+
+def _rate(value: Any) -> float:
+    rate = float(value)
+    if rate < 0:
+        raise ValueError(f"Negative rate: {value!r}")
+    return rate
+
+
+class RateTable:
+    """Rates and caps in force for one stretch of time."""
+
+    def __init__(self, rates: Dict[str, float], caps: Dict[str, int], default_rate: float):
+        self.rates = rates
+        self.caps = caps
+        self.default_rate = default_rate
+        # Raw category spelling -> (rate, cap), so rows skip the lower()
+        self._resolved: Dict[Any, Tuple[float, Optional[int]]] = {}
+
+    def lookup(self, category: Optional[str]) -> Tuple[float, Optional[int]]:
+        hit = self._resolved.get(category)
+        if hit is None:
+            key = (category or DEFAULT_CATEGORY).lower()
+            hit = self._resolved[category] = (self.rates.get(key, self.default_rate), self.caps.get(key))
+        return hit
+
+    def rate(self, category: Optional[str]) -> float:
+        return self.lookup(category)[0]
+
+    def credit(self, amount: float, category: Optional[str]) -> int:
+        rate, cap = self.lookup(category)
+        credit = int(float(amount or 0) * rate / 100.0)
+        return credit if cap is None or credit <= cap else cap
+
+    def server_params(self) -> Dict[str, Any]:
+        """Arguments for the payment functions (create_payment_tx & co.)."""
+        return {"p_rates": dict(self.rates), "p_caps": dict(self.caps), "p_default_rate": self.default_rate}
+
+
+class _Compiled:
+    def __init__(self, rules: Dict[str, Any]):
+        default_rate = _rate(rules.get("default_rate", DEFAULT_RULES["default_rate"]))
+        rates: Dict[str, float] = {}
+        caps: Dict[str, int] = {}
+        for name, spec in (rules.get("categories") or {}).items():
+            key = str(name).lower()
+            rates[key] = _rate(spec["rate"])
+            cap = _cap(spec.get("cap"))
+            if cap is not None:
+                caps[key] = cap
+
+        promotions = []
+        for promo in rules.get("promotions") or []:
+            starts, ends = _to_utc(promo["starts"]), _to_utc(promo["ends"])
+            if ends <= starts:
+                raise ValueError(f"Promotion {promo.get('name')!r} ends before it starts")
+            categories = [str(c).lower() for c in promo.get("categories") or []]
+            promotions.append((starts, ends, categories, _rate(promo["rate"]), _cap(promo.get("cap")),
+                               promo.get("name")))
+
+        self.rules = rules
+        self.promotions = promotions
+        self.boundaries = sorted({p[0] for p in promotions} | {p[1] for p in promotions})
+        # tables[i] is in force from boundaries[i - 1] until boundaries[i]
+        self.tables = [
+            self._table(rates, caps, default_rate, at)
+            for at in [datetime.min] + self.boundaries
+        ]
+
+    def _table(self, rates: Dict[str, float], caps: Dict[str, int], default_rate: float,
+               at: datetime) -> RateTable:
+        rates, caps = dict(rates), dict(caps)
+        best: Dict[str, float] = {}
+        everywhere = None
+        for starts, ends, categories, rate, cap, _ in self.promotions:
+            if not (starts <= at < ends):
+                continue
+            if not categories:
+                if everywhere is None or rate > everywhere[0]:
+                    everywhere = (rate, cap)
+                continue
+            for key in categories:
+                if key not in best or rate > best[key]:
+                    best[key] = rate
+                    rates[key] = rate
+                    if cap is not None:
+                        caps[key] = cap
+                    else:
+                        caps.pop(key, None)
+        if everywhere is not None:
+            rate, cap = everywhere
+            for key in set(rates) | {DEFAULT_CATEGORY}:
+                if rate > best.get(key, -1.0):
+                    rates[key] = rate
+                    if cap is not None:
+                        caps[key] = cap
+                    else:
+                        caps.pop(key, None)
+            default_rate = rate
+        return RateTable(rates, caps, default_rate)
+
+    def table(self, at: datetime) -> RateTable:
+        return self.tables[bisect.bisect_right(self.boundaries, at)]
+
+
+class RewardRules:
+    """Compiled reward rules, reloaded when the rules file changes."""
+
+    def __init__(self, path: Optional[str] = None, reload_seconds: float = 5.0):
+        self.path = path
+        self.reload_seconds = reload_seconds
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._mtime: Optional[float] = None
+        self._next_check = 0.0
+        self._compiled = _Compiled(DEFAULT_RULES)
+        self._source = "defaults"
+        self.reload()
+
+    def reload(self) -> bool:
+        """Re-read the rules file now; False (previous rules kept) if it fails."""
+        with self._lock:
+            return self._load()
+
+    def _load(self) -> bool:
+        self._next_check = time.monotonic() + self.reload_seconds
+        if not self.path or not os.path.exists(self.path):
+            return True
+        try:
+            # Remembered even if the file is broken, so it is retried once it changes again
+            self._mtime = os.path.getmtime(self.path)
+            with open(self.path, encoding="utf-8") as f:
+                compiled = _Compiled(json.load(f))
+        except Exception as e:
+            print(f"Warning: Could not load reward rules from {self.path} (keeping previous rules): {e}")
+            return False
+        self._compiled = compiled
+        self._source = self.path
+        self.reloads += 1
+        return True
+
+    def _current(self) -> _Compiled:
+        if self.reload_seconds > 0 and time.monotonic() >= self._next_check and self._lock.acquire(blocking=False):
+            try:
+                try:
+                    changed = bool(self.path) and os.path.getmtime(self.path) != self._mtime  # type: ignore[arg-type]
+                except OSError:
+                    changed = False
+                if changed:
+                    self._load()
+                else:
+                    self._next_check = time.monotonic() + self.reload_seconds
+            finally:
+                self._lock.release()
+        return self._compiled
+
+    def table(self, at: Any = None) -> RateTable:
+        """Rates in force at `at` (default: now)."""
+        return self._current().table(datetime.utcnow() if at is None else _to_utc(at))
+
+    def rate(self, category: Optional[str], at: Any = None) -> float:
+        return self.table(at).rate(category)
+
+    def credit(self, amount: float, category: Optional[str], at: Any = None) -> int:
+        return self.table(at).credit(amount, category)
+
+    def credits(self, amounts: Sequence[float], categories: Sequence[Optional[str]],
+                times: Optional[Sequence[Any]] = None, at: Any = None) -> List[int]:
+        """Credits for many payments at once.
+
+        `times` gives each payment's time (for historical rows); without it
+        every payment is rated at the rules in force at `at` (default now).
+        """
+        if len(amounts) != len(categories) or (times is not None and len(times) != len(amounts)):
+            raise ValueError("amounts, categories and times must have the same length")
+        if times is None:
+            credit = self.table(at).credit
+            return [credit(a, c) for a, c in zip(amounts, categories)]
+        compiled = self._current()
+        now = datetime.utcnow()
+        return [
+            compiled.table(now if t is None else _to_utc(t)).credit(a, c)
+            for a, c, t in zip(amounts, categories, times)
+        ]
+
+    def describe(self, at: Any = None) -> Dict[str, Any]:
+        """Rates, caps and promotions in force at `at`, plus every promotion."""
+        compiled = self._current()
+        when = datetime.utcnow() if at is None else _to_utc(at)
+        table = compiled.table(when)
+        return {
+            "at": when.isoformat(),
+            "default_rate": table.default_rate,
+            "rates": dict(table.rates),
+            "caps": dict(table.caps),
+            "promotions": [
+                {"name": name, "categories": categories, "rate": rate, "cap": cap,
+                 "starts": starts.isoformat(), "ends": ends.isoformat(), "active": starts <= when < ends}
+                for starts, ends, categories, rate, cap, name in compiled.promotions
+            ],
+            "source": self._source,
+        }
@@ -0,0 +1,965 @@
+"""Embedded SQLite storage backend.
+
+Implements the subset of the Supabase/PostgREST query-builder API used by
+db.py and bank_db.py (table().select/insert/upsert/update/delete, filters,
+order, limit/range, single) on top of a local SQLite file, so the same
+public operations can run without any network hop.
+
+- WAL journal mode with synchronous=NORMAL (concurrent readers, one writer)
+- One connection per thread, statements are parameterised and served from
+  sqlite3's compiled-statement cache
+- Schema (tables + indexes) is created on first connect
+- client.rpc(name, params) runs the local equivalent of a Postgres function
+  from migrations/ inside one BEGIN IMMEDIATE transaction
+"""
+from __future__ import annotations
+
+import re
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    id TEXT PRIMARY KEY,
+    email TEXT,
+    full_name TEXT,
+    credits REAL NOT NULL DEFAULT 0,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_profiles_email ON profiles(email);
+
+CREATE TABLE IF NOT EXISTS bills (
+    id TEXT PRIMARY KEY,
+    user_id TEXT,
+    title TEXT,
+    description TEXT,
+    receiver_bank TEXT,
+    receiver_name TEXT,
+    amount REAL NOT NULL DEFAULT 0,
+    due_date TEXT,
+    status TEXT DEFAULT 'unpaid',
+    category TEXT,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_bills_user_id ON bills(user_id, id);
+
+CREATE TABLE IF NOT EXISTS payments (
+    id TEXT PRIMARY KEY,
+    user_id TEXT,
+    bill_id TEXT,
+    payer_bank TEXT,
+    payer_name TEXT,
+    payment_time TEXT,
+    order_number TEXT,
+    amount_paid REAL NOT NULL DEFAULT 0,
+    payment_method TEXT,
+    remark TEXT,
+    status TEXT DEFAULT 'success',
+    credit_awarded INTEGER,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_payments_user_id ON payments(user_id, id);
+CREATE INDEX IF NOT EXISTS idx_payments_bill_id ON payments(bill_id);
+
+CREATE TABLE IF NOT EXISTS credit_log (
+    log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    source_type TEXT,
+    source_id INTEGER,
+    change_amount INTEGER,
+    balance_after INTEGER,
+    created_at TEXT,
+    entry_key TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_credit_log_user_id ON credit_log(user_id, log_id);
+
+CREATE TABLE IF NOT EXISTS credit_shop (
+    shop_item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    item_name TEXT,
+    item_description TEXT,
+    credit_cost INTEGER NOT NULL DEFAULT 0,
+    stock INTEGER NOT NULL DEFAULT 0,
+    status TEXT DEFAULT 'active',
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_credit_shop_status ON credit_shop(status);
+
+CREATE TABLE IF NOT EXISTS redemptions (
+    id TEXT PRIMARY KEY,
+    user_id TEXT,
+    reward_id TEXT,
+    redemption_type TEXT,
+    amount INTEGER NOT NULL DEFAULT 0,
+    description TEXT,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_redemptions_user_id ON redemptions(user_id, id);
+
+CREATE TABLE IF NOT EXISTS leaderboard (
+    user_id INTEGER PRIMARY KEY,
+    total_credit_earned INTEGER NOT NULL DEFAULT 0,
+    total_redeemed INTEGER NOT NULL DEFAULT 0,
+    last_updated TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_leaderboard_earned ON leaderboard(total_credit_earned DESC);
+
+CREATE TABLE IF NOT EXISTS rewards (
+    id TEXT PRIMARY KEY,
+    user_id TEXT,
+    total_credits REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_rewards_user_id ON rewards(user_id);
+
+CREATE TABLE IF NOT EXISTS bank_cards (
+    id TEXT PRIMARY KEY,
+    card_number TEXT NOT NULL UNIQUE,
+    card_holder_name TEXT,
+    sort_code TEXT,
+    account_number TEXT,
+    balance REAL NOT NULL DEFAULT 0,
+    currency TEXT DEFAULT 'GBP',
+    bank_name TEXT,
+    card_type TEXT,
+    status TEXT DEFAULT 'active',
+    version INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_bank_cards_created_at ON bank_cards(created_at);
+
+CREATE TABLE IF NOT EXISTS credit_ledger (
+    entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    delta INTEGER NOT NULL,
+    source_type TEXT NOT NULL,
+    source_id TEXT,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_credit_ledger_user_entry ON credit_ledger(user_id, entry_id);
+
+CREATE TABLE IF NOT EXISTS credit_snapshots (
+    user_id TEXT PRIMARY KEY,
+    balance INTEGER NOT NULL,
+    last_entry_id INTEGER NOT NULL,
+    taken_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    idempotency_key TEXT PRIMARY KEY,
+    request_hash TEXT NOT NULL,
+    status_code INTEGER,
+    response_body TEXT,
+    created_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS spending_rollups (
+    user_id TEXT NOT NULL,
+    month TEXT NOT NULL,
+    category TEXT NOT NULL,
+    payments INTEGER NOT NULL DEFAULT 0,
+    total_paid REAL NOT NULL DEFAULT 0,
+    credits INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT,
+    PRIMARY KEY (user_id, month, category)
+);
+"""
+
+# Columns added after a table first shipped: (table, column, definition).
+# Applied with ALTER TABLE to existing database files that predate them.
+COLUMN_MIGRATIONS = [
+    ("payments", "credit_awarded", "INTEGER"),
+    ("credit_log", "entry_key", "TEXT"),
+    ("bank_cards", "version", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+# Indexes on migrated columns, created once the columns exist.
+COLUMN_INDEXES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_credit_log_entry_key ON credit_log(entry_key)",
+]
+
+# Spending rollups recomputed from payments (013_spending_rollups.sql)
+_ROLLUP_SELECT = (
+    "SELECT p.user_id, substr(COALESCE(p.payment_time, p.created_at), 1, 7) || '-01', "
+    "lower(COALESCE(b.category, 'rent')), COUNT(*), SUM(COALESCE(p.amount_paid, 0)), "
+    "SUM(COALESCE(p.credit_awarded, 0)), datetime('now') "
+    "FROM payments p LEFT JOIN bills b ON b.id = p.bill_id"
+)
+
+# Idempotent data fixes run once when a client opens a database file.
+DATA_MIGRATIONS = [
+    # migrations/008_credit_ledger.sql: opening balance for pre-ledger profiles
+    "INSERT INTO credit_ledger (user_id, delta, source_type, created_at) "
+    "SELECT p.id, CAST(COALESCE(p.credits, 0) AS INTEGER), 'OpeningBalance', p.created_at "
+    "FROM profiles p WHERE COALESCE(p.credits, 0) <> 0 "
+    "AND NOT EXISTS (SELECT 1 FROM credit_ledger l WHERE l.user_id = p.id)",
+    # migrations/013_spending_rollups.sql: initial fill from existing payments
+    "INSERT OR IGNORE INTO spending_rollups "
+    "(user_id, month, category, payments, total_paid, credits, updated_at) "
+    + _ROLLUP_SELECT + " WHERE p.user_id IS NOT NULL GROUP BY 1, 2, 3",
+]
+
+# Tables whose primary key is a uuid generated by Postgres (gen_random_uuid()).
+UUID_PRIMARY_KEYS = {
+    "profiles": "id",
+    "bills": "id",
+    "payments": "id",
+    "redemptions": "id",
+    "rewards": "id",
+    "bank_cards": "id",
+}
+
+PRIMARY_KEYS = {
+    **UUID_PRIMARY_KEYS,
+    "credit_log": "log_id",
+    "credit_shop": "shop_item_id",
+    "leaderboard": "user_id",
+    "credit_ledger": "entry_id",
+    "credit_snapshots": "user_id",
+    "idempotency_keys": "idempotency_key",
+}
+
+_IDENT = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+# SQLite's default SQLITE_MAX_VARIABLE_NUMBER since 3.32
+_MAX_VARIABLES = 32766
+
+
+class SQLiteAPIError(Exception):
+    """Raised where PostgREST would answer with an error (e.g. .single() miss)."""
+
+
+def _wants_rows(returning: Any) -> bool:
+    """False for postgrest's ReturnMethod.minimal (or "minimal")."""
+    return getattr(returning, "value", returning) != "minimal"
+
+
+def _ident(name: str) -> str:
+    name = name.strip()
+    if not _IDENT.match(name):
+        raise ValueError(f"Unsupported identifier: {name!r}")
+    return f'"{name}"'
+
+
+def _adapt(value: Any) -> Any:
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _migrate_columns(conn: sqlite3.Connection) -> None:
+    for table, column, definition in COLUMN_MIGRATIONS:
+        existing = {r[1] for r in conn.execute(f"PRAGMA table_info({_ident(table)})")}
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {_ident(table)} ADD COLUMN {_ident(column)} {definition}")
+    for sql in COLUMN_INDEXES:
+        conn.execute(sql)
+
+
+class SQLiteResponse:
+    """Mirror of postgrest's APIResponse (data + count)."""
+
+    def __init__(self, data: Any, count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+class SQLiteQuery:
+    """Query builder for one table; mirrors the postgrest request builders."""
+
+    def __init__(self, client: "SQLiteClient", table: str):
+        self._client = client
+        self._table = table
+        self._op: Optional[str] = None
+        self._columns = "*"
+        self._count: Optional[str] = None
+        self._payload: Any = None
+        self._on_conflict: Optional[str] = None
+        self._ignore_duplicates = False
+        self._returning = True
+        self._where: List[str] = []
+        self._params: List[Any] = []
+        self._order: List[str] = []
+        self._limit: Optional[int] = None
+        self._offset: Optional[int] = None
+        self._single: Optional[str] = None
+
+    # ----- operations -----
+
+    def select(self, *columns: str, count: Optional[str] = None) -> "SQLiteQuery":
+        self._op = "select"
+        cols = ",".join(columns) if columns else "*"
+        parts = [c.strip() for c in cols.split(",") if c.strip()]
+        self._columns = "*" if parts in ([], ["*"]) else ", ".join(_ident(c) for c in parts)
+        self._count = count
+        return self
+
+    def insert(self, json: Any, *, count: Optional[str] = None, upsert: bool = False,
+               returning: Any = None, **_: Any) -> "SQLiteQuery":
+        self._op = "upsert" if upsert else "insert"
+        self._payload = json
+        self._returning = _wants_rows(returning)
+        return self
+
+    def upsert(self, json: Any, *, on_conflict: str = "", ignore_duplicates: bool = False,
+               returning: Any = None, **_: Any) -> "SQLiteQuery":
+        self._op = "upsert"
+        self._payload = json
+        self._on_conflict = on_conflict or None
+        self._ignore_duplicates = ignore_duplicates
+        self._returning = _wants_rows(returning)
+        return self
+
+    def update(self, json: Dict[str, Any], **_: Any) -> "SQLiteQuery":
+        self._op = "update"
+        self._payload = json
+        return self
+
+    def delete(self, *, count: Optional[str] = None, returning: Any = None, **_: Any) -> "SQLiteQuery":
+        self._op = "delete"
+        self._count = count
+        self._returning = _wants_rows(returning)
+        return self
+
+    # ----- filters -----
+
+    def _cmp(self, column: str, op: str, value: Any) -> "SQLiteQuery":
+        self._where.append(f"{_ident(column)} {op} ?")
+        self._params.append(_adapt(value))
+        return self
+
+    def eq(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._cmp(column, "=", value)
+
+    def neq(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._cmp(column, "!=", value)
+
+    def gt(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._cmp(column, ">", value)
+
+    def gte(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._cmp(column, ">=", value)
+
+    def lt(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._cmp(column, "<", value)
+
+    def lte(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._cmp(column, "<=", value)
+
+    def like(self, column: str, pattern: str) -> "SQLiteQuery":
+        return self._cmp(column, "LIKE", pattern.replace("*", "%"))
+
+    def in_(self, column: str, values: Sequence[Any]) -> "SQLiteQuery":
+        values = list(values)
+        if not values:
+            self._where.append("0")
+            return self
+        self._where.append(f"{_ident(column)} IN ({', '.join('?' * len(values))})")
+        self._params.extend(_adapt(v) for v in values)
+        return self
+
+    def is_(self, column: str, value: Any) -> "SQLiteQuery":
+        if value is None or str(value).lower() == "null":
+            self._where.append(f"{_ident(column)} IS NULL")
+            return self
+        return self._cmp(column, "IS", value)
+
+    # ----- modifiers -----
+
+    def order(self, column: str, *, desc: bool = False, **_: Any) -> "SQLiteQuery":
+        self._order.append(f"{_ident(column)} {'DESC' if desc else 'ASC'}")
+        return self
+
+    def limit(self, size: int, **_: Any) -> "SQLiteQuery":
+        self._limit = int(size)
+        return self
+
+    def offset(self, size: int) -> "SQLiteQuery":
+        self._offset = int(size)
+        return self
+
+    def range(self, start: int, end: int, **_: Any) -> "SQLiteQuery":
+        self._offset = int(start)
+        self._limit = int(end) - int(start) + 1
+        return self
+
+    def single(self) -> "SQLiteQuery":
+        self._single = "single"
+        return self
+
+    def maybe_single(self) -> "SQLiteQuery":
+        self._single = "maybe"
+        return self
+
+    # ----- execution -----
+
+    def _where_sql(self) -> str:
+        return f" WHERE {' AND '.join(self._where)}" if self._where else ""
+
+    def _tail_sql(self) -> str:
+        sql = f" ORDER BY {', '.join(self._order)}" if self._order else ""
+        if self._limit is not None or self._offset is not None:
+            sql += f" LIMIT {self._limit if self._limit is not None else -1}"
+            if self._offset:
+                sql += f" OFFSET {self._offset}"
+        return sql
+
+    def execute(self) -> SQLiteResponse:
+        conn = self._client.connection()
+        table = _ident(self._table)
+        count: Optional[int] = None
+        if self._op in (None, "select"):
+            sql = f"SELECT {self._columns} FROM {table}{self._where_sql()}{self._tail_sql()}"
+            rows = [dict(r) for r in conn.execute(sql, self._params)]
+            if self._count:
+                count = conn.execute(
+                    f"SELECT COUNT(*) FROM {table}{self._where_sql()}", self._params
+                ).fetchone()[0]
+        elif self._op in ("insert", "upsert"):
+            rows = self._client.insert_rows(
+                conn, self._table, self._payload,
+                on_conflict=self._on_conflict if self._op == "upsert" else None,
+                upsert=self._op == "upsert",
+                ignore_duplicates=self._ignore_duplicates,
+                returning=self._returning,
+            )
+        elif self._op == "update":
+            assignments = ", ".join(f"{_ident(k)} = ?" for k in self._payload)
+            params = [_adapt(v) for v in self._payload.values()] + self._params
+            sql = f"UPDATE {table} SET {assignments}{self._where_sql()} RETURNING *"
+            rows = [dict(r) for r in conn.execute(sql, params)]
+        elif self._op == "delete":
+            sql = f"DELETE FROM {table}{self._where_sql()}"
+            if self._returning:
+                rows = [dict(r) for r in conn.execute(sql + " RETURNING *", self._params)]
+                count = len(rows) if self._count else None
+            else:
+                rows = []
+                deleted = conn.execute(sql, self._params).rowcount
+                count = deleted if self._count else None
+        else:
+            raise ValueError(f"Unsupported operation: {self._op}")
+
+        if self._single is not None:
+            if len(rows) == 1:
+                return SQLiteResponse(rows[0], count)
+            if self._single == "maybe" and not rows:
+                return SQLiteResponse(None, count)
+            raise SQLiteAPIError(
+                f"JSON object requested, multiple (or no) rows returned ({len(rows)})"
+            )
+        return SQLiteResponse(rows, count)
+
+
+class SQLiteRPC:
+    """Pending call of a registered local function (mirrors postgrest's rpc builder)."""
+
+    def __init__(self, client: "SQLiteClient", name: str, params: Dict[str, Any]):
+        self._client = client
+        self._name = name
+        self._params = params
+
+    def execute(self) -> SQLiteResponse:
+        fn = RPC_FUNCTIONS.get(self._name)
+        if fn is None:
+            raise SQLiteAPIError(f"Could not find the function {self._name}")
+        conn = self._client.connection()
+        with self._client.transaction(conn):
+            return SQLiteResponse(fn(self._client, conn, self._params))
+
+
+class SQLiteClient:
+    """Drop-in stand-in for supabase.Client backed by a SQLite database file."""
+
+    def __init__(self, path: str):
+        if path == ":memory:":
+            # Shared in-memory DB so every per-thread connection sees the same data
+            self._target = f"file:guhack-{uuid.uuid4().hex}?mode=memory&cache=shared"
+        else:
+            self._target = f"file:{path}"
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        # Keep one connection open for the lifetime of the client (keeps
+        # shared in-memory databases alive and creates the schema eagerly).
+        self._keepalive = self.connection()
+        with self.transaction(self._keepalive) as conn:
+            for sql in DATA_MIGRATIONS:
+                conn.execute(sql)
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self._target,
+                uri=True,
+                isolation_level=None,  # autocommit; explicit BEGIN for transactions
+                cached_statements=512,
+                timeout=5.0,
+            )
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            with self._schema_lock:
+                conn.executescript(SCHEMA)
+                _migrate_columns(conn)
+            self._local.conn = conn
+        return conn
+
+    def table(self, name: str) -> SQLiteQuery:
+        return SQLiteQuery(self, name)
+
+    def from_(self, name: str) -> SQLiteQuery:
+        return self.table(name)
+
+    def rpc(self, fn: str, params: Optional[Dict[str, Any]] = None) -> SQLiteRPC:
+        return SQLiteRPC(self, fn, dict(params or {}))
+
+    @contextmanager
+    def transaction(self, conn: Optional[sqlite3.Connection] = None) -> Iterator[sqlite3.Connection]:
+        """BEGIN IMMEDIATE ... COMMIT on the calling thread's connection (re-entrant)."""
+        conn = conn or self.connection()
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def insert_rows(self, conn: sqlite3.Connection, table: str, payload: Any,
+                    on_conflict: Optional[str] = None, upsert: bool = False,
+                    ignore_duplicates: bool = False, returning: bool = True) -> List[Dict[str, Any]]:
+        """Multi-row INSERT ... RETURNING *, batched under SQLite's variable limit.
+
+        returning=False skips RETURNING (postgrest's returning="minimal").
+        """
+        rows = [payload] if isinstance(payload, dict) else list(payload or [])
+        if not rows:
+            return []
+        pk = UUID_PRIMARY_KEYS.get(table)
+        prepared = []
+        for row in rows:
+            row = {k: _adapt(v) for k, v in row.items()}
+            if pk and row.get(pk) is None:
+                row[pk] = str(uuid.uuid4())
+            prepared.append(row)
+
+        # Rows with the same key set share one multi-row statement
+        groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+        for row in prepared:
+            groups.setdefault(tuple(row.keys()), []).append(row)
+
+        conflict_col = on_conflict or PRIMARY_KEYS.get(table)
+        out: List[Dict[str, Any]] = []
+        with self.transaction(conn):
+            for cols, group in groups.items():
+                col_sql = ", ".join(_ident(c) for c in cols)
+                row_sql = f"({', '.join('?' * len(cols))})"
+                suffix = ""
+                if upsert and conflict_col:
+                    updates = ", ".join(
+                        f"{_ident(c)} = excluded.{_ident(c)}" for c in cols if c != conflict_col
+                    )
+                    target = ", ".join(_ident(c) for c in conflict_col.split(","))
+                    suffix = (f" ON CONFLICT ({target}) DO UPDATE SET {updates}"
+                              if updates and not ignore_duplicates
+                              else f" ON CONFLICT ({target}) DO NOTHING")
+                per_stmt = max(1, _MAX_VARIABLES // len(cols))
+                for i in range(0, len(group), per_stmt):
+                    chunk = group[i:i + per_stmt]
+                    sql = (f"INSERT INTO {_ident(table)} ({col_sql}) VALUES "
+                           f"{', '.join([row_sql] * len(chunk))}{suffix}")
+                    params = [row[c] for row in chunk for c in cols]
+                    if returning:
+                        out.extend(dict(r) for r in conn.execute(sql + " RETURNING *", params))
+                    else:
+                        conn.execute(sql, params)
+        return out
+
+
+# ---------- Local equivalents of the Postgres functions in migrations/ ----------
+
+RpcFunction = Callable[[SQLiteClient, sqlite3.Connection, Dict[str, Any]], Any]
+RPC_FUNCTIONS: Dict[str, RpcFunction] = {}
+
+
+def rpc_function(name: str) -> Callable[[RpcFunction], RpcFunction]:
+    def register(fn: RpcFunction) -> RpcFunction:
+        RPC_FUNCTIONS[name] = fn
+        return fn
+    return register
+
+
+def _legacy_int_user_id(user_id: str) -> int:
+    """Integer key used by credit_log/leaderboard for a profiles uuid."""
+    return int(user_id.replace('-', '')[:9], 16) % 2147483647
+
+
+def _payment_credit(p: Dict[str, Any], amount: float, category: Optional[str]) -> int:
+    """Credits for one payment from p_rates / p_default_rate / p_caps (012)."""
+    category = (category or "rent").lower()
+    rate = float((p.get("p_rates") or {}).get(category, p.get("p_default_rate", 5.0)))
+    credit = int(amount * rate / 100.0)
+    cap = (p.get("p_caps") or {}).get(category)
+    return credit if cap is None else min(credit, int(cap))
+
+
+@rpc_function("create_payment_tx")
+def _create_payment_tx(client: SQLiteClient, conn: sqlite3.Connection,
+                       p: Dict[str, Any]) -> Dict[str, Any]:
+    """migrations/002_create_payment_tx.sql (leaderboard update: 004, ledger: 008, caps: 012, rollups: 013)"""
+    # BEGIN IMMEDIATE already holds the write lock, so the status cannot change under us
+    bill = conn.execute(
+        "SELECT user_id, category, status FROM bills WHERE id = ?", (p["p_bill_id"],)
+    ).fetchone()
+    if bill is None:
+        raise SQLiteAPIError("Bill not found")
+    if (bill["status"] or "").lower() == "paid":
+        raise SQLiteAPIError(f"Bill already paid: {p['p_bill_id']}")
+    user_id = bill["user_id"]
+    amount = float(p["p_amount_paid"])
+    credit = _payment_credit(p, amount, bill["category"])
+    now = p.get("p_now") or datetime.utcnow().isoformat()
+
+    payment = client.insert_rows(conn, "payments", {
+        "bill_id": p["p_bill_id"],
+        "user_id": user_id,
+        "payer_bank": p.get("p_payer_bank"),
+        "payer_name": p.get("p_payer_name"),
+        "payment_time": now,
+        "order_number": p.get("p_order_number"),
+        "amount_paid": amount,
+        "payment_method": p.get("p_payment_method"),
+        "remark": p.get("p_remark"),
+        "status": "success",
+        "credit_awarded": credit,
+        "created_at": now,
+    })[0]
+    conn.execute("UPDATE bills SET status = 'paid' WHERE id = ?", (p["p_bill_id"],))
+    balance_after = _ledger_append(conn, user_id, credit, "Payment", payment["id"])
+    conn.execute(
+        "INSERT INTO credit_log (user_id, source_type, source_id, change_amount, balance_after, created_at) "
+        "VALUES (?, 'Payment', NULL, ?, ?, ?)",
+        (_legacy_int_user_id(user_id), credit, balance_after, now),
+    )
+    _leaderboard_add(conn, _legacy_int_user_id(user_id), credit, 0, now)
+    _rollup_add(conn, user_id, now, bill["category"], 1, amount, credit)
+    return {**payment, "balance_after": balance_after}
+
+
+@rpc_function("create_payments_batch_tx")
+def _create_payments_batch_tx(client: SQLiteClient, conn: sqlite3.Connection,
+                              p: Dict[str, Any]) -> Dict[str, Any]:
+    """migrations/005_create_payments_batch_tx.sql (ledger: 008, caps: 012, rollups: 013)"""
+    items = p.get("p_items") or []
+    ids = [item["bill_id"] for item in items]
+    seen = set()
+    for bill_id in ids:
+        if bill_id in seen:
+            raise SQLiteAPIError(f"Duplicate bill: {bill_id}")
+        seen.add(bill_id)
+    bills: Dict[str, sqlite3.Row] = {}
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        for row in conn.execute(
+            f"SELECT id, user_id, category, status FROM bills WHERE id IN ({', '.join('?' * len(chunk))})",
+            chunk,
+        ):
+            bills[row["id"]] = row
+    for bill_id in ids:
+        if bill_id not in bills:
+            raise SQLiteAPIError(f"Bill not found: {bill_id}")
+    for bill_id in ids:
+        if (bills[bill_id]["status"] or "").lower() == "paid":
+            raise SQLiteAPIError(f"Bill already paid: {bill_id}")
+
+    now = p.get("p_now") or datetime.utcnow().isoformat()
+    rows = []
+    for item in items:
+        bill = bills[item["bill_id"]]
+        amount = float(item["amount_paid"])
+        rows.append({
+            "bill_id": item["bill_id"],
+            "user_id": bill["user_id"],
+            "payer_bank": p.get("p_payer_bank"),
+            "payer_name": p.get("p_payer_name"),
+            "payment_time": now,
+            "order_number": item.get("order_number"),
+            "amount_paid": amount,
+            "payment_method": p.get("p_payment_method"),
+            "remark": p.get("p_remark"),
+            "status": "success",
+            "credit_awarded": _payment_credit(p, amount, bill["category"]),
+            "created_at": now,
+        })
+    payments = client.insert_rows(conn, "payments", rows) if rows else []
+    conn.executemany("UPDATE bills SET status = 'paid' WHERE id = ?", [(bill_id,) for bill_id in ids])
+
+    conn.executemany(
+        "INSERT INTO credit_ledger (user_id, delta, source_type, source_id, created_at) "
+        "VALUES (?, ?, 'Payment', ?, ?)",
+        [(payment["user_id"], int(payment["credit_awarded"]), payment["id"], now) for payment in payments],
+    )
+    earned: Dict[str, int] = {}
+    for payment in payments:
+        earned[payment["user_id"]] = earned.get(payment["user_id"], 0) + int(payment["credit_awarded"])
+    balances: Dict[str, int] = {}
+    for user_id, credit in earned.items():
+        conn.execute("UPDATE profiles SET credits = COALESCE(credits, 0) + ? WHERE id = ?", (credit, user_id))
+        balances[user_id] = _credit_balance(conn, user_id)[0]
+        conn.execute(
+            "INSERT INTO credit_log (user_id, source_type, source_id, change_amount, balance_after, created_at) "
+            "VALUES (?, 'Payment', NULL, ?, ?, ?)",
+            (_legacy_int_user_id(user_id), credit, balances[user_id], now),
+        )
+        _leaderboard_add(conn, _legacy_int_user_id(user_id), credit, 0, now)
+    rollups: Dict[Tuple[str, Any], List[float]] = {}
+    for payment in payments:
+        totals = rollups.setdefault((payment["user_id"], bills[payment["bill_id"]]["category"]), [0, 0.0, 0])
+        totals[0] += 1
+        totals[1] += float(payment["amount_paid"])
+        totals[2] += int(payment["credit_awarded"])
+    for (user_id, category), (count, amount, credit) in rollups.items():
+        _rollup_add(conn, user_id, now, category, int(count), amount, int(credit))
+    return {"payments": payments, "balances": balances}
+
+
+def _rollup_add(conn: sqlite3.Connection, user_id: str, at: str, category: Optional[str],
+                payments: int, amount: float, credits: int) -> None:
+    conn.execute(
+        "INSERT INTO spending_rollups (user_id, month, category, payments, total_paid, credits, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (user_id, month, category) DO UPDATE SET "
+        "payments = payments + excluded.payments, "
+        "total_paid = total_paid + excluded.total_paid, "
+        "credits = credits + excluded.credits, "
+        "updated_at = excluded.updated_at",
+        (user_id, at[:7] + "-01", (category or "rent").lower(), payments, amount, credits,
+         datetime.utcnow().isoformat()),
+    )
+
+
+@rpc_function("spending_rollups_rebuild")
+def _spending_rollups_rebuild(client: SQLiteClient, conn: sqlite3.Connection, p: Dict[str, Any]) -> int:
+    """migrations/013_spending_rollups.sql"""
+    user_ids = list(p.get("p_user_ids") or [])
+    if not user_ids:
+        return 0
+    marks = ", ".join("?" * len(user_ids))
+    conn.execute(f"DELETE FROM spending_rollups WHERE user_id IN ({marks})", user_ids)
+    before = conn.total_changes
+    conn.execute(
+        "INSERT INTO spending_rollups (user_id, month, category, payments, total_paid, credits, updated_at) "
+        + _ROLLUP_SELECT + f" WHERE p.user_id IN ({marks}) GROUP BY 1, 2, 3",
+        user_ids,
+    )
+    return conn.total_changes - before
+
+
+def _leaderboard_add(conn: sqlite3.Connection, user_id: int, earned: int, redeemed: int, now: str) -> None:
+    conn.execute(
+        "INSERT INTO leaderboard (user_id, total_credit_earned, total_redeemed, last_updated) "
+        "VALUES (?, ?, ?, ?) ON CONFLICT (user_id) DO UPDATE SET "
+        "total_credit_earned = total_credit_earned + excluded.total_credit_earned, "
+        "total_redeemed = total_redeemed + excluded.total_redeemed, "
+        "last_updated = excluded.last_updated",
+        (user_id, earned, redeemed, now),
+    )
+
+
+@rpc_function("leaderboard_add")
+def _leaderboard_add_rpc(client: SQLiteClient, conn: sqlite3.Connection, p: Dict[str, Any]) -> None:
+    """migrations/004_leaderboard_totals.sql"""
+    _leaderboard_add(conn, int(p["p_user_id"]), int(p.get("p_earned") or 0),
+                     int(p.get("p_redeemed") or 0), p.get("p_now") or datetime.utcnow().isoformat())
+
+
+def _credit_balance(conn: sqlite3.Connection, user_id: str) -> Tuple[int, int]:
+    """(snapshot balance + ledger tail, number of tail entries)"""
+    row = conn.execute(
+        "SELECT COALESCE(s.balance, 0) + COALESCE(SUM(l.delta), 0) AS balance, "
+        "COUNT(l.entry_id) AS tail_entries "
+        "FROM (SELECT ? AS user_id) u "
+        "LEFT JOIN credit_snapshots s ON s.user_id = u.user_id "
+        "LEFT JOIN credit_ledger l ON l.user_id = u.user_id AND l.entry_id > COALESCE(s.last_entry_id, 0)",
+        (user_id,),
+    ).fetchone()
+    return int(row["balance"]), int(row["tail_entries"])
+
+
+def _ledger_append(conn: sqlite3.Connection, user_id: str, delta: int, source_type: str,
+                   source_id: Optional[Any] = None) -> int:
+    conn.execute(
+        "INSERT INTO credit_ledger (user_id, delta, source_type, source_id, created_at) VALUES (?, ?, ?, ?, ?)",
+        (user_id, delta, source_type, None if source_id is None else str(source_id),
+         datetime.utcnow().isoformat()),
+    )
+    conn.execute("UPDATE profiles SET credits = COALESCE(credits, 0) + ? WHERE id = ?", (delta, user_id))
+    return _credit_balance(conn, user_id)[0]
+
+
+@rpc_function("credit_balance")
+def _credit_balance_rpc(client: SQLiteClient, conn: sqlite3.Connection, p: Dict[str, Any]) -> Dict[str, int]:
+    """migrations/008_credit_ledger.sql"""
+    balance, tail_entries = _credit_balance(conn, p["p_user_id"])
+    return {"balance": balance, "tail_entries": tail_entries}
+
+
+@rpc_function("credit_ledger_append")
+def _credit_ledger_append(client: SQLiteClient, conn: sqlite3.Connection, p: Dict[str, Any]) -> int:
+    """migrations/008_credit_ledger.sql"""
+    return _ledger_append(conn, p["p_user_id"], int(p["p_delta"]), p["p_source_type"], p.get("p_source_id"))
+
+
+@rpc_function("credit_snapshot")
+def _credit_snapshot(client: SQLiteClient, conn: sqlite3.Connection, p: Dict[str, Any]) -> int:
+    """migrations/008_credit_ledger.sql"""
+    changes = conn.total_changes  # rowcount is -1 for statements starting with WITH
+    conn.execute(
+        "WITH bounds AS ("
+        " SELECT l.user_id, COALESCE(s.last_entry_id, 0) AS after_id, COALESCE(s.balance, 0) AS base,"
+        " MIN(CASE WHEN l.created_at >= :before THEN l.entry_id END) AS stop_id"
+        " FROM credit_ledger l LEFT JOIN credit_snapshots s ON s.user_id = l.user_id"
+        " WHERE (:user_id IS NULL OR l.user_id = :user_id) AND l.entry_id > COALESCE(s.last_entry_id, 0)"
+        " GROUP BY l.user_id)"
+        " INSERT INTO credit_snapshots (user_id, balance, last_entry_id, taken_at)"
+        " SELECT b.user_id, b.base + SUM(l.delta), MAX(l.entry_id), :now"
+        " FROM bounds b JOIN credit_ledger l ON l.user_id = b.user_id AND l.entry_id > b.after_id"
+        " AND (b.stop_id IS NULL OR l.entry_id < b.stop_id)"
+        " WHERE true GROUP BY b.user_id"
+        " ON CONFLICT (user_id) DO UPDATE SET balance = excluded.balance,"
+        " last_entry_id = excluded.last_entry_id, taken_at = excluded.taken_at"
+        " WHERE credit_snapshots.last_entry_id < excluded.last_entry_id",
+        {
+            "user_id": p.get("p_user_id"),
+            "before": p.get("p_before") or datetime.utcnow().isoformat(),
+            "now": datetime.utcnow().isoformat(),
+        },
+    )
+    return conn.total_changes - changes
+
+
+_ACTIVE_STATUSES = ("active", "enabled", "available")
+
+
+@rpc_function("reserve_stock")
+def _reserve_stock(client: SQLiteClient, conn: sqlite3.Connection, p: Dict[str, Any]) -> int:
+    """migrations/010_redeem_reward_tx.sql"""
+    row = conn.execute(
+        "SELECT stock, status FROM credit_shop WHERE shop_item_id = ?", (p["p_shop_item_id"],)
+    ).fetchone()
+    if row is None or (row["status"] or "active").lower() not in _ACTIVE_STATUSES or (row["stock"] or 0) <= 0:
+        return 0
+    granted = min(int(row["stock"]), max(int(p["p_count"]), 0))
+    conn.execute("UPDATE credit_shop SET stock = stock - ? WHERE shop_item_id = ?", (granted, p["p_shop_item_id"]))
+    return granted
+
+
+@rpc_function("release_stock")
+def _release_stock(client: SQLiteClient, conn: sqlite3.Connection, p: Dict[str, Any]) -> None:
+    """migrations/010_redeem_reward_tx.sql"""
+    conn.execute("UPDATE credit_shop SET stock = stock + ? WHERE shop_item_id = ?",
+                 (max(int(p["p_count"]), 0), p["p_shop_item_id"]))
+
+
+@rpc_function("redeem_reward_tx")
+def _redeem_reward_tx(client: SQLiteClient, conn: sqlite3.Connection, p: Dict[str, Any]) -> Dict[str, Any]:
+    """migrations/010_redeem_reward_tx.sql"""
+    user_id = p["p_user_id"]
+    if conn.execute("SELECT 1 FROM profiles WHERE id = ?", (user_id,)).fetchone() is None:
+        raise SQLiteAPIError("User not found")
+    item = conn.execute(
+        "SELECT shop_item_id, credit_cost, status FROM credit_shop WHERE shop_item_id = ?",
+        (p["p_shop_item_id"],),
+    ).fetchone()
+    if item is None:
+        raise SQLiteAPIError("Reward not found")
+    if (item["status"] or "active").lower() not in _ACTIVE_STATUSES:
+        raise SQLiteAPIError("Reward not active")
+    cost = int(item["credit_cost"] or 0)
+    if _credit_balance(conn, user_id)[0] < cost:
+        raise SQLiteAPIError("Insufficient credit")
+    if not p.get("p_reserved"):
+        updated = conn.execute(
+            "UPDATE credit_shop SET stock = stock - 1 WHERE shop_item_id = ? AND stock > 0",
+            (item["shop_item_id"],),
+        ).rowcount
+        if not updated:
+            raise SQLiteAPIError("Out of stock")
+    now = p.get("p_now") or datetime.utcnow().isoformat()
+    redemption = client.insert_rows(conn, "redemptions", {
+        "user_id": user_id,
+        "reward_id": None,
+        "redemption_type": "credit_shop",
+        "amount": cost,
+        "description": f"shop_item:{item['shop_item_id']}",
+        "created_at": now,
+    })[0]
+    balance_after = _ledger_append(conn, user_id, -cost, "Redemption", redemption["id"])
+    _leaderboard_add(conn, _legacy_int_user_id(user_id), 0, cost, now)
+    return {**redemption, "balance_after": balance_after}
+
+
+def _adjust_card_balance(conn: sqlite3.Connection, card_number: str, delta: float,
+                         guard: bool) -> List[Dict[str, Any]]:
+    sql = ("UPDATE bank_cards SET balance = balance + ?, version = version + 1, updated_at = ? "
+           "WHERE card_number = ?")
+    params: List[Any] = [delta, datetime.utcnow().isoformat(), card_number]
+    if guard:
+        sql += " AND balance >= ?"
+        params.append(-delta)
+    return [dict(r) for r in conn.execute(sql + " RETURNING *", params)]
+
+
+@rpc_function("debit_card")
+def _debit_card(client: SQLiteClient, conn: sqlite3.Connection, p: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """migrations/003_bank_card_balance.sql, 011_bank_card_version.sql"""
+    return _adjust_card_balance(conn, p["p_card_number"], -float(p["p_amount"]), guard=True)
+
+
+@rpc_function("credit_card")
+def _credit_card(client: SQLiteClient, conn: sqlite3.Connection, p: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """migrations/003_bank_card_balance.sql, 011_bank_card_version.sql"""
+    return _adjust_card_balance(conn, p["p_card_number"], float(p["p_amount"]), guard=False)
+
+
+@rpc_function("set_card_balance")
+def _set_card_balance(client: SQLiteClient, conn: sqlite3.Connection, p: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """migrations/011_bank_card_version.sql"""
+    rows = conn.execute(
+        "UPDATE bank_cards SET balance = ?, version = version + 1, updated_at = ? "
+        "WHERE card_number = ? RETURNING *",
+        (float(p["p_balance"]), datetime.utcnow().isoformat(), p["p_card_number"]),
+    )
+    return [dict(r) for r in rows]
+
+
+@rpc_function("bank_card_stats")
+def _bank_card_stats(client: SQLiteClient, conn: sqlite3.Connection, p: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """migrations/006_bank_card_stats.sql"""
+    row = conn.execute(
+        "SELECT COUNT(*) AS card_count, COALESCE(SUM(balance), 0) AS total_balance FROM bank_cards"
+    ).fetchone()
+    return [dict(row)]
+
+
+_clients: Dict[str, SQLiteClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_sqlite_client(path: str) -> SQLiteClient:
+    """Return the process-wide client for a database path."""
+    with _clients_lock:
+        client = _clients.get(path)
+        if client is None:
+            client = SQLiteClient(path)
+            _clients[path] = client
+        return client
@@ -0,0 +1,308 @@
+"""Storage backend selection for db.py and bank_db.py.
+
+Both modules talk to a PostgREST-style client (`client.table(T).select(...)`).
+Which client they get is chosen by configuration:
+
+- STORAGE_BACKEND=supabase (default): hosted Supabase/PostgREST over HTTPS
+- STORAGE_BACKEND=sqlite: embedded SQLite file (see sqlite_store.py), no network
+
+The bank database can be pointed elsewhere with BANK_STORAGE_BACKEND
+(defaults to STORAGE_BACKEND). SQLite file locations come from SQLITE_PATH and
+BANK_SQLITE_PATH; ":memory:" gives a throwaway in-process database.
+
+Storage operations in db.py/bank_db.py are written once as generators that
+yield unexecuted queries and receive their results (StorageOp). run_sync
+drives them with the blocking clients; run_async drives them with the async
+Supabase client (db_async.py, bank_db_async.py), so the same query logic serves
+both the sync helpers and the async FastAPI handlers.
+
+An operation can also yield a BlockingCall for local blocking I/O (such as
+a write-behind spool append): run_sync runs it inline, run_async in a worker
+thread, so it stays off the event loop.
+
+Every client is wrapped in TracedClient, which counts each executed storage
+request (one PostgREST round trip, or one SQLite statement/transaction) so
+callers can see how many calls a request made (see count_storage_calls) and
+per table/operation latency is exported at /api/metrics (metrics.py).
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import inspect
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Generator, Iterator, Optional, TypeVar
+
+from dotenv import load_dotenv
+
+from metrics import observe_storage_call
+
+HERE = Path(__file__).resolve().parent
+ROOT = HERE.parent
+
+load_dotenv(str(ROOT / ".env"))
+load_dotenv(str(HERE / ".env"))
+
+BACKEND_SUPABASE = "supabase"
+BACKEND_SQLITE = "sqlite"
+STORAGE_BACKENDS = (BACKEND_SUPABASE, BACKEND_SQLITE)
+
+STORAGE_BACKEND = (os.getenv("STORAGE_BACKEND") or BACKEND_SUPABASE).strip().lower()
+BANK_STORAGE_BACKEND = (os.getenv("BANK_STORAGE_BACKEND") or STORAGE_BACKEND).strip().lower()
+
+SQLITE_PATH = os.getenv("SQLITE_PATH") or str(HERE / "guhack.db")
+BANK_SQLITE_PATH = os.getenv("BANK_SQLITE_PATH") or SQLITE_PATH
+# Threads that run SQLite statements for the async clients (one connection each)
+SQLITE_ASYNC_WORKERS = int(os.getenv("SQLITE_ASYNC_WORKERS", "4"))
+
+
+def create_storage_client(backend: str, url: Optional[str] = None, key: Optional[str] = None,
+                          sqlite_path: Optional[str] = None) -> Any:
+    """Create a client for the given backend.
+
+    Supabase needs url + key; SQLite needs a file path (or ":memory:").
+    """
+    if backend == BACKEND_SQLITE:
+        from sqlite_store import get_sqlite_client
+        return TracedClient(get_sqlite_client(sqlite_path or SQLITE_PATH))
+    if backend == BACKEND_SUPABASE:
+        from supabase import create_client
+        return TracedClient(create_client(url, key))
+    raise RuntimeError(
+        f"Unknown storage backend {backend!r}; expected one of {', '.join(STORAGE_BACKENDS)}"
+    )
+
+
+async def create_async_storage_client(backend: str, url: Optional[str] = None,
+                                      key: Optional[str] = None,
+                                      sqlite_path: Optional[str] = None) -> Any:
+    """Async counterpart of create_storage_client.
+
+    Supabase gets an AsyncClient (one shared httpx.AsyncClient per process).
+    SQLite statements run on a small thread pool (SQLITE_ASYNC_WORKERS), so a
+    write waiting on the database lock (busy timeout) never blocks the event
+    loop.
+    """
+    if backend == BACKEND_SUPABASE:
+        from supabase import acreate_client
+        return TracedClient(await acreate_client(url, key))
+    if backend == BACKEND_SQLITE:
+        from sqlite_store import get_sqlite_client
+        return TracedClient(ThreadedClient(get_sqlite_client(sqlite_path or SQLITE_PATH)))
+    return create_storage_client(backend, url=url, key=key, sqlite_path=sqlite_path)
+
+
+# ---------- Blocking clients behind an async interface ----------
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _storage_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max(1, SQLITE_ASYNC_WORKERS),
+                                       thread_name_prefix="sqlite")
+    return _executor
+
+
+class ThreadedQuery:
+    """Wraps a blocking query builder; execute() returns an awaitable that
+    runs the query on the storage thread pool."""
+
+    __slots__ = ("_builder",)
+
+    def __init__(self, builder: Any):
+        self._builder = builder
+
+    def execute(self) -> Any:
+        context = contextvars.copy_context()
+        return asyncio.get_running_loop().run_in_executor(
+            _storage_executor(), context.run, self._builder.execute
+        )
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._builder, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args: Any, **kwargs: Any) -> Any:
+            result = attr(*args, **kwargs)
+            if hasattr(result, "execute"):
+                return ThreadedQuery(result)
+            return result
+        return call
+
+
+class ThreadedClient:
+    """Async view of a blocking client (used for SQLite)."""
+
+    def __init__(self, client: Any):
+        self.client = client
+
+    def table(self, name: str) -> ThreadedQuery:
+        return ThreadedQuery(self.client.table(name))
+
+    def rpc(self, fn: str, params: Optional[dict] = None) -> ThreadedQuery:
+        return ThreadedQuery(self.client.rpc(fn, params or {}))
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
+
+
+# ---------- Running storage operations ----------
+
+T = TypeVar("T")
+
+# A storage operation: yields query builders, is sent their executed responses
+StorageOp = Generator[Any, Any, T]
+
+
+class BlockingCall:
+    """Local blocking work yielded by a storage operation like a query."""
+
+    __slots__ = ("fn", "args")
+
+    def __init__(self, fn: Callable[..., Any], *args: Any):
+        self.fn = fn
+        self.args = args
+
+    def execute(self) -> Any:
+        return self.fn(*self.args)
+
+
+def run_sync(op: StorageOp[T]) -> T:
+    """Run a storage operation, executing each yielded query synchronously."""
+    try:
+        query = next(op)
+        while True:
+            try:
+                result = query.execute()
+            except Exception as e:
+                query = op.throw(e)
+            else:
+                query = op.send(result)
+    except StopIteration as done:
+        return done.value
+
+
+async def run_async(op: StorageOp[T]) -> T:
+    """Run a storage operation, awaiting each yielded query when it is async."""
+    try:
+        query = next(op)
+        while True:
+            try:
+                if isinstance(query, BlockingCall):
+                    result = await asyncio.to_thread(query.execute)
+                else:
+                    result = query.execute()
+                if inspect.isawaitable(result):
+                    result = await result
+            except Exception as e:
+                query = op.throw(e)
+            else:
+                query = op.send(result)
+    except StopIteration as done:
+        return done.value
+
+
+# ---------- Storage call tracing ----------
+
+class StorageCallCounter:
+    """Number of storage calls made while the counter is active."""
+
+    __slots__ = ("count",)
+
+    def __init__(self) -> None:
+        self.count = 0
+
+
+_call_counter: ContextVar[Optional[StorageCallCounter]] = ContextVar(
+    "storage_call_counter", default=None
+)
+
+
+@contextmanager
+def count_storage_calls() -> Iterator[StorageCallCounter]:
+    """Count storage calls made in this context (and threads/tasks it spawns)."""
+    counter = StorageCallCounter()
+    token = _call_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _call_counter.reset(token)
+
+
+def record_storage_call(table: str, op: str, seconds: float) -> None:
+    counter = _call_counter.get()
+    if counter is not None:
+        counter.count += 1
+    observe_storage_call(table, op, seconds)
+
+
+_OPERATIONS = ("select", "insert", "upsert", "update", "delete")
+
+
+class TracedQuery:
+    """Wraps a query builder; records one storage call per execute()."""
+
+    __slots__ = ("_builder", "_table", "_op")
+
+    def __init__(self, builder: Any, table: str, op: Optional[str] = None):
+        self._builder = builder
+        self._table = table
+        self._op = op
+
+    def execute(self) -> Any:
+        start = time.perf_counter()
+        try:
+            result = self._builder.execute()
+        except Exception:
+            self._record(start)
+            raise
+        if inspect.isawaitable(result):
+            return self._execute_async(result, start)
+        self._record(start)
+        return result
+
+    async def _execute_async(self, pending: Any, start: float) -> Any:
+        try:
+            return await pending
+        finally:
+            self._record(start)
+
+    def _record(self, start: float) -> None:
+        record_storage_call(self._table, self._op or "select", time.perf_counter() - start)
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._builder, name)
+        if not callable(attr):
+            return attr
+        op = self._op or (name if name in _OPERATIONS else None)
+
+        def call(*args: Any, **kwargs: Any) -> Any:
+            result = attr(*args, **kwargs)
+            if hasattr(result, "execute"):
+                return TracedQuery(result, self._table, op)
+            return result
+        return call
+
+
+class TracedClient:
+    """Storage client wrapper that traces table() and rpc() calls."""
+
+    def __init__(self, client: Any):
+        self.client = client
+
+    def table(self, name: str) -> TracedQuery:
+        return TracedQuery(self.client.table(name), name)
+
+    def rpc(self, fn: str, params: Optional[dict] = None) -> TracedQuery:
+        return TracedQuery(self.client.rpc(fn, params or {}), fn, "rpc")
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
@@ -0,0 +1,78 @@
+"""Storage-call budget of the bank endpoints (X-Storage-Calls, SQLite backend)."""
+import random
+
+from bank_db import add_balance, create_bank_card
+from middleware import STORAGE_CALLS_HEADER
+
+
+def _new_card(balance: float = 500.0) -> dict:
+    number = "".join(random.choice("0123456789") for _ in range(16))
+    return create_bank_card(number, "Test Holder", "12-34-56", number[-8:], balance=balance)
+
+
+def _payment(card: dict, amount: float) -> dict:
+    return {
+        "account_number": card["card_number"],
+        "card_holder_name": card["card_holder_name"],
+        "cvv": card["card_number"][-3:],
+        "expiry_date": "12/28",
+        "amount": amount,
+    }
+
+
+def test_process_payment_is_one_lookup_and_one_debit(client):
+    card = _new_card()
+    res = client.post("/api/bank/process-payment", json=_payment(card, 25.0))
+
+    assert res.status_code == 200
+    assert res.json()["success"] is True
+    assert res.json()["new_balance"] == 475.0
+    # Card lookup (cold cache) + conditional debit
+    assert res.headers[STORAGE_CALLS_HEADER] == "2"
+
+
+def test_process_payment_with_cached_card_is_one_debit(client):
+    card = _new_card()
+    client.get(f"/api/bank/balance/{card['card_number']}")
+
+    res = client.post("/api/bank/process-payment", json=_payment(card, 25.0))
+    assert res.json()["success"] is True
+    assert res.headers[STORAGE_CALLS_HEADER] == "1"
+
+
+def test_balance_is_served_from_the_card_cache(client):
+    card = _new_card()
+    cold = client.get(f"/api/bank/balance/{card['card_number']}")
+    assert cold.headers[STORAGE_CALLS_HEADER] == "1"
+
+    warm = client.get(f"/api/bank/balance/{card['card_number']}")
+    assert warm.status_code == 200
+    assert warm.json()["balance"] == 500.0
+    assert warm.headers[STORAGE_CALLS_HEADER] == "0"
+
+
+def test_balance_after_payment_is_a_cache_hit(client):
+    card = _new_card()
+    client.post("/api/bank/process-payment", json=_payment(card, 100.0))
+
+    res = client.get(f"/api/bank/balance/{card['card_number']}")
+    assert res.json()["balance"] == 400.0
+    assert res.headers[STORAGE_CALLS_HEADER] == "0"
+
+
+def test_declined_payment_is_not_replayed_for_the_same_key(client):
+    card = _new_card(balance=10.0)
+    headers = {"Idempotency-Key": f"declined-{card['card_number']}"}
+
+    declined = client.post("/api/bank/process-payment", json=_payment(card, 50.0), headers=headers)
+    assert declined.json()["success"] is False
+
+    add_balance(card["card_number"], 100.0)
+    retried = client.post("/api/bank/process-payment", json=_payment(card, 50.0), headers=headers)
+    assert retried.json()["success"] is True
+    assert retried.json()["new_balance"] == 60.0
+    assert "idempotent-replayed" not in retried.headers
+
+    replayed = client.post("/api/bank/process-payment", json=_payment(card, 50.0), headers=headers)
+    assert replayed.headers["idempotent-replayed"] == "true"
+    assert replayed.json() == retried.json()
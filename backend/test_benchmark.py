@@ -0,0 +1,65 @@
+"""Tests for the benchmark report maths (no app or database needed)."""
+import pytest
+
+import benchmark
+
+
+def test_percentile_is_nearest_rank():
+    values = [float(v) for v in range(1, 101)]
+    assert benchmark.percentile(values, 50) == 50.0
+    assert benchmark.percentile(values, 95) == 95.0
+    assert benchmark.percentile(values, 99) == 99.0
+    assert benchmark.percentile(values, 100) == 100.0
+
+
+def test_percentile_of_small_lists():
+    ten = [float(v) for v in range(1, 11)]
+    assert benchmark.percentile(ten, 50) == 5.0
+    assert benchmark.percentile(ten, 95) == 10.0
+    assert benchmark.percentile([7.0], 99) == 7.0
+    assert benchmark.percentile([], 95) == 0.0
+
+
+def test_summarize_counts_errors_and_percentiles():
+    samples = [(float(ms), 500 if ms == 100 else 200) for ms in range(1, 101)]
+    s = benchmark.summarize(samples, wall_seconds=2.0)
+
+    assert s["count"] == 100
+    assert s["errors"] == 1
+    assert s["throughput_rps"] == 50.0
+    assert (s["p50_ms"], s["p95_ms"], s["p99_ms"], s["max_ms"]) == (50.0, 95.0, 99.0, 100.0)
+
+
+def test_parse_mix():
+    assert benchmark.parse_mix("checkout=4, redeem=2,leaderboard") == {
+        "checkout": 4, "redeem": 2, "leaderboard": 1,
+    }
+
+
+def test_parse_mix_rejects_unknown_and_empty_mixes():
+    with pytest.raises(SystemExit, match="Unknown workload"):
+        benchmark.parse_mix("checkout=1,nope=2")
+    with pytest.raises(SystemExit, match="positive weight"):
+        benchmark.parse_mix("checkout=0")
+
+
+def _report(**p95: float) -> dict:
+    return {"routes": {route: {"p95_ms": ms} for route, ms in p95.items()}}
+
+
+def test_compare_passes_within_the_allowed_regression(capsys):
+    baseline = _report(pay=10.0, board=2.0)
+    assert benchmark.compare(_report(pay=11.9, board=1.0), baseline, max_regression=0.20)
+    assert "REGRESSION" not in capsys.readouterr().out
+
+
+def test_compare_flags_a_p95_regression(capsys):
+    baseline = _report(pay=10.0, board=2.0)
+    assert not benchmark.compare(_report(pay=12.5, board=2.0), baseline, max_regression=0.20)
+    out = capsys.readouterr().out
+    assert "REGRESSION" in out and "+25.0%" in out
+
+
+def test_compare_ignores_routes_missing_from_the_baseline(capsys):
+    assert benchmark.compare(_report(pay=10.0, new_route=500.0), _report(pay=10.0), max_regression=0.20)
+    assert "new" in capsys.readouterr().out
@@ -0,0 +1,35 @@
+"""Export route tests (SQLite backend, see conftest.py)."""
+from urllib.parse import quote
+
+
+def test_export_filename_is_sanitized(client):
+    user_id = 'a"b\r\nX-Injected: 1;é'
+    res = client.get(f"/api/reward/export/credit_logs/{quote(user_id, safe='')}", params={"format": "csv"})
+
+    assert res.status_code == 200
+    assert "x-injected" not in res.headers
+    assert res.headers["content-disposition"] == 'attachment; filename="credit_logs_a_b__X-Injected__1__.csv"'
+
+
+def test_credit_log_fallback_pages_by_rewards_id(client):
+    import uuid
+
+    import db
+
+    user_id = str(uuid.uuid4())
+    ids = sorted(str(uuid.uuid4()) for _ in range(5))
+    db.get_client().table(db.T_CREDITS).insert(
+        [{"id": i, "user_id": user_id, "total_credits": 10} for i in ids]
+    ).execute()
+
+    seen, after = [], None
+    while True:
+        page = db.list_credit_logs(user_id, limit=2, after=after)
+        seen.extend(row["LogID"] for row in page)
+        if len(page) < 2:
+            break
+        after = page[-1]["LogID"]
+
+    assert seen == ids
+    res = client.get(f"/api/reward/credit_logs/{user_id}", params={"limit": 2, "after": ids[1]})
+    assert [row["LogID"] for row in res.json()] == ids[2:4]
@@ -0,0 +1,43 @@
+"""Leaderboard tests (SQLite backend, see conftest.py)."""
+import db
+from leaderboard import LeaderboardEngine
+
+
+def test_redemptions_show_on_a_rebuilt_board(client, funded_user):
+    user = funded_user(2000.0, "leader")  # 100 credits
+    reward = db.create_reward("Coffee", 30, "A coffee", stock=10)
+    for _ in range(2):
+        res = client.post("/api/reward/redemptions",
+                          json={"UserID": user["UserID"], "RewardID": reward["RewardID"]})
+        assert res.status_code == 200
+
+    db._leaderboard._loaded_at = None  # force a cold-start rebuild
+    rank = client.get(f"/api/reward/leaderboard/rank/{user['UserID']}").json()
+    assert rank["TotalCreditEarned"] == 100
+    assert rank["TotalRedeemed"] == 60
+
+
+def test_rebuild_keeps_updates_recorded_during_the_scan():
+    board = LeaderboardEngine()
+    board.record_earned(1, 10)
+
+    scan = board.begin_rebuild()
+    page = [{"user_id": 1, "total_credit_earned": 10, "total_redeemed": 0, "as_of": board.position()}]
+    # Recorded after user 1's row was read, and for a user the scan never saw
+    board.record_earned(1, 5)
+    board.record_redeemed(2, 3)
+    board.rebuild(page, scan)
+
+    assert board.get(1)["total_credit_earned"] == 15
+    assert board.get(2)["total_redeemed"] == 3
+    assert board.rank(1) == 1
+
+
+def test_rebuild_does_not_double_count_updates_read_by_the_scan():
+    board = LeaderboardEngine()
+    scan = board.begin_rebuild()
+    board.record_earned(1, 5)  # committed before user 1's row was read
+    page = [{"user_id": 1, "total_credit_earned": 5, "total_redeemed": 0, "as_of": board.position()}]
+    board.rebuild(page, scan)
+
+    assert board.get(1)["total_credit_earned"] == 5
@@ -0,0 +1,26 @@
+"""Payment tests (SQLite backend, see conftest.py)."""
+import pytest
+
+import db
+
+
+def test_paying_a_bill_twice_is_rejected(new_bill):
+    bill = new_bill()
+    first = db.create_payment(bill["BillID"], 1000.0, "card")
+    assert first["CreditAwarded"] == 50
+
+    with pytest.raises(ValueError, match="Bill already paid"):
+        db.create_payment(bill["BillID"], 1000.0, "card")
+
+    assert len(db.list_payments(bill_id=bill["BillID"])) == 1
+    assert db.get_user(bill["UserID"])["CurrentCredit"] == 50
+
+
+def test_paying_a_bill_twice_over_http_is_a_conflict(client, new_bill):
+    bill = new_bill()
+    body = {"BillID": bill["BillID"], "AmountPaid": 1000.0, "PaymentMethod": "card"}
+
+    assert client.post("/api/reward/payments", json=body).status_code == 200
+    again = client.post("/api/reward/payments", json=body)
+    assert again.status_code == 409
+    assert "Bill already paid" in again.json()["detail"]
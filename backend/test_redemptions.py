@@ -0,0 +1,30 @@
+"""Redemption tests (SQLite backend, see conftest.py)."""
+import asyncio
+
+import db
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def test_credit_log_spool_append_runs_off_the_event_loop(client, monkeypatch, funded_user):
+    user = funded_user(1000.0, "redeemer")  # 50 credits
+    reward = db.create_reward("Tea", 10, "A tea", stock=5)
+
+    calls = []
+    append = db.credit_log_queue.append
+
+    def spy(row):
+        calls.append(_on_event_loop())
+        return append(row)
+
+    monkeypatch.setattr(db.credit_log_queue, "append", spy)
+    res = client.post("/api/reward/redemptions", json={"UserID": user["UserID"], "RewardID": reward["RewardID"]})
+
+    assert res.status_code == 200
+    assert calls == [False]
@@ -0,0 +1,26 @@
+"""User listing tests (SQLite backend, see conftest.py)."""
+import db
+from storage import count_storage_calls
+
+
+def test_list_users_is_one_round_trip(funded_user):
+    created = {funded_user(200.0, f"user{i}")["UserID"] for i in range(5)}
+
+    stats = {}
+    with count_storage_calls() as calls:
+        users = db.list_users(limit=1000, stats=stats)
+
+    assert stats["round_trips"] == 1
+    assert calls.count == 1
+    # Credits come from the same projected query
+    credits = {u["UserID"]: u["CurrentCredit"] for u in users if u["UserID"] in created}
+    assert credits == {user_id: 10 for user_id in created}
+
+
+def test_list_users_page_after_cursor_is_one_round_trip():
+    first = db.list_users(limit=2)
+    stats = {}
+    page = db.list_users(limit=2, after=first[-1]["UserID"], stats=stats)
+
+    assert stats["round_trips"] == 1
+    assert all(u["UserID"] > first[-1]["UserID"] for u in page)
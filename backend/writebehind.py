@@ -0,0 +1,266 @@
+"""Durable write-behind queue for append-only rows (e.g. credit_log).
+
+append() writes the row as one JSON line to a local spool file and returns;
+a background thread hands the rows to `sink` (one multi-row insert per
+`flush_rows` rows) once `flush_rows` are waiting or `flush_seconds` have
+passed. So the insert leaves the request path without rows being lost:
+
+- At flush the spool file is closed and renamed to a numbered segment; a
+  segment is deleted only after the sink accepted all of its rows. Failed
+  flushes keep the segment and are retried with exponential backoff.
+- Segments left behind by a crash are delivered when the queue next starts.
+  A row may then be sent twice, so every row carries a unique `entry_key`
+  for the sink to deduplicate on.
+- close() (FastAPI shutdown, atexit) flushes what is left.
+
+append() is blocking file I/O (write, and fsync if enabled); async callers
+run it in a worker thread (storage.BlockingCall), not on the event loop.
+
+One process owns a spool directory at a time (flock on `.lock`); other
+processes spool into `worker-<pid>/` below it, and a starting process also
+delivers the segments of worker directories whose owner has exited.
+"""
+from __future__ import annotations
+
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from typing import IO, Any, Callable, Dict, Iterable, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: no cross-process locking
+    fcntl = None  # type: ignore[assignment]
+
+Sink = Callable[[List[Dict[str, Any]]], None]
+
+MAX_BACKOFF_SECONDS = 60.0
+
+
+class WriteBehindQueue:
+    def __init__(self, name: str, spool_dir: str, sink: Sink, flush_rows: int = 500,
+                 flush_seconds: float = 1.0, fsync: bool = False):
+        self.name = name
+        self.flush_rows = max(1, flush_rows)
+        self.flush_seconds = flush_seconds
+        self.fsync = fsync
+        self._root = spool_dir
+        self._dir = spool_dir
+        self._sink = sink
+        self._cond = threading.Condition()
+        self._file: Optional[IO[str]] = None
+        self._lock_file: Optional[IO[str]] = None
+        self._thread: Optional[threading.Thread] = None
+        self._closing = False
+        self._buffered = 0  # rows in the spool file, not yet rotated
+        self._segment_seq = 0
+        self._retry_at = 0.0
+        self._backoff = 0.0
+        self.flushed = 0
+        self.failures = 0
+
+    # ---------- Producer side ----------
+
+    def append(self, row: Dict[str, Any]) -> str:
+        """Spool one row for delivery; returns its entry_key."""
+        row = dict(row)
+        row.setdefault("entry_key", uuid.uuid4().hex)
+        line = json.dumps(row, default=str) + "\n"
+        with self._cond:
+            self._start_locked()
+            assert self._file is not None
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._buffered += 1
+            if self._buffered >= self.flush_rows:
+                self._cond.notify()
+        return row["entry_key"]
+
+    def start(self) -> None:
+        """Open the spool and start the flusher (append() does this lazily)."""
+        with self._cond:
+            self._start_locked()
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Stop the flusher after delivering everything spooled so far."""
+        with self._cond:
+            thread = self._thread
+            if thread is None:
+                return
+            self._closing = True
+            self._retry_at = 0.0
+            self._cond.notify()
+        thread.join(timeout)
+        with self._cond:
+            if self._thread is thread and not thread.is_alive():
+                self._thread = None
+                self._closing = False
+                if self._lock_file is not None:
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def pending(self) -> int:
+        """Rows spooled but not yet delivered (counts segment files on disk)."""
+        with self._cond:
+            rows = self._buffered
+            segments = self._segments()
+        for path in segments:
+            rows += sum(1 for _ in _read_rows(path))
+        return rows
+
+    def stats(self) -> Dict[str, Any]:
+        return {"name": self.name, "flushed": self.flushed, "failures": self.failures,
+                "pending": self.pending()}
+
+    # ---------- Flusher ----------
+
+    def _start_locked(self) -> None:
+        if self._thread is not None:
+            return
+        self._dir = self._claim_dir()
+        orphans = self._orphan_dirs()
+        # Whatever a previous run left in the spool file becomes a segment
+        current = os.path.join(self._dir, "current.ndjson")
+        if os.path.exists(current) and os.path.getsize(current):
+            os.replace(current, self._next_segment_path())
+        self._file = open(current, "a", encoding="utf-8")
+        self._buffered = 0
+        self._thread = threading.Thread(target=self._run, args=(orphans,),
+                                        name=f"writebehind-{self.name}", daemon=True)
+        self._thread.start()
+
+    def _run(self, orphans: List[str]) -> None:
+        for path in orphans:
+            self._adopt(path)
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_seconds
+                while (not self._closing and self._buffered < self.flush_rows
+                       and time.monotonic() < deadline):
+                    self._cond.wait(max(0.0, deadline - time.monotonic()))
+                closing = self._closing
+                if time.monotonic() >= self._retry_at or closing:
+                    self._rotate_locked()
+                    segments = self._segments()
+                else:
+                    segments = []
+            delivered = self._deliver(segments)
+            if closing:
+                if not delivered:
+                    print(f"Warning: {self.name} write-behind queue closed with undelivered rows "
+                          f"in {self._dir}; they will be sent on the next start")
+                with self._cond:
+                    if self._file is not None:
+                        self._file.close()
+                        self._file = None
+                return
+
+    def _rotate_locked(self) -> None:
+        if not self._buffered or self._file is None:
+            return
+        self._file.close()
+        current = os.path.join(self._dir, "current.ndjson")
+        os.replace(current, self._next_segment_path())
+        self._file = open(current, "a", encoding="utf-8")
+        self._buffered = 0
+
+    def _deliver(self, segments: Iterable[str]) -> bool:
+        """Send segments oldest first; stop at the first failure."""
+        for path in segments:
+            rows = list(_read_rows(path))
+            try:
+                for i in range(0, len(rows), self.flush_rows):
+                    self._sink(rows[i:i + self.flush_rows])
+            except Exception as e:
+                self.failures += 1
+                self._backoff = min(max(self._backoff * 2, self.flush_seconds, 0.1), MAX_BACKOFF_SECONDS)
+                self._retry_at = time.monotonic() + self._backoff
+                print(f"Warning: Could not flush {self.name} rows (retrying in {self._backoff:.1f}s): {e}")
+                return False
+            os.remove(path)
+            self.flushed += len(rows)
+            self._backoff = 0.0
+        return True
+
+    # ---------- Spool files ----------
+
+    def _next_segment_path(self) -> str:
+        self._segment_seq += 1
+        return os.path.join(self._dir, f"{time.time_ns():020d}-{self._segment_seq:06d}.seg")
+
+    def _segments(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self._dir, "*.seg")))
+
+    def _claim_dir(self) -> str:
+        """Lock the spool directory, or a worker-<pid> directory below it."""
+        os.makedirs(self._root, exist_ok=True)
+        if fcntl is None:
+            return self._root
+        for path in (self._root, os.path.join(self._root, f"worker-{os.getpid()}")):
+            os.makedirs(path, exist_ok=True)
+            lock_file = open(os.path.join(path, ".lock"), "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                continue
+            self._lock_file = lock_file
+            return path
+        raise RuntimeError(f"Could not lock a {self.name} spool directory under {self._root}")
+
+    def _orphan_dirs(self) -> List[str]:
+        """worker-* directories whose owning process is gone (lock is free)."""
+        if fcntl is None:
+            return []
+        orphans = []
+        for path in sorted(glob.glob(os.path.join(self._root, "worker-*"))):
+            if path == self._dir:
+                continue
+            with open(os.path.join(path, ".lock"), "a") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue
+                current = os.path.join(path, "current.ndjson")
+                if os.path.exists(current) and os.path.getsize(current):
+                    os.replace(current, os.path.join(path, f"{time.time_ns():020d}-orphan.seg"))
+                orphans.append(path)
+        return orphans
+
+    def _adopt(self, path: str) -> None:
+        """Move an orphaned worker directory's segments into ours, then remove it."""
+        for segment in sorted(glob.glob(os.path.join(path, "*.seg"))):
+            try:
+                os.replace(segment, self._next_segment_path())
+            except FileNotFoundError:
+                pass  # another process adopted it first
+        for leftover in (".lock", "current.ndjson"):
+            try:
+                os.remove(os.path.join(path, leftover))
+            except OSError:
+                pass
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+
+
+def _read_rows(path: str) -> Iterable[Dict[str, Any]]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # A torn last line from a crash mid-write
+                    print(f"Warning: Skipping unreadable spooled row in {path}")
+    except FileNotFoundError:
+        return